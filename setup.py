@@ -5,8 +5,8 @@ import os
 import time
 import shutil
 
-from distutils.core import setup, Extension
-from distutils.command.build_ext import build_ext
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
 
 
 class custom_build_app(build_ext):
@@ -58,7 +58,11 @@ setup(
     author='Frank Scherbaum and Marius Kriegerowski',
     package_dir={'pytch': 'src'},
     packages=['pytch'],
-    scripts=['apps/pytch'],
+    scripts=['apps/pytch', 'apps/pytch-batch'],
+    # os.pwrite, multiprocessing.shared_memory, contextlib.nullcontext
+    python_requires='>=3.8',
+    # sliding_window_view, scipy.fft with workers
+    install_requires=['numpy>=1.20', 'scipy>=1.4'],
     cmdclass={
         'py2app': custom_build_app,
     },
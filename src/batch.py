@@ -0,0 +1,183 @@
+''' Headless pitch analysis of recorded WAV files.
+
+Runs the :py:class:`pytch.data.Channel` / :py:class:`pytch.two_channel_tuner.Worker`
+pipeline without importing Qt. Files are spread across a process pool.'''
+import os
+import glob
+import time
+import logging
+import numpy as num
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pytch.data import WavFileProvider, SegmentedBuffer
+from pytch.synthetic import SyntheticProvider
+from pytch.two_channel_tuner import Worker
+
+
+logger = logging.getLogger(__name__)
+
+
+def output_filenames(fn, outdir, ichannel):
+    ''' Names of the pitch and spectrum files written for channel
+    *ichannel* of *fn*'''
+    base = os.path.join(
+        outdir, '%s.channel%i' % (os.path.splitext(os.path.basename(fn))[0],
+                                  ichannel))
+    return base + '.pitch.txt', base + '.spectrum.txt'
+
+
+def analyse_provider(provider, name, outdir, algorithm='yin',
+                     buffer_dir=None, pitch_workers=None):
+    ''' Analyse all channels of the unthrottled, finite *provider* and
+    write the results to *outdir*.
+
+    For each channel two text files are written:
+    *<name>.channel<i>.pitch.txt* with columns time [s], pitch [Hz],
+    confidence and spectral centroid [Hz] per analysis frame, and
+    *<name>.channel<i>.spectrum.txt* with columns frequency [Hz] and mean
+    power.
+
+    :param buffer_dir: if given, results of long inputs are moved to disk
+        in this directory until they are written
+    :param pitch_workers: number of pitch tracking processes, see
+        :py:class:`pytch.two_channel_tuner.Worker`
+    :returns: tuple of *name*, number of channels and duration in seconds'''
+    channels = provider.channels
+    for channel in channels:
+        channel.pitch_algorithm = algorithm
+
+    worker = Worker(channels, pitch_workers=pitch_workers)
+    nchannels = len(channels)
+    freqs = channels[0].freqs
+
+    results = [
+        [SegmentedBuffer(channel.analysis_rate, dtype=dtype,
+                         directory=buffer_dir)
+         for dtype in (num.float64, num.float32, num.float32, num.float32)]
+        for channel in channels]
+    spectrum_sum = num.zeros((nchannels, freqs.size))
+    nframes = 0
+
+    provider.start_new_stream()
+    try:
+        while not provider.exhausted:
+            provider.flush()
+            worker.process()
+            for ic, channel in enumerate(channels):
+                istop = channel.pitch.i_filled
+                n = istop - nframes
+                spectra = channel.fft.latest_frame_data(n)
+                power = num.sum(spectra, axis=1)
+                centroid = num.sum(freqs * spectra, axis=1) / num.where(
+                    power > 0., power, 1.)
+                spectrum_sum[ic] += num.sum(spectra, axis=0)
+                # time within the input, not the capture time of the replay
+                times = num.arange(nframes, istop) * channel.pitch.delta + \
+                    channel.pitch.time_origin
+                for b, d in zip(results[ic], (
+                        times,
+                        channel.undo_pitch_proxy(
+                            channel.pitch.latest_frame_data(n)),
+                        channel.pitch_confidence.latest_frame_data(n),
+                        centroid)):
+                    b.append(d)
+
+            nframes = channels[0].pitch.i_filled
+    finally:
+        worker.close()
+
+    for ic in range(nchannels):
+        fn_pitch, fn_spectrum = output_filenames(name, outdir, ic)
+        num.savetxt(
+            fn_pitch,
+            num.vstack([b.data for b in results[ic]]).T,
+            header='time[s] pitch[Hz] confidence centroid[Hz]')
+        num.savetxt(
+            fn_spectrum,
+            num.vstack((freqs, spectrum_sum[ic] / max(nframes, 1))).T,
+            header='frequency[Hz] power')
+
+    return name, nchannels, provider.nframes * provider.deltat
+
+
+def analyse_file(fn, outdir, fftsize=2048, algorithm='yin', buffer_dir=None,
+                 pitch_workers=None):
+    ''' Analyse all channels of the wav file *fn*. See
+    :py:func:`analyse_provider`.'''
+    provider = WavFileProvider(fn, fftsize=fftsize, realtime=False)
+    return analyse_provider(provider, fn, outdir, algorithm=algorithm,
+                            buffer_dir=buffer_dir, pitch_workers=pitch_workers)
+
+
+def analyse_synthetic(nchannels, duration, outdir, seed=0, fftsize=2048,
+                      algorithm='yin', buffer_dir=None, pitch_workers=None):
+    ''' Analyse *duration* seconds of *nchannels* synthetic voices. See
+    :py:func:`analyse_provider`.'''
+    provider = SyntheticProvider(
+        nchannels=nchannels, fftsize=fftsize, seed=seed, duration=duration,
+        realtime=False)
+    return analyse_provider(
+        provider, 'synthetic%i' % seed, outdir, algorithm=algorithm,
+        buffer_dir=buffer_dir, pitch_workers=pitch_workers)
+
+
+def process_directory(directory, outdir, nworkers=None, pattern='*.wav',
+                      **kwargs):
+    ''' Analyse all files matching *pattern* in *directory* using a pool of
+    *nworkers* processes (default: number of cores).
+
+    Further keyword arguments are passed to :py:func:`analyse_file`.
+
+    :returns: list of the return values of :py:func:`analyse_file` of all
+        files which were processed successfully'''
+    fns = sorted(glob.glob(os.path.join(directory, pattern)))
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    results = []
+    t0 = time.time()
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        futures = dict(
+            (executor.submit(analyse_file, fn, outdir, **kwargs), fn)
+            for fn in fns)
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error('%s failed: %s' % (futures[future], e))
+                continue
+
+            logger.info('finished %s (%i channels, %.1f s)' % result)
+            results.append(result)
+
+    duration = sum(r[2] for r in results)
+    logger.info('processed %.1f s of audio in %.1f s' % (
+        duration, time.time()-t0))
+    return results
+
+
+def from_command_line(directory, outdir=None, nworkers=None, pattern='*.wav',
+                      fftsize=2048, algorithm='yin', synthetic=None,
+                      duration=60., seed=0, buffer_dir=None,
+                      pitch_workers=None):
+    ''' Start a batch run from command line'''
+    if synthetic:
+        outdir = outdir or '.'
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+
+        t0 = time.time()
+        result = analyse_synthetic(
+            synthetic, duration, outdir, seed=seed, fftsize=fftsize,
+            algorithm=algorithm, buffer_dir=buffer_dir,
+            pitch_workers=pitch_workers)
+        logger.info('processed %i channels x %.1f s in %.1f s' % (
+            synthetic, duration, time.time()-t0))
+        return [result]
+
+    return process_directory(
+        directory, outdir or directory, nworkers=nworkers, pattern=pattern,
+        fftsize=fftsize, algorithm=algorithm, buffer_dir=buffer_dir,
+        pitch_workers=pitch_workers)
@@ -1,6 +1,9 @@
 import os
-import threading
+import mmap
+import time
 import atexit
+import threading
+import tempfile
 import numpy as num
 import logging
 import pyaudio
@@ -8,85 +11,309 @@ import pyaudio
 from scipy.io import wavfile
 from aubio import pitch
 from pytch.kalman import Kalman
+from pytch.recorder import WavRecorder
 from pytch.util import f2cent, cent2f
+from pytch.yin import YinDetector
 
 
-_lock = threading.Lock()
-
 # class taken from the scipy 2015 vispy talk opening example
 # see https://github.com/vispy/vispy/pull/928
 
 logger = logging.getLogger(__name__)
 
 pitch_algorithms = [
-    'default', 'schmitt', 'fcomb', 'mcomb', 'specacf', 'yin', 'yinfft']
+    'default', 'schmitt', 'fcomb', 'mcomb', 'specacf', 'yin', 'yinfft',
+    'numpy-yin']
 
 
-def get_audio_devices():
-    ''' returns a list of device descriptions'''
-    p = pyaudio.PyAudio()
-    devices = []
-    for i in range(p.get_device_count()):
-        devices.append(p.get_device_info_by_index(i).get('name'))
-    p.terminate()
-    return devices
+def make_pitch_detector(algorithm, fftsize, hopsize, sampling_rate,
+                        tolerance=0.8):
+    ''' aubio pitch detector over windows of *fftsize*, fed with *hopsize*
+    new samples per call and returning Hz. *numpy-yin* gives a
+    :py:class:`pytch.yin.YinDetector`.'''
+    if algorithm == 'numpy-yin':
+        pitch_o = YinDetector(fftsize, hopsize, sampling_rate)
+    else:
+        pitch_o = pitch(algorithm, fftsize, hopsize, sampling_rate)
 
+    pitch_o.set_unit("Hz")
+    pitch_o.set_tolerance(tolerance)
+    return pitch_o
 
-def sampling_rate_options(device_no, audio=None):
-    ''' list of supported sampling rates.'''
-    candidates = [8000., 11.025, 123123123123., 16000., 22050., 32000., 37.800,
-                  44100., 48000.]
-    supported_sampling_rates = []
-    for c in candidates:
-        if check_sampling_rate(device_no, int(c), audio=audio):
-            supported_sampling_rates.append(c)
 
-    return supported_sampling_rates
+candidate_sampling_rates = [
+    8000, 11025, 16000, 22050, 32000, 44100, 48000, 88200, 96000]
+
+# PortAudio is not thread safe. Initialization, device queries and opening
+# or closing streams are serialized through this lock.
+portaudio_lock = threading.RLock()
 
 
 def check_sampling_rate(device_index, sampling_rate, audio=None):
-    p = audio or pyaudio.PyAudio()
-    devinfo = p.get_device_info_by_index(device_index)
-    valid = False
-    try:
-        p.is_format_supported(
-            sampling_rate,
-            input_device=devinfo['index'],
-            input_channels=devinfo['maxinputchannels'],
-            input_format=pyaudio.paint16)
-    except ValueError as e:
-        logger.debug(e)
-        valid = False
-
-    finally:
-        if not audio:
-            p.terminate()
-        return valid
+    ''' True if input device *device_index* supports *sampling_rate* with
+    int16 samples and all of its input channels.'''
+    with portaudio_lock:
+        p = audio or pyaudio.PyAudio()
+        try:
+            devinfo = p.get_device_info_by_index(device_index)
+            return bool(p.is_format_supported(
+                sampling_rate,
+                input_device=devinfo['index'],
+                input_channels=max(devinfo['maxInputChannels'], 1),
+                input_format=pyaudio.paInt16))
+        except ValueError as e:
+            logger.debug(e)
+            return False
+        finally:
+            if not audio:
+                p.terminate()
+
+
+class DeviceRegistry(object):
+    ''' Cache of the available audio devices and their supported input
+    sampling rates.
+
+    Probing PortAudio is slow, mostly because every candidate sampling rate
+    has to be tested on every device. :py:meth:`refresh` therefore probes in
+    a background thread using a single :py:class:`pyaudio.PyAudio` instance
+    and callers read the cached results. The probe holds
+    :py:data:`portaudio_lock`, so streams are only opened once it finished.'''
+
+    def __init__(self):
+        self.devices = []
+        self.default_index = None
+        self._sampling_rates = {}
+        self._probed = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def probed(self):
+        return self._probed.is_set()
+
+    def refresh(self, callback=None):
+        ''' Probe devices in a background thread.
+
+        Until the probe finished, :py:attr:`probed` is False and
+        :py:meth:`wait` blocks, while the results of the previous probe
+        remain readable.
+
+        :param callback: called without arguments from the probing thread
+            when probing finished, before :py:meth:`wait` returns. Qt widgets
+            should connect it to a signal.'''
+        with self._lock:
+            if callback is not None:
+                self._callbacks.append(callback)
+
+            if self._thread is not None:
+                return
+
+            self._probed.clear()
+            self._thread = threading.Thread(
+                target=self._probe, name='pytch-device-probe')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _probe(self):
+        t0 = time.time()
+        p = None
+        try:
+            with portaudio_lock:
+                p = pyaudio.PyAudio()
+                devices = [p.get_device_info_by_index(i)
+                           for i in range(p.get_device_count())]
+                try:
+                    default_index = p.get_default_input_device_info()['index']
+                except IOError:
+                    default_index = None
+
+                sampling_rates = {}
+                for device in devices:
+                    if device['maxInputChannels'] > 0:
+                        sampling_rates[device['index']] = [
+                            rate for rate in candidate_sampling_rates
+                            if check_sampling_rate(
+                                device['index'], rate, audio=p)]
+        except Exception as e:
+            logger.warning('probing audio devices failed: %s' % e)
+            devices, default_index, sampling_rates = [], None, {}
+        finally:
+            if p is not None:
+                with portaudio_lock:
+                    p.terminate()
+
+        with self._lock:
+            self.devices = devices
+            self.default_index = default_index
+            self._sampling_rates = sampling_rates
+
+        logger.debug('probed %i audio devices in %.2f s' % (
+            len(devices), time.time()-t0))
+        while True:
+            # callbacks registered meanwhile see the same results
+            with self._lock:
+                callbacks = self._callbacks
+                self._callbacks = []
+                if not callbacks:
+                    self._thread = None
+                    self._probed.set()
+                    break
+
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error('device probe callback failed: %s' % e)
+
+    def wait(self, timeout=None):
+        ''' Block until the current probe finished, starting one if devices
+        were never probed.'''
+        if not self.probed:
+            self.refresh()
+        return self._probed.wait(timeout)
+
+    def device_names(self):
+        return [device['name'] for device in self.devices]
+
+    def sampling_rates(self, device_index):
+        ''' Cached supported input sampling rates of *device_index*.'''
+        return self._sampling_rates.get(device_index, [])
+
+
+device_registry = DeviceRegistry()
+
+
+def get_audio_devices():
+    ''' returns a list of device descriptions'''
+    device_registry.wait()
+    return device_registry.device_names()
+
+
+def sampling_rate_options(device_no, audio=None):
+    ''' list of supported sampling rates.
+
+    Uses the :py:data:`device_registry` cache unless an open *audio*
+    instance is given to probe with.'''
+    if audio is None:
+        device_registry.wait()
+        return device_registry.sampling_rates(device_no)
+
+    return [rate for rate in candidate_sampling_rates
+            if check_sampling_rate(device_no, rate, audio=audio)]
+
+
+class MappedFile(object):
+    ''' Anonymous temporary file in *directory* (default: the system's temp
+    dir) holding several memory mapped arrays.
+
+    Each mapping holds a file descriptor of its own, so arrays are not
+    mapped one by one. They are placed in chunks of the file which are
+    mapped as a whole, each chunk at least twice as large as the one before.
+    Space which is not written to is not allocated on disk. The file is
+    closed once this object and its arrays are gone.'''
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.file = None
+        self.size = 0
+        self.chunk = None
+        self.used = 0
+
+    def array(self, shape, dtype):
+        ''' Return a zeroed array of *shape* placed in the file.'''
+        dtype = num.dtype(dtype)
+        nbytes = max(int(num.prod(shape)) * dtype.itemsize, 1)
+        offset = -(-self.used // 64) * 64
+        if self.chunk is None or offset + nbytes > len(self.chunk):
+            if self.file is None:
+                self.file = tempfile.TemporaryFile(dir=self.directory,
+                                                   prefix='pytch-')
+
+            granularity = mmap.ALLOCATIONGRANULARITY
+            size = max(nbytes, 2*len(self.chunk or b''))
+            size = -(-size // granularity) * granularity
+            os.ftruncate(self.file.fileno(), self.size + size)
+            self.chunk = mmap.mmap(self.file.fileno(), size, offset=self.size)
+            self.size += size
+            offset = 0
+
+        self.used = offset + nbytes
+        array = num.ndarray.__new__(num.memmap, shape, dtype=dtype,
+                                    buffer=self.chunk, offset=offset)
+        # as set up by num.memmap, views keep the memmap type
+        array._mmap = self.chunk
+        array.offset = offset
+        array.mode = 'r+'
+        return array
+
+
+def memmap_array(shape, dtype, directory=None):
+    ''' Return an array of *shape* backed by an anonymous temporary file in
+    *directory* (default: the system's temp dir). If *directory* is a
+    :py:class:`MappedFile`, the array is placed in that file.
+
+    Pages are loaded and evicted by the OS page cache, so the array may be
+    much larger than the memory that is actually resident.'''
+    if not isinstance(directory, MappedFile):
+        directory = MappedFile(directory)
+
+    return directory.array(shape, dtype)
 
 
 class Buffer():
 
     ''' data container
 
-    new data is prepended, so that the latest data point is in self.data[0]'''
+    new data is prepended, so that the latest data point is in self.data[0]
+
+    :param directory: if given, data is stored in a memory mapped file in
+        this directory instead of anonymous memory. May be a
+        :py:class:`MappedFile` shared with other buffers.'''
     def __init__(self, sampling_rate, buffer_length_seconds, dtype=num.float32,
-                 tmin=0, proxy=None):
+                 tmin=0, proxy=None, directory=None):
         self.tmin = tmin
         self.tmax = self.tmin + buffer_length_seconds
         self.sampling_rate = sampling_rate
         self.data_len = int(buffer_length_seconds * sampling_rate)
         self.dtype = dtype
+        self.directory = directory
+        self.time_index = None
         self.empty()
         self.i_filled = 0
-        self._x = num.arange(self.data_len, dtype=self.dtype) * self.delta + self.tmin
         self.proxy = self._proxy if not proxy else proxy
 
     def _proxy(self, data):
         return data
 
+    def allocate(self, shape):
+        ''' Return an uninitialized data array of *shape*.'''
+        if self.directory is not None:
+            return memmap_array(shape, self.dtype, self.directory)
+
+        return num.empty(shape, dtype=self.dtype)
+
     def empty(self):
-        self.data = num.empty((int(self.data_len)),
-                          dtype=self.dtype)
+        self.data = self.allocate((int(self.data_len), ))
+
+    @property
+    def time_origin(self):
+        ''' Time of the sample with index 0. Sample *i* is at
+        ``time_origin + i * delta``.'''
+        return self.tmin
+
+    @property
+    def anchored(self):
+        ''' True if times are capture times taken from :py:attr:`time_index`
+        instead of the nominal times given by :py:attr:`time_origin`.'''
+        return self.time_index is not None and self.time_index.n > 0
+
+    def xaxis(self, istart, istop):
+        ''' Times of the samples with indices *istart* to *istop*
+        (exclusive).'''
+        if self.anchored:
+            return self.time_index.time_at(num.arange(istart, istop))
+
+        return num.arange(istart, istop) * self.delta + self.time_origin
 
     def save_as(self, fn, fmt='txt'):
         fn = fn + '.' + fmt
@@ -117,39 +344,88 @@ class Buffer():
     def delta(self):
         return 1./self.sampling_rate
 
+    @property
+    def nbytes(self):
+        ''' Size of the data storage in bytes.'''
+        return self.data.nbytes
+
     @property
     def ydata(self):
         return self.proxy(self.data[:self.i_filled])
 
     @property
     def xdata(self):
-        return self._x[:self.i_filled]
+        return self.xaxis(0, self.i_filled)
 
     def index_at_time(self, t):
         ''' Get the index of the sample (closest) defined by *t* '''
-        return int((t-self.tmin) * self.sampling_rate)
+        if self.anchored:
+            return int(self.time_index.index_at(t))
+
+        return int((t-self.time_origin) * self.sampling_rate)
 
     def latest_indices(self, seconds):
         return self.i_filled-int(min(
             seconds * self.sampling_rate, self.i_filled)), self.i_filled
 
+    @property
+    def retained_indices(self):
+        ''' Indices *istart*, *istop* (exclusive) of the samples held.'''
+        return 0, self.i_filled
+
+    def slice_indices(self, t0, t1):
+        ''' Indices *istart*, *istop* (exclusive) of the held samples with
+        times from *t0* to *t1*, both included.'''
+        if self.anchored:
+            istart, istop = self.time_index.index_range(t0, t1)
+        else:
+            f0, f1 = (num.array((t0, t1), dtype=num.float64) -
+                      self.time_origin) * self.sampling_rate
+            istart = int(num.ceil(f0 - 1e-6))
+            istop = int(num.floor(f1 + 1e-6)) + 1
+
+        ifirst, ilast = self.retained_indices
+        istart = min(max(istart, ifirst), ilast)
+        istop = min(max(istop, istart), ilast)
+        return istart, istop
+
+    def slice_view(self, istart, istop):
+        ''' Stored samples *istart* to *istop* (exclusive) within
+        :py:attr:`retained_indices`, as view if possible.'''
+        return self.data[istart: istop]
+
+    def slice_time(self, t0, t1):
+        ''' Samples with times from *t0* to *t1* as x and y data tuple.
+        Parts of the range which are not held are left out.'''
+        istart, istop = self.slice_indices(t0, t1)
+        return (self.xaxis(istart, istop),
+                self.proxy(self.slice_view(istart, istop)))
+
     def latest_frame(self, seconds):
         ''' Return the latest *seconds* data from buffer as x and y data tuple.'''
         istart, istop = self.latest_indices(seconds)
-        return (self._x[istart: istop], self.proxy(self.data[istart: istop]))
+        return (self.xaxis(istart, istop), self.proxy(self.data[istart: istop]))
 
     def latest_frame_data(self, n):
         ''' Return the latest n samples data from buffer as array.'''
         return self.proxy(self.data[max(self.i_filled-n, 0): self.i_filled])
 
+    def check_space(self, n):
+        if self.i_filled + n > self.data_len:
+            raise ValueError(
+                'buffer full: cannot append %i to %i of %i samples' % (
+                    n, self.i_filled, self.data_len))
+
     def append(self, d):
         ''' Append data frame *d* to Buffer'''
         n = d.shape[0]
+        self.check_space(n)
         self.data[self.i_filled:self.i_filled+n] = d
         self.i_filled += n
 
     def append_value(self, v):
-        self.data[self.i_filled+1] = v
+        self.check_space(1)
+        self.data[self.i_filled] = v
         self.i_filled += 1
 
     #def energy(self, nsamples_total, nsamples_sum=1):
@@ -160,58 +436,325 @@ class Buffer():
 
 
 
+class SegmentedBuffer(Buffer):
+    ''' Linear buffer which grows by fixed size segments.
+
+    Appending never reallocates or copies data already stored. Reads
+    within one resident segment return views, reads across segment borders
+    or from disk are copies.
+
+    :param segment_seconds: length of a segment
+    :param directory: if given, segments older than the *max_resident*
+        latest ones are moved to one temporary file in this directory, so
+        that a buffer holds a single file descriptor however long it grows
+    :param max_resident: number of latest segments kept in memory'''
+    def __init__(self, sampling_rate, segment_seconds=60., dtype=num.float32,
+                 tmin=0, proxy=None, directory=None, max_resident=2):
+        self.segments = []
+        self.max_resident = max_resident
+        self.n_spilled = 0
+        self.spill_file = None
+        Buffer.__init__(self, sampling_rate, segment_seconds, dtype=dtype,
+                        tmin=tmin, proxy=proxy, directory=directory)
+
+    def empty(self):
+        self.segments = []
+        self.n_spilled = 0
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    @property
+    def segment_len(self):
+        return self.data_len
+
+    @property
+    def nbytes(self):
+        ''' Size of the segments held in memory in bytes.'''
+        return sum(s.nbytes for s in self.segments[self.n_spilled:])
+
+    def add_segment(self):
+        self.segments.append(num.empty(self.data_len, dtype=self.dtype))
+        if self.directory is None:
+            return
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(
+                dir=self.directory, prefix='pytch-')
+
+        while len(self.segments) - self.n_spilled > self.max_resident:
+            # segments are written in order, at offset n_spilled
+            os.pwrite(self.spill_file.fileno(),
+                      self.segments[self.n_spilled].tobytes(),
+                      self.n_spilled * self.data_len * self.itemsize)
+            self.segments[self.n_spilled] = None
+            self.n_spilled += 1
+
+    @property
+    def itemsize(self):
+        return num.dtype(self.dtype).itemsize
+
+    def read_segment(self, iseg, istart, istop):
+        ''' Samples *istart* to *istop* (exclusive) of segment *iseg*.'''
+        segment = self.segments[iseg]
+        if segment is not None:
+            return segment[istart: istop]
+
+        itemsize = self.itemsize
+        data = os.pread(
+            self.spill_file.fileno(), (istop-istart) * itemsize,
+            (iseg*self.data_len + istart) * itemsize)
+        return num.frombuffer(data, dtype=self.dtype)
+
+    def read(self, istart, istop):
+        ''' Samples *istart* to *istop* (exclusive). A view if they lie
+        within one resident segment.'''
+        istart = max(istart, 0)
+        istop = min(istop, self.i_filled)
+        if istop <= istart:
+            return num.empty(0, dtype=self.dtype)
+
+        n = self.data_len
+        iseg_start, iseg_stop = istart // n, (istop-1) // n
+        offset = iseg_start * n
+        if iseg_start == iseg_stop:
+            return self.read_segment(
+                iseg_start, istart-offset, istop-offset)
+
+        parts = [self.read_segment(iseg_start, istart-offset, n)]
+        parts.extend(self.read_segment(iseg, 0, n)
+                     for iseg in range(iseg_start+1, iseg_stop))
+        parts.append(self.read_segment(iseg_stop, 0, istop-iseg_stop*n))
+        return num.concatenate(parts)
+
+    def slice_view(self, istart, istop):
+        return self.read(istart, istop)
+
+    @property
+    def data(self):
+        return self.read(0, self.i_filled)
+
+    @property
+    def ydata(self):
+        return self.proxy(self.read(0, self.i_filled))
+
+    def latest_frame(self, seconds):
+        istart, istop = self.latest_indices(seconds)
+        return (self.xaxis(istart, istop), self.proxy(self.read(istart, istop)))
+
+    def latest_frame_data(self, n):
+        return self.proxy(self.read(self.i_filled-n, self.i_filled))
+
+    def append(self, d):
+        n = d.shape[0]
+        i = 0
+        while i < n:
+            if self.i_filled == len(self.segments) * self.data_len:
+                self.add_segment()
+
+            offset = self.i_filled % self.data_len
+            m = min(n-i, self.data_len-offset)
+            self.segments[-1][offset: offset+m] = d[i: i+m]
+            self.i_filled += m
+            i += m
+
+    def append_value(self, v):
+        if self.i_filled == len(self.segments) * self.data_len:
+            self.add_segment()
+
+        self.segments[-1][self.i_filled % self.data_len] = v
+        self.i_filled += 1
+
+
+def seq_read(seq, read):
+    ''' Call *read* until no write guarded by the sequence counter *seq*
+    overlapped it, see :py:class:`RingBuffer`. Returns the result of the
+    last call.'''
+    while True:
+        generation = seq[0]
+        if generation % 2:
+            # write in progress
+            time.sleep(0)
+            continue
+
+        result = read()
+        if seq[0] == generation:
+            return result
+
+
 class RingBuffer(Buffer):
-    ''' Based on numpy'''
+    ''' Based on numpy
+
+    Samples are stored twice, in a mirrored array of twice the buffer
+    length, so that the latest *n* samples always form a contiguous slice.
+    :py:attr:`data` is a view of the first half.
+
+    Appends are guarded by a sequence counter (seqlock), which is odd
+    while a write is in progress. Readers on other threads use
+    :py:meth:`snapshot` to obtain consistent copies without ever blocking
+    the writer. The counter, like :py:attr:`i_filled`, is private to the
+    process, even if the samples are in a shared file.'''
     def __init__(self, *args, **kwargs):
         Buffer.__init__(self, *args, **kwargs)
+        self._xrel = num.empty(0)
+        self._seq = num.zeros(1, dtype=num.int64)
 
-    def append(self, d):
-        '''append new data d to buffer f'''
-        n = d.size
-        if n == 1:
-            self.append_value(d)
-            return
+    def empty(self):
+        self.set_storage(self.allocate((2*int(self.data_len), )))
 
-        i_filled_mod = self.i_filled % self.data_len
-        istop = i_filled_mod + n
-        if istop >= self.data_len:
-            istop_wrap = istop - self.data_len
-            iwrap = n - istop_wrap
-            self.data[i_filled_mod: ] = d[: iwrap]
-            self.data[0: istop_wrap] = d[iwrap :]
+    def set_storage(self, mirror):
+        self._mirror = mirror
+        self.data = mirror[:self.data_len]
+
+    @property
+    def nbytes(self):
+        return self._mirror.nbytes
+
+    def store(self, i, d):
+        ''' Write rows *d* at ring position *i* and their mirror position.
+        At most two slice copies per half.'''
+        n = d.shape[0]
+        m = self._mirror
+        L = self.data_len
+        m[i: i+n] = d
+        if i + n <= L:
+            m[i+L: i+L+n] = d
         else:
-            self.data[i_filled_mod: istop] = d
+            k = L - i
+            m[i+L:] = d[:k]
+            m[:n-k] = d[k:]
+
+    def append(self, d, skip=0):
+        ''' Append rows *d* along the first axis. Rows older than the
+        buffer length are dropped. :py:attr:`i_filled` only moves forward,
+        once per call.
+
+        :param skip: number of rows to leave out in front of *d*, e.g.
+            because their source was overwritten before it was read'''
+        if d.shape[0] == 0 and skip == 0:
+            return
 
-        self.i_filled += n
+        self._seq[0] += 1
+        self.append_unguarded(d, skip=skip)
+        self._seq[0] += 1
+
+    def append_unguarded(self, d, skip=0):
+        ''' Like :py:meth:`append` without touching the sequence counter.
+        For rings sharing one counter, whose appends the caller guards
+        together.'''
+        n = d.shape[0]
+        i_filled = self.i_filled + skip
+        if n > self.data_len:
+            i_filled += n - self.data_len
+            d = d[-self.data_len:]
+            n = self.data_len
+
+        self.store(i_filled % self.data_len, d)
+        self.i_filled = i_filled + n
 
     def append_value(self, v):
-        self.data[self.i_filled % self.data_len] = v
+        ''' Append a single row *v*.'''
+        self._seq[0] += 1
+        i = self.i_filled % self.data_len
+        self._mirror[i] = v
+        self._mirror[i+self.data_len] = v
         self.i_filled += 1
+        self._seq[0] += 1
+
+    def append_fill(self, n, v):
+        ''' Append *n* rows set to *v*, given in storage format.'''
+        RingBuffer.append(self, num.broadcast_to(
+            num.asarray(v, dtype=self.dtype), (n,) + self._mirror.shape[1:]))
+
+    @property
+    def generation(self):
+        ''' Sequence counter, incremented before and after each append.'''
+        return int(self._seq[0])
+
+    def snapshot(self, n, out=None):
+        ''' Consistent copy of the latest *n* samples while another thread
+        may append. The copy is retried until no append overlapped it.
+
+        :param out: optional array receiving the raw copy
+        :returns: tuple of :py:attr:`i_filled` at the time of the copy and
+            the data with :py:attr:`proxy` applied'''
+        def read():
+            view = self.latest_view(n)
+            if out is None:
+                return self.i_filled, view.copy()
+
+            out[...] = view
+            return self.i_filled, out
+
+        i_filled, data = seq_read(self._seq, read)
+        return i_filled, self.proxy(data)
+
+    @property
+    def time_origin(self):
+        ''' Ring samples are stamped at the end of their sampling interval,
+        so sample 0 is at *tmin* + :py:attr:`delta` and the latest at
+        :py:attr:`t_latest`.'''
+        return self.tmin + self.delta
+
+    @property
+    def retained_indices(self):
+        return max(self.i_filled - self.data_len, 0), self.i_filled
+
+    def slice_view(self, istart, istop):
+        ''' Samples *istart* to *istop* (exclusive) within
+        :py:attr:`retained_indices` as one view into the mirrored storage.'''
+        i = istart % self.data_len
+        return self._mirror[i: i + istop - istart]
+
+    def latest_view(self, n):
+        ''' Latest *n* samples as view into the storage. The view is
+        overwritten by later appends.'''
+        if n > self.data_len:
+            return num.take(self.data, num.arange(
+                self.i_filled - n, self.i_filled), mode='wrap', axis=0)
+
+        istop = self.i_filled % self.data_len + self.data_len
+        return self._mirror[istop-n: istop]
 
     def latest_frame_data(self, n):
         ''' Return the latest n samples data from buffer as array.'''
-        return self.proxy(
-            num.take(self.data,
-                        num.arange(
-                            self.i_filled - n, self.i_filled),
-                        mode='wrap', axis=0)
-        )
+        return self.proxy(self.latest_view(n))
 
-    def latest_frame(self, seconds, clip_min=False):
-        ''' Return the latest *seconds* data from buffer as x and y data tuple.'''
-        istart, istop = self.latest_indices(seconds)
+    def relative_time_axis(self, n):
+        ''' Times of the latest *n* samples relative to the latest sample.
+        Returns a view of a cached axis.'''
+        if n > self._xrel.size:
+            self._xrel = num.arange(-n+1, 1) * self.delta
+        return self._xrel[self._xrel.size-n:]
+
+    @property
+    def t_latest(self):
+        ''' Time of the latest sample, the offset of
+        :py:meth:`relative_time_axis` '''
+        if self.anchored:
+            return float(self.time_index.time_at(self.i_filled - 1))
+
+        return self.i_filled/self.sampling_rate + self.tmin
+
+    def latest_frame_relative(self, seconds, clip_min=False):
+        ''' Like :py:meth:`latest_frame` but return the time axis as scalar
+        offset :py:attr:`t_latest` and relative axis. Tuple of offset,
+        relative times and data.'''
         n = int(seconds*self.sampling_rate)+1
-        x = self.i_filled/self.sampling_rate - self._x[:n][::-1]
+        istart = 0
         if clip_min:
-            istart = num.where(x>0)[0]
-            if not len(istart):
+            # only samples written so far
+            istart = n - self.i_filled
+            if not 0 < istart < n:
                 istart = 0
-            else:
-                istart = num.min(istart)
-        else:
-            istart = 0
-        return (x[istart:], self.latest_frame_data(n-istart))
 
+        return (self.t_latest, self.relative_time_axis(n-istart),
+                self.latest_frame_data(n-istart))
+
+    def latest_frame(self, seconds, clip_min=False):
+        ''' Return the latest *seconds* data from buffer as x and y data tuple.'''
+        t, x, y = self.latest_frame_relative(seconds, clip_min=clip_min)
+        return x + t, y
 
 class RingBuffer2D(RingBuffer):
     def __init__(self, ndimension2, *args, **kwargs):
@@ -219,53 +762,729 @@ class RingBuffer2D(RingBuffer):
         RingBuffer.__init__(self, *args, **kwargs)
 
     def empty(self):
-        self.data = num.ones((int(self.data_len), int(self.ndimension2)),
-                          dtype=self.dtype)
+        mirror = self.allocate((2*int(self.data_len), int(self.ndimension2)))
+        if self.directory is None:
+            # file backed storage starts out zeroed, filling it would touch
+            # every page
+            mirror.fill(1)
+        self.set_storage(mirror)
 
     def append(self, d):
-        if len(d.shape) == 1:
+        if d.ndim == 1:
             self.append_value(d)
             return
 
-        n, n2 = d.shape
-        if n2 != self.ndimension2:
-            raise Exception('ndim2 wrong')
+        if d.shape[1] != self.ndimension2:
+            raise ValueError('expected rows of length %i, got %i' % (
+                self.ndimension2, d.shape[1]))
 
-        istop = (self.i_filled + n)
-        if istop >= self.data_len:
-            istop %= self.data_len
-            iwrap = n - istop
-            self.data[self.i_filled:] = d[: iwrap]
-            self.data[0: istop] = d[iwrap :]
-        else:
-            self.data[self.i_filled: istop] = d
+        RingBuffer.append(self, d)
+
+
+class SpectrumBuffer(RingBuffer2D):
+    ''' History of power spectra, restricted to a frequency band and stored
+    log-scaled.
+
+    Spectra are appended as linear power over *freqs*. Only bins between
+    *fmin* and *fmax* are kept. :py:meth:`latest_frame_data` returns linear
+    float32 power of these bins, :py:attr:`freqs` their frequencies.
+
+    :param dtype: storage type. *num.uint8* quantizes log10 power to 256
+        levels spanning *log_range*, *num.float16* stores log10 power.
+    :param log_range: log10 power mapped to the lowest and highest uint8
+        level'''
+    def __init__(self, freqs, sampling_rate, buffer_length_seconds, fmin=0.,
+                 fmax=None, dtype=num.uint8, log_range=(0., 14.), tmin=0,
+                 directory=None):
+        if fmax is None:
+            fmax = freqs[-1]
 
-        self.i_filled = istop
+        self.ifmin, self.ifmax = num.searchsorted(freqs, (fmin, fmax))
+        self.ifmax = min(self.ifmax+1, freqs.size)
+        self.freqs = freqs[self.ifmin: self.ifmax]
+
+        self.log_range = log_range
+        log_min, log_max = log_range
+        self.scale = 255. / (log_max - log_min)
+        self.levels = num.power(
+            10., num.arange(256) / self.scale + log_min).astype(num.float32)
+
+        RingBuffer2D.__init__(
+            self, self.freqs.size, sampling_rate, buffer_length_seconds,
+            dtype=dtype, tmin=tmin, proxy=self.dequantize,
+            directory=directory)
+
+    def empty(self):
+        # lowest level, like the 1 filled into linear spectra. File backed
+        # storage is zeroed already.
+        mirror = self.allocate((2*int(self.data_len), int(self.ndimension2)))
+        if self.directory is None:
+            mirror.fill(0)
+        self.set_storage(mirror)
+
+    def quantize(self, power):
+        ''' Convert linear *power* over the full input spectrum to the storage
+        format.'''
+        band = power[..., self.ifmin: self.ifmax]
+        logpower = num.log10(num.maximum(band, 1e-30))
+        if self.dtype == num.float16:
+            return logpower.astype(num.float16)
+
+        logpower -= self.log_range[0]
+        logpower *= self.scale
+        logpower += 0.5
+        return num.clip(logpower, 0., 255.).astype(num.uint8)
+
+    def dequantize(self, data):
+        ''' Linear float32 power of stored *data*.'''
+        if self.dtype == num.float16:
+            return num.power(10., data, dtype=num.float32)
+
+        return self.levels[data]
+
+    def append(self, d):
+        if len(d.shape) == 1:
+            RingBuffer2D.append_value(self, self.quantize(d))
+        else:
+            RingBuffer2D.append(self, self.quantize(d))
 
     def append_value(self, v):
-        self.i_filled += 1
-        self.i_filled %= self.data_len
-        self.data[self.i_filled, :] = v
+        RingBuffer2D.append_value(self, self.quantize(v))
+
+    def latest_frame_levels(self, n):
+        ''' Latest *n* spectra as uint8 log power levels, as used for images.
+        A consistent copy, see :py:meth:`snapshot`.'''
+        d = seq_read(self._seq, lambda: self.latest_view(n).copy())
+        if self.dtype == num.uint8:
+            return d
+
+        return num.clip((d - self.log_range[0]) * self.scale, 0., 255.).astype(
+            num.uint8)
+
+
+class EnvelopePyramid(object):
+    ''' Min/max/RMS summaries of a sample :py:class:`RingBuffer` at
+    several resolutions.
+
+    Level 0 summarizes blocks of *blocksize* samples, each following level
+    combines *factor* blocks of the level below. Levels are updated
+    incrementally from the samples appended since the last
+    :py:meth:`update` and cover the same time span as the sample buffer.
+    :py:meth:`envelope` reads from the coarsest level which still resolves
+    the requested number of points, so its cost scales with the number of
+    points instead of the number of samples.
+
+    :param buffer: :py:class:`RingBuffer` holding the samples'''
+    def __init__(self, buffer, blocksize=32, factor=8):
+        self.buffer = buffer
+        self.factor = factor
+        self.blocksizes = []
+        self.levels = []
+        bs = blocksize
+        while not self.levels or bs <= buffer.data_len // 4:
+            seconds = buffer.data_len / float(buffer.sampling_rate)
+            level = [RingBuffer(buffer.sampling_rate / float(bs), seconds,
+                                dtype=dtype, directory=buffer.directory)
+                     for dtype in (buffer.dtype, buffer.dtype, num.float32)]
+            for b in level:
+                # readers retry on any change to samples or summaries
+                b._seq = buffer._seq
+            self.levels.append(level)
+            self.blocksizes.append(bs)
+            bs *= factor
+
+    @property
+    def nbytes(self):
+        return sum(b.nbytes for level in self.levels for b in level)
+
+    def update(self):
+        ''' Summarize samples appended to the buffer since the last call.
+
+        Summaries are computed before they are appended, so that readers on
+        other threads never see a level's fill cursor move backwards.'''
+        buffer = self.buffer
+        bs = self.blocksizes[0]
+        level = self.levels[0]
+        i_done = level[0].i_filled * bs
+        nnew = (buffer.i_filled - i_done) // bs
+        if nnew <= 0:
+            return
+
+        nskip = 0
+        if buffer.i_filled - i_done > buffer.data_len:
+            # samples were overwritten before they were summarized
+            nskip = nnew - buffer.data_len // bs
+            i_done += nskip * bs
+            nnew -= nskip
+
+        blocks = buffer.latest_view(buffer.i_filled - i_done)[:nnew*bs]
+        blocks = blocks.reshape((nnew, bs))
+        blocks_f = blocks.astype(num.float32)
+        summaries = (blocks.min(axis=1), blocks.max(axis=1),
+                     num.einsum('ij,ij->i', blocks_f, blocks_f))
+        for b, d in zip(level, summaries):
+            b.append(d, skip=nskip)
+
+        for below, level in zip(self.levels, self.levels[1:]):
+            ncomplete = below[0].i_filled // self.factor
+            # only blocks whose summaries below are still held
+            iretained = -(-below[0].retained_indices[0] // self.factor)
+            nnew = min(ncomplete - level[0].i_filled, level[0].data_len,
+                       ncomplete - iretained)
+            if nnew <= 0:
+                break
+
+            i_start = ncomplete - nnew
+            nskip = i_start - level[0].i_filled
+            n = nnew * self.factor
+            nread = below[0].i_filled - i_start * self.factor
+            summaries = [
+                reduce(b_below.latest_view(nread)[:n].reshape(
+                    (nnew, self.factor)), axis=1)
+                for b_below, reduce in zip(below, (num.min, num.max, num.sum))]
+            for b, d in zip(level, summaries):
+                b.append(d, skip=nskip)
+
+    def envelope(self, seconds, npoints):
+        ''' Summary of the latest *seconds* in about *npoints* points.
+
+        :returns: tuple of time (block centers), min, max and RMS arrays'''
+        buffer = self.buffer
+        sr = float(buffer.sampling_rate)
+        n = min(int(seconds * sr), buffer.i_filled, buffer.data_len)
+        per_point = max(n // max(npoints, 1), 1)
+
+        ilevel = -1
+        for i, bs in enumerate(self.blocksizes):
+            if bs <= per_point:
+                ilevel = i
+
+        if ilevel < 0:
+            # finer than level 0: summarize raw samples
+            bs = 1
+            m = n
+            i_filled = buffer.i_filled
+            raw = buffer.latest_view(m)
+            data = (raw, raw, raw.astype(num.float32)**2)
+        else:
+            bs = self.blocksizes[ilevel]
+            level = self.levels[ilevel]
+            i_filled = level[0].i_filled
+            m = min(n // bs, i_filled, level[0].data_len)
+            data = [b.latest_view(m) for b in level]
+
+        r = max(m // max(npoints, 1), 1)
+        m = m // r * r
+        ymin, ymax, sumsq = [
+            reduce(d[len(d)-m:].reshape((-1, r)), axis=1).astype(num.float32)
+            for d, reduce in zip(data, (num.min, num.max, num.sum))]
+
+        rms = num.sqrt(sumsq / (r*bs))
+        istart = (i_filled - m) * bs
+        x = (istart + (num.arange(m // r) + 0.5) * r * bs) / sr + buffer.tmin
+        return x, ymin, ymax, rms
+
+
+class TimeIndex(object):
+    ''' Map from sample index to wall clock time.
+
+    The index stores anchors, pairs of sample index and capture time.
+    Between anchors, time advances by one sampling interval per sample.
+    :py:meth:`add` keeps a new anchor only if it deviates from this
+    extrapolation by more than *tolerance* seconds. This happens at gaps,
+    e.g. chunks dropped on overflow, and when the sample clock drifts.
+    Anchors which would make time run backwards, e.g. through callback
+    jitter, are rejected, so times increase with the sample index. Owners
+    drop anchors of samples they no longer hold with :py:meth:`prune`. The
+    index therefore stays small. Lookups use binary search.
+
+    :param tolerance: deviation in seconds above which a new anchor is
+        stored'''
+    def __init__(self, sampling_rate, tolerance=0.005):
+        self.sampling_rate = float(sampling_rate)
+        self.tolerance = tolerance
+        self._isample = num.empty(64, dtype=num.int64)
+        self._t = num.empty(64)
+        self.n = 0
+
+    @property
+    def isamples(self):
+        return self._isample[:self.n]
+
+    @property
+    def times(self):
+        return self._t[:self.n]
+
+    def add(self, isample, t):
+        ''' Sample *isample* was captured at time *t*.'''
+        n = self.n
+        if n:
+            ilast = self._isample[n-1]
+            if isample <= ilast:
+                return
+
+            deviation = t - self._t[n-1] - (isample - ilast)/self.sampling_rate
+            if abs(deviation) <= self.tolerance:
+                return
+
+            if deviation <= -1. / self.sampling_rate:
+                # not after the sample before, keep the extrapolation
+                return
+
+        if n == self._isample.size:
+            self._isample = num.concatenate((self._isample, self._isample))
+            self._t = num.concatenate((self._t, self._t))
+
+        self._isample[n] = isample
+        self._t[n] = t
+        self.n = n + 1
+
+    def prune(self, isample):
+        ''' Drop the anchors which are not needed for the times of samples
+        from *isample* on.'''
+        j = int(num.searchsorted(self.isamples, isample, side='right')) - 1
+        if j <= 0:
+            return
+
+        n = self.n - j
+        self._isample[:n] = self._isample[j: self.n]
+        self._t[:n] = self._t[j: self.n]
+        self.n = n
+
+    def time_at(self, isample):
+        ''' Capture time of sample(s) *isample*.'''
+        if not self.n:
+            return isample / self.sampling_rate
+
+        j = num.maximum(
+            num.searchsorted(self.isamples, isample, side='right') - 1, 0)
+        return self._t[j] + (isample - self._isample[j]) / self.sampling_rate
+
+    def index_at(self, t):
+        ''' Index of the sample captured at or just before time(s) *t*. For
+        times within a gap the first sample after the gap is returned.'''
+        if not self.n:
+            return num.floor(num.asarray(t) * self.sampling_rate).astype(
+                num.int64)
+
+        j = num.maximum(num.searchsorted(self.times, t, side='right') - 1, 0)
+        i = self._isample[j] + num.floor(
+            (t - self._t[j]) * self.sampling_rate).astype(num.int64)
+        if self.n > 1:
+            inext = self._isample[num.minimum(j+1, self.n-1)]
+            i = num.where(j+1 < self.n, num.minimum(i, inext), i)
+
+        return i
+
+    def index_range(self, t0, t1):
+        ''' Indices *istart*, *istop* (exclusive) of the samples captured
+        from *t0* to *t1*, both included. Samples within gaps do not exist,
+        so a range within a gap is empty.'''
+        i = self.index_at(num.array((t0, t1), dtype=num.float64))
+        # index_at may be off by one sample through rounding
+        candidates = i[:, num.newaxis] + num.arange(-1, 3)
+        times = self.time_at(candidates)
+        istart = candidates[0, num.argmax(times[0] >= t0)]
+        after = times[1] > t1
+        istop = candidates[1, num.argmax(after)] if after.any() \
+            else candidates[1, -1] + 1
+        return int(istart), int(max(istop, istart))
+
+    def gaps(self):
+        ''' Gaps in the captured time.
+
+        :returns: tuple of the indices of the first sample after each gap
+            and the gap durations in seconds'''
+        isample, t = self.isamples, self.times
+        expected = t[:-1] + num.diff(isample) / self.sampling_rate
+        duration = t[1:] - expected
+        gap = duration > self.tolerance
+        return isample[1:][gap], duration[gap]
+
+
+class StreamClock(object):
+    ''' Convert the *time_info* of PortAudio callbacks to the wall clock
+    time at which the first frame of the chunk was captured.
+
+    PortAudio reports times on its stream clock. The offset to
+    :py:func:`time.time` is taken at the first callback. Host APIs which do
+    not report the ADC time fall back to the callback time minus the chunk
+    duration.'''
+    def __init__(self, sampling_rate):
+        self.sampling_rate = float(sampling_rate)
+        self.offset = None
+
+    def __call__(self, time_info, frame_count):
+        t_current = time_info.get('current_time', 0.)
+        if not t_current:
+            return time.time() - frame_count / self.sampling_rate
+
+        if self.offset is None:
+            self.offset = time.time() - t_current
+
+        t = time_info.get('input_buffer_adc_time', 0.)
+        if not t:
+            t = t_current - frame_count / self.sampling_rate
+
+        return t + self.offset
+
+
+class CaptureRing(object):
+    ''' Preallocated single-producer/single-consumer ring of interleaved
+    frames.
+
+    The producer (e.g. the PortAudio callback) only calls :py:meth:`write`,
+    the consumer only calls :py:meth:`read_views` and :py:meth:`advance`.
+    Each side moves its own cursor exclusively, so no lock is required.
+    Cursors count frames since the last :py:meth:`reset` and never wrap.
+
+    Within a process, the GIL orders the data copies before the cursor
+    updates. A ring in a *buffer* shared with another process separates
+    them by :py:meth:`fence` on both sides, as cores may reorder plain
+    stores otherwise.
+
+    Cursors and counters are kept in a small int64 header array in front of
+    the sample data. If *buffer* is given, header and data are placed in
+    it (e.g. shared memory, see :py:mod:`pytch.shm`) and nothing is reset.
+
+    :param nchannels: number of interleaved channels
+    :param nframes: capacity in frames (one frame holds one sample per
+        channel)
+    :param buffer: optional buffer of at least :py:meth:`nbytes_required`
+        bytes
+
+    Chunks may carry their capture time, which is stored as anchor (frame
+    cursor, time) in a small ring behind the header. The consumer collects
+    them with :py:meth:`read_anchors`.'''
+
+    nheader = 16
+    nanchors = 1024
+    _iwrite, _iread, _ioverflows, _idropped = range(4)
+    _ianchors = 8
+
+    def __init__(self, nchannels, nframes, dtype=num.int16, buffer=None):
+        self.nchannels = int(nchannels)
+        self.nframes = int(nframes)
+        if buffer is None:
+            buffer = bytearray(
+                self.nbytes_required(self.nchannels, self.nframes, dtype))
+            owner = True
+        else:
+            owner = False
+
+        self.header = num.frombuffer(
+            buffer, dtype=num.int64, count=self.nheader)
+        self.anchors = num.frombuffer(
+            buffer, dtype=num.float64, count=self.nanchors*2,
+            offset=self.header.nbytes).reshape((self.nanchors, 2))
+        self.data = num.frombuffer(
+            buffer, dtype=dtype, count=self.nframes*self.nchannels,
+            offset=self.header.nbytes+self.anchors.nbytes).reshape(
+                (self.nframes, self.nchannels))
+        self._ianchor_read = 0
+        # each process takes its own lock, contention is limited to its
+        # own threads
+        self._fence_lock = None if owner else threading.Lock()
+
+        if owner:
+            self.reset()
+
+    def fence(self):
+        ''' Memory barrier for rings shared between processes. Taking and
+        releasing a lock synchronizes memory (POSIX.1 4.12), so loads and
+        stores are not reordered across this call. No-op for rings private
+        to the process.'''
+        if self._fence_lock is not None:
+            self._fence_lock.acquire()
+            self._fence_lock.release()
+
+    @classmethod
+    def nbytes_required(cls, nchannels, nframes, dtype=num.int16):
+        ''' Size in bytes of the buffer holding header and data.'''
+        return cls.nheader * 8 + cls.nanchors * 2 * 8 + \
+            int(nchannels) * int(nframes) * num.dtype(dtype).itemsize
+
+    def reset(self):
+        ''' Discard unread frames and clear counters. Only call this while
+        the producer is stopped.'''
+        self.header[:4] = 0
+        self.header[self._ianchors] = 0
+        self._ianchor_read = 0
+
+    @property
+    def write_cursor(self):
+        return int(self.header[self._iwrite])
+
+    @property
+    def read_cursor(self):
+        return int(self.header[self._iread])
+
+    @property
+    def n_overflows(self):
+        ''' Number of chunks dropped because they did not fit.'''
+        return int(self.header[self._ioverflows])
+
+    @property
+    def n_frames_dropped(self):
+        return int(self.header[self._idropped])
+
+    @property
+    def n_available(self):
+        ''' Number of frames written but not yet consumed.'''
+        return self.write_cursor - self.read_cursor
+
+    def write(self, frames, t=None):
+        ''' Copy *frames* into the ring (producer side).
+
+        :param frames: interleaved 1D array or array of shape
+            (n, nchannels)
+        :param t: optional capture time of the first frame
+        :returns: False if the chunk was dropped because the ring is full'''
+        frames = frames.reshape((-1, self.nchannels))
+        n = frames.shape[0]
+        header = self.header
+        write_cursor = int(header[self._iwrite])
+        if write_cursor - int(header[self._iread]) + n > self.nframes:
+            header[self._ioverflows] += 1
+            header[self._idropped] += n
+            return False
+
+        # the consumer is done with the frames released before
+        self.fence()
+
+        if t is not None:
+            ianchor = int(header[self._ianchors])
+            self.anchors[ianchor % self.nanchors] = write_cursor, t
+            header[self._ianchors] = ianchor + 1
+
+        istart = write_cursor % self.nframes
+        istop = istart + n
+        if istop > self.nframes:
+            iwrap = self.nframes - istart
+            self.data[istart:] = frames[:iwrap]
+            self.data[:n-iwrap] = frames[iwrap:]
+        else:
+            self.data[istart:istop] = frames
+
+        # publish only after the data has been copied
+        self.fence()
+        header[self._iwrite] = write_cursor + n
+        return True
+
+    def read_views(self, n=None):
+        ''' Views of up to *n* (default: all) unread frames (consumer side).
+
+        Returns a tuple of one or, at the wrap-around, two arrays of shape
+        (nframes, nchannels). Call :py:meth:`advance` once they have been
+        consumed.'''
+        read_cursor = self.read_cursor
+        n_available = self.write_cursor - read_cursor
+        # frames up to the cursor are complete
+        self.fence()
+        n = n_available if n is None else min(n, n_available)
+        istart = read_cursor % self.nframes
+        istop = istart + n
+        if istop > self.nframes:
+            return (self.data[istart:], self.data[:istop-self.nframes])
+
+        return (self.data[istart:istop], )
+
+    def advance(self, n):
+        ''' Mark *n* frames as consumed, releasing them to the producer.'''
+        self.fence()
+        self.header[self._iread] += n
+
+    def read_anchors(self, n):
+        ''' Anchors of the next *n* unread frames (consumer side).
+
+        :returns: list of (frame offset relative to the read cursor, time)
+            tuples. Anchors of frames already consumed are skipped.'''
+        read_cursor = self.read_cursor
+        nwritten = int(self.header[self._ianchors])
+        ianchor = max(self._ianchor_read, nwritten - self.nanchors)
+        anchors = []
+        while ianchor < nwritten:
+            cursor, t = self.anchors[ianchor % self.nanchors]
+            offset = int(cursor) - read_cursor
+            if offset >= n:
+                break
+
+            if offset >= 0:
+                anchors.append((offset, t))
+            ianchor += 1
+
+        self._ianchor_read = ianchor
+        return anchors
 
 
 class DataProvider(object):
     ''' Base class defining common interface for data input to Worker'''
     def __init__(self):
-        self.frames = []
+        self.channels = []
+        self.capture_ring = None
+        self.recorder = None
+        self.bank = None
         atexit.register(self.terminate)
 
+    @property
+    def fftsizes(self):
+        ''' List of fft sizes of all channels registered by the input
+        device'''
+        return [c.fftsize for c in self.channels]
+
+    @property
+    def deltat(self):
+        return 1./self.sampling_rate
+
+    def setup_channels(self, nchannels, fftsize, buffer_length_seconds=40,
+                       buffer_dir=None, hopsize=None):
+        ''' Create *nchannels* channels as views of one
+        :py:class:`ChannelBank`.'''
+        self.bank = ChannelBank(
+            nchannels, self.sampling_rate, fftsize=fftsize, hopsize=hopsize,
+            buffer_length_seconds=buffer_length_seconds,
+            buffer_dir=buffer_dir)
+        self.channels = self.bank.channels
+
+    def setup_deinterleave(self, nchannels, nframes):
+        ''' Allocate the scratch array used to deinterleave up to *nframes*
+        frames per call to :py:meth:`deliver`. Not needed if the channels
+        are views of a :py:class:`ChannelBank`.'''
+        if self.bank is not None:
+            return
+
+        self._deinterleaved = num.empty((nchannels, nframes), dtype=num.int16)
+
+    def setup_capture(self, nchannels, nframes):
+        ''' Allocate the capture ring holding *nframes* interleaved frames and
+        the scratch array used to deinterleave it in :py:meth:`flush`.'''
+        self.capture_ring = CaptureRing(nchannels, nframes)
+        self.setup_deinterleave(nchannels, nframes)
+
+    def deliver(self, views, anchors=()):
+        ''' Append interleaved frames to the channels.
+
+        *views* is a sequence of arrays of shape (n, nchannels). All of them
+        are deinterleaved with one strided copy each, directly into the
+        :py:class:`ChannelBank` if the channels have one. Otherwise each
+        channel receives a single contiguous block per call.
+
+        :param anchors: sequence of (frame offset, capture time) tuples added
+            to the :py:class:`TimeIndex` of each channel
+        :returns: number of delivered frames'''
+        n = sum(frames.shape[0] for frames in views)
+        if not n:
+            return n
+
+        recorder = self.recorder
+        if recorder is not None:
+            for frames in views:
+                recorder.put(frames)
+
+        bank = self.bank
+        if bank is not None:
+            # deinterleave straight into the bank
+            for offset, t in anchors:
+                bank.time_index.add(bank.i_filled + offset, t)
+            for frames in views:
+                bank.append(frames.T)
+
+            bank.time_index.prune(bank.retained_indices[0])
+
+            return n
+
+        n = 0
+        for frames in views:
+            nframes = frames.shape[0]
+            num.copyto(self._deinterleaved[:, n:n+nframes], frames.T)
+            n += nframes
+
+        for channel, samples in zip(self.channels, self._deinterleaved[:, :n]):
+            for offset, t in anchors:
+                channel.time_index.add(channel.i_filled + offset, t)
+            channel.append(samples)
+            channel.time_index.prune(channel.retained_indices[0])
+
+        return n
+
+    def flush(self):
+        ''' Move all pending frames from the capture ring into the
+        channels.'''
+        ring = self.capture_ring
+        views = ring.read_views()
+        anchors = ring.read_anchors(sum(v.shape[0] for v in views))
+        ring.advance(self.deliver(views, anchors))
+
+    def start_recording(self, fn):
+        ''' Continuously write all channels to the WAV file *fn* from a
+        background thread, starting with the next :py:meth:`flush`.'''
+        self.stop_recording()
+        recorder = WavRecorder(
+            fn, len(self.channels), self.sampling_rate)
+        recorder.start()
+        self.recorder = recorder
+
+    def stop_recording(self):
+        recorder = self.recorder
+        if recorder is not None:
+            self.recorder = None
+            recorder.stop()
+
     def terminate(self):
-        # cleanup
-        pass
+        self.stop_recording()
 
 
 class Channel(RingBuffer):
-    def __init__(self, sampling_rate, fftsize=8192):
+    ''' Audio samples of one input channel plus its analysis results.
+
+    Samples are stored in their raw capture format (*dtype*, int16 by
+    default). Reading methods convert only the requested window to float32,
+    scaled by *gain*.
+
+    :param buffer_length_seconds: history retained for audio and analysis
+        results
+    :param buffer_dir: if given, all buffers are memory mapped files in this
+        directory. Use this for histories which do not fit into memory. The
+        samples and their envelope share one file (or the file of *bank*, if
+        *buffer_dir* is its :py:class:`MappedFile`), the analysis buffers
+        another one.
+    :param fmin, fmax: frequency band kept in the spectral history
+    :param spectrum_dtype: storage type of the spectral history, see
+        :py:class:`SpectrumBuffer`
+    :param bank: :py:class:`ChannelBank` holding the samples of this
+        channel as row *ibank*. Samples are then appended through the bank
+        only.
+    :param hopsize: samples between the ends of successive analysis
+        windows. Defaults to a quarter of *fftsize*. Spectra and pitches are
+        stored at :py:attr:`analysis_rate`.'''
+    def __init__(self, sampling_rate, fftsize=8192, dtype=num.int16, gain=1.,
+                 buffer_length_seconds=40, buffer_dir=None, fmin=0.,
+                 fmax=None, spectrum_dtype=num.uint8, bank=None, ibank=None,
+                 hopsize=None):
+
+        self.buffer_length_seconds = buffer_length_seconds
+        self.gain = gain
+        self.fmin = fmin
+        self.fmax = fmax
+        self.spectrum_dtype = spectrum_dtype
+        self.bank = bank
+        self.ibank = ibank
+        if buffer_dir is not None and not isinstance(buffer_dir, MappedFile):
+            buffer_dir = MappedFile(buffer_dir)
+
+        RingBuffer.__init__(self, sampling_rate, self.buffer_length_seconds,
+                            dtype=dtype, directory=buffer_dir)
+
+        if bank is None:
+            self.time_index = TimeIndex(sampling_rate)
+        else:
+            self._seq = bank._seq
+            self.time_index = bank.time_index
 
-        self.buffer_length_seconds = 40
-        RingBuffer.__init__(self, sampling_rate, self.buffer_length_seconds)
+        self.envelope_pyramid = EnvelopePyramid(self)
 
         self.__algorithm = 'yinfft'
+        self.__hopsize = hopsize
         self.name = ''
         self.pitch_o = None
         self.fftsize = fftsize
@@ -278,37 +1497,234 @@ class Channel(RingBuffer):
         self.standard_frequency = 220.
         self.pitch_shift = 0.
 
+    def to_float(self, data, out=None):
+        ''' Convert raw samples *data* to float32 scaled by :py:attr:`gain`,
+        optionally writing into *out*.'''
+        if out is None:
+            out = num.empty(data.shape, dtype=num.float32)
+
+        if self.gain == 1.:
+            out[...] = data
+        else:
+            num.multiply(data, self.gain, out=out, casting='unsafe')
+
+        return out
+
+    @property
+    def ydata(self):
+        return self.to_float(self.data[:self.i_filled])
+
+    def empty(self):
+        if self.bank is None:
+            RingBuffer.empty(self)
+        else:
+            self.set_storage(self.bank._mirror[self.ibank])
+
+    def append(self, d):
+        if self.bank is not None:
+            raise ValueError('channel samples are appended through the bank')
+
+        RingBuffer.append(self, d)
+        self.envelope_pyramid.update()
+
+    def append_value(self, v):
+        if self.bank is not None:
+            raise ValueError('channel samples are appended through the bank')
+
+        RingBuffer.append_value(self, v)
+        self.envelope_pyramid.update()
+
+    def latest_times(self, n):
+        ''' Capture times of the latest *n* samples, see
+        :py:attr:`time_index`.'''
+        return self.time_index.time_at(
+            num.arange(self.i_filled - n, self.i_filled))
+
+    def latest_envelope(self, seconds, npoints):
+        ''' Min, max and RMS of the latest *seconds* at a resolution of about
+        *npoints*, scaled by :py:attr:`gain`. See
+        :py:meth:`EnvelopePyramid.envelope`. Consistent while samples are
+        appended on another thread.'''
+        x, ymin, ymax, rms = seq_read(
+            self._seq, lambda: self.envelope_pyramid.envelope(seconds, npoints))
+        if self.gain != 1.:
+            ymin *= self.gain
+            ymax *= self.gain
+            rms *= abs(self.gain)
+
+        return x, ymin, ymax, rms
+
+    def latest_raw_data(self, n):
+        ''' Return the latest *n* samples in storage format.'''
+        return RingBuffer.latest_frame_data(self, n)
+
+    def latest_frame_data(self, n, out=None):
+        ''' Return the latest *n* samples as float32 array. If given, the
+        result is written into the caller supplied array *out*.'''
+        return self.to_float(self.latest_raw_data(n), out=out)
+
+    def slice_time(self, t0, t1):
+        ''' Like :py:meth:`RingBuffer.slice_time`, returning float32
+        samples scaled by :py:attr:`gain`.'''
+        x, y = RingBuffer.slice_time(self, t0, t1)
+        return x, self.to_float(y)
+
+    def latest_frame_decimated(self, seconds, ndecimate):
+        ''' Like :py:meth:`latest_frame` but min/max decimated by factor
+        *ndecimate*. Decimation runs on the raw samples, only the decimated
+        trace is converted to float32.'''
+        n = int(seconds*self.sampling_rate) // ndecimate * ndecimate
+        raw = self.latest_raw_data(n).reshape((-1, ndecimate))
+        y = num.empty(raw.shape[0], dtype=num.float32)
+        y[::2] = raw[::2].min(axis=1)
+        y[1::2] = raw[1::2].max(axis=1)
+        if self.gain != 1.:
+            y *= self.gain
+
+        x = self.relative_time_axis(n)[::ndecimate] + self.t_latest
+        return x, y
+
     def pitch_proxy(self, data):
         return f2cent(data, self.standard_frequency) + self.pitch_shift
 
     def undo_pitch_proxy(self, data):
         return cent2f(data-self.pitch_shift, self.standard_frequency)
 
+    @property
+    def analysis_rate(self):
+        ''' Frame rate of the spectral and pitch history in Hz.'''
+        return self.sampling_rate / float(self.hopsize)
+
     def update(self):
+        ''' Reset the analysis buffers. Analysis continues with the next hop
+        after the latest sample.'''
         nfft = (int(self.fftsize), self.delta)
-        self.freqs = num.fft.rfftfreq(*nfft)
-        sr = int(1000./58.)
-        # TODO: 58=gui refresh rate. Nastily hard coded here for now
-        self.fft = RingBuffer2D(
-            ndimension2=self.fftsize/2+1,
-            # sampling_rate=self.sampling_rate/self.fftsize,   # Hop size
-            sampling_rate = sr,
-            buffer_length_seconds=self.buffer_length_seconds,
-            dtype=num.uint32)
-        self.fft_power = RingBuffer(
-            sampling_rate=sr,
-            buffer_length_seconds=self.buffer_length_seconds)
-        self.pitch = RingBuffer(
-            sampling_rate=sr,
-            buffer_length_seconds=self.sampling_rate*self.buffer_length_seconds/self.fftsize,
-            proxy=self.pitch_proxy)
-        self.pitch_confidence = RingBuffer(
+        sr = self.analysis_rate
+        self.i_analysed = self.i_filled
+        # times of analysis frames are those of the last sample of their hop
+        tmin = self.i_analysed / float(self.sampling_rate)
+        directory = None
+        if self.directory is not None:
+            # a new file each reset, so that the space of the replaced
+            # buffers is given back
+            directory = MappedFile(self.directory.directory)
+
+        kwargs = dict(
             sampling_rate=sr,
-            buffer_length_seconds=self.sampling_rate*self.buffer_length_seconds/self.fftsize)
+            buffer_length_seconds=self.buffer_length_seconds,
+            tmin=tmin,
+            directory=directory)
+
+        self.fft = SpectrumBuffer(
+            num.fft.rfftfreq(*nfft),
+            fmin=self.fmin,
+            fmax=self.fmax,
+            dtype=self.spectrum_dtype,
+            **kwargs)
+        self.freqs = self.fft.freqs
+        self.fft_power = RingBuffer(**kwargs)
+        self.pitch = RingBuffer(proxy=self.pitch_proxy, **kwargs)
+        self.pitch_confidence = RingBuffer(**kwargs)
+        # pitch and confidence are appended and read together
+        self.pitch_confidence._seq = self.pitch._seq
+        # capture times of the analysis frames, see anchor_hops
+        self.analysis_index = TimeIndex(sr)
+        for b in (self.fft, self.fft_power, self.pitch, self.pitch_confidence):
+            b.time_index = self.analysis_index
+        logger.debug('spectral history: %i bins, %.1f MB' % (
+            self.freqs.size, self.fft.nbytes/1e6))
+
+    def anchor_hops(self, nhops):
+        ''' Anchor the analysis frames of the next *nhops* hops at the
+        capture times of the last samples of their hops, so that the
+        analysis history follows the gaps of the audio.'''
+        if not self.time_index.n:
+            return
+
+        iframe = self.pitch.i_filled
+        isamples = self.i_analysed - 1 + self.hopsize * num.arange(1, nhops+1)
+        for i, t in enumerate(self.time_index.time_at(isamples)):
+            self.analysis_index.add(iframe + i, t)
+
+        self.analysis_index.prune(self.pitch.retained_indices[0])
+
+    @property
+    def n_pending_hops(self):
+        ''' Number of complete hops which have not been analysed yet.'''
+        return (self.i_filled - self.i_analysed) // self.hopsize
+
+    def skip_hops(self, n):
+        ''' Mark the next *n* hops as analysed without analysing them, e.g.
+        when their samples were overwritten before. Rows of zero power, pitch
+        and confidence are appended, so that the analysis history keeps its
+        frame rate.'''
+        self.anchor_hops(n)
+        fft = self.fft
+        fft.append_fill(n, fft.quantize(num.zeros(fft.ifmax)))
+        zeros = num.zeros(n, dtype=self.pitch.dtype)
+        self._append_pitch(zeros, zeros)
+        self.i_analysed += n * self.hopsize
+
+    def set_spectral_band(self, fmin, fmax):
+        ''' Keep only *fmin* to *fmax* in the spectral history. Resets the
+        analysis buffers.'''
+        self.fmin = fmin
+        self.fmax = fmax
+        self.update()
+
+    @property
+    def nbytes_total(self):
+        ''' Memory footprint of samples and analysis buffers in bytes.'''
+        return self.envelope_pyramid.nbytes + sum(b.nbytes for b in (
+            self, self.fft, self.fft_power, self.pitch, self.pitch_confidence))
 
     def latest_confident_indices(self, n, threshold):
         return num.where(self.pitch_confidence.latest_frame_data(n) >= threshold)
 
+    def append_pitch(self, pitch, confidence):
+        ''' Append arrays of several *pitch* estimates and their
+        *confidence* at once. They belong to the hops following
+        :py:attr:`i_analysed`.'''
+        self.anchor_hops(len(pitch))
+        self._append_pitch(pitch, confidence)
+
+    def _append_pitch(self, pitch, confidence):
+        ''' Append *pitch* and *confidence* as one write for readers of
+        :py:meth:`pitch_snapshot`.'''
+        seq = self.pitch._seq
+        seq[0] += 1
+        self.pitch.append_unguarded(pitch)
+        self.pitch_confidence.append_unguarded(confidence)
+        seq[0] += 1
+
+    def pitch_snapshot(self, n):
+        ''' Consistent copy of the latest *n* pitch estimates and their
+        confidence, taken while the analysis thread may append.
+
+        :returns: tuple of :py:attr:`pitch` fill index at the time of the
+            copy, pitch with :py:attr:`pitch_proxy` applied and confidence'''
+        pitch = self.pitch
+        confidence = self.pitch_confidence
+        i_filled, p, c = seq_read(pitch._seq, lambda: (
+            pitch.i_filled, pitch.latest_view(n).copy(),
+            confidence.latest_view(n).copy()))
+        return i_filled, pitch.proxy(p), c
+
+    def latest_pitch_relative(self, seconds, clip_min=False):
+        ''' Consistent counterpart of
+        :py:meth:`RingBuffer.latest_frame_relative` for pitch and
+        confidence. Tuple of the time of the latest frame, relative times,
+        pitch and confidence.'''
+        pitch = self.pitch
+        n = int(seconds*pitch.sampling_rate)+1
+        if clip_min and 0 < pitch.i_filled < n:
+            # only frames written so far
+            n = pitch.i_filled
+
+        i_filled, p, c = self.pitch_snapshot(n)
+        t = float(pitch.xaxis(i_filled-1, i_filled)[0])
+        return t, pitch.relative_time_axis(n), p, c
+
     def append_value_pitch(self, val, apply_kalman=False):
         ''' Append a new pitch value to pitch buffer. Apply Kalman filter
         before appending'''
@@ -324,6 +1740,18 @@ class Channel(RingBuffer):
     def fftsize(self, size):
         self.__fftsize = size
         self.update()
+        if self.pitch_o is not None:
+            self.setup_pitch()
+
+    @property
+    def hopsize(self):
+        return self.__hopsize or self.fftsize // 4
+
+    @hopsize.setter
+    def hopsize(self, size):
+        self.__hopsize = size
+        self.update()
+        self.setup_pitch()
 
     @property
     def pitch_algorithm(self):
@@ -341,40 +1769,135 @@ class Channel(RingBuffer):
     def setup_pitch(self):
         if self.pitch_o:
             self.pitch_o = None
-        tolerance = 0.8
-        win_s = self.fftsize
-        self.pitch_o = pitch(self.pitch_algorithm,
-          win_s, win_s, self.sampling_rate)
-        self.pitch_o.set_unit("Hz")
-        self.pitch_o.set_tolerance(tolerance)
+        self.pitch_o = make_pitch_detector(
+            self.pitch_algorithm, self.fftsize, self.hopsize,
+            self.sampling_rate)
+
+
+class ChannelBank(object):
+    ''' Audio history of several channels in one array of shape
+    (nchannels, N) with a shared write cursor.
+
+    Storage is mirrored like in :py:class:`RingBuffer`, so that the latest
+    samples of all channels form one strided view. :py:attr:`channels` are
+    :py:class:`Channel` instances whose samples are rows of the bank.
+    Further keyword arguments are passed to :py:class:`Channel`.'''
+    def __init__(self, nchannels, sampling_rate, buffer_length_seconds=40,
+                 dtype=num.int16, buffer_dir=None, **kwargs):
+        self.nchannels = nchannels
+        self.sampling_rate = sampling_rate
+        self.data_len = int(buffer_length_seconds * sampling_rate)
+        self.dtype = dtype
+        shape = (nchannels, 2*self.data_len)
+        if buffer_dir is not None:
+            # channels put their envelopes into the same file
+            buffer_dir = MappedFile(buffer_dir)
+            self._mirror = memmap_array(shape, dtype, buffer_dir)
+        else:
+            self._mirror = num.empty(shape, dtype=dtype)
+
+        self.data = self._mirror[:, :self.data_len]
+        self.i_filled = 0
+        self._seq = num.zeros(1, dtype=num.int64)
+        self.time_index = TimeIndex(sampling_rate)
+        self.channels = [
+            Channel(sampling_rate, dtype=dtype,
+                    buffer_length_seconds=buffer_length_seconds,
+                    buffer_dir=buffer_dir, bank=self, ibank=i, **kwargs)
+            for i in range(nchannels)]
+
+    @property
+    def gains(self):
+        return num.array([c.gain for c in self.channels], dtype=num.float32)
+
+    def append(self, block):
+        ''' Append *block* of shape (nchannels, n) to all channels. *block*
+        may be strided, e.g. the transpose of interleaved frames.'''
+        n = block.shape[1]
+        if n > self.data_len:
+            self.i_filled += n - self.data_len
+            block = block[:, -self.data_len:]
+            n = self.data_len
+
+        self._seq[0] += 1
+        m = self._mirror
+        L = self.data_len
+        i = self.i_filled % L
+        m[:, i: i+n] = block
+        if i + n <= L:
+            m[:, i+L: i+L+n] = block
+        else:
+            k = L - i
+            m[:, i+L:] = block[:, :k]
+            m[:, :n-k] = block[:, k:]
+
+        self.i_filled += n
+        for channel in self.channels:
+            channel.i_filled = self.i_filled
+        self._seq[0] += 1
+
+        for channel in self.channels:
+            channel.envelope_pyramid.update()
+
+    @property
+    def retained_indices(self):
+        return max(self.i_filled - self.data_len, 0), self.i_filled
+
+    def slice_view(self, istart, istop):
+        ''' Samples *istart* to *istop* (exclusive) of all channels within
+        :py:attr:`retained_indices` as view of shape (nchannels, n).'''
+        i = istart % self.data_len
+        return self._mirror[:, i: i + istop - istart]
+
+    def latest_view(self, n):
+        ''' Latest *n* samples of all channels as view of shape
+        (nchannels, n).'''
+        istop = self.i_filled % self.data_len + self.data_len
+        return self._mirror[:, istop-n: istop]
+
+    def latest_frame_data(self, n, out=None):
+        ''' Latest *n* samples of all channels as float32 array of shape
+        (nchannels, n), scaled by the channel gains.'''
+        if out is None:
+            out = num.empty((self.nchannels, n), dtype=num.float32)
+
+        gains = self.gains
+        if num.all(gains == 1.):
+            out[...] = self.latest_view(n)
+        else:
+            num.multiply(self.latest_view(n), gains[:, num.newaxis], out=out,
+                         casting='unsafe')
+
+        return out
 
 
 class MicrophoneRecorder(DataProvider):
 
     def __init__(self, chunksize=512, device_no=None, sampling_rate=None, fftsize=1024,
-                 nchannels=2):
+                 nchannels=2, capture_buffer_seconds=5., buffer_length_seconds=40,
+                 buffer_dir=None):
         DataProvider.__init__(self)
 
         self.stream = None
-        self.p = pyaudio.PyAudio()
+        with portaudio_lock:
+            self.p = pyaudio.PyAudio()
+            default = self.p.get_default_input_device_info()
         self.nchannels = nchannels
-        default = self.p.get_default_input_device_info()
 
         self.device_no = device_no or default['index']
         self.sampling_rate = sampling_rate or int(default['defaultSampleRate'])
 
-        self.channels = []
-        for i in range(self.nchannels):
-            c = Channel(self.sampling_rate, fftsize=fftsize)
-            self.channels.append(c)
+        self.setup_channels(
+            self.nchannels, fftsize,
+            buffer_length_seconds=buffer_length_seconds,
+            buffer_dir=buffer_dir)
 
         self.chunksize = chunksize
-
-    @property
-    def fftsizes(self):
-        ''' List of sampling rates of all channels registered by the input
-        device'''
-        return [c.fftsize for c in self.channels]
+        self.setup_capture(
+            self.nchannels, int(capture_buffer_seconds * self.sampling_rate))
+        self.clock = StreamClock(self.sampling_rate)
+        self.n_input_overflows = 0
+        self._stop = True
 
     @property
     def sampling_rate_options(self):
@@ -382,20 +1905,23 @@ class MicrophoneRecorder(DataProvider):
         return sampling_rate_options(self.device_no, audio=self.p)
 
     def new_frame(self, data, frame_count, time_info, status):
-        data = num.asarray(num.fromstring(data, 'int16'), num.float32)
+        ''' PortAudio callback. Copies the raw chunk and its capture time
+        into the capture ring without converting or allocating.'''
+        if status & pyaudio.paInputOverflow:
+            self.n_input_overflows += 1
 
-        with _lock:
-            self.frames.append(data)
-            if self._stop:
-                return None, pyaudio.paComplete
+        self.capture_ring.write(
+            num.frombuffer(data, dtype=num.int16),
+            t=self.clock(time_info, frame_count))
+        if self._stop:
+            return None, pyaudio.paComplete
 
         return None, pyaudio.paContinue
 
-    def get_frames(self):
-        with _lock:
-            frames = self.frames
-            self.frames = []
-        return frames
+    @property
+    def n_overflows(self):
+        ''' Number of chunks dropped because the capture ring was full.'''
+        return self.capture_ring.n_overflows
 
     def start(self):
         if self.stream is None:
@@ -410,37 +1936,43 @@ class MicrophoneRecorder(DataProvider):
 
     @sampling_rate.setter
     def sampling_rate(self, rate):
-        check_sampling_rate(self.device_no, rate, audio=self.p)
+        if not check_sampling_rate(self.device_no, rate, audio=self.p):
+            logger.warning('sampling rate %s may not be supported by device '
+                           '%s' % (rate, self.device_no))
         self.__sampling_rate = rate
 
     def start_new_stream(self):
-        self.frames = []
-        self.stream = self.p.open(format=pyaudio.paInt16,
-                                  channels=self.nchannels,
-                                  rate=self.sampling_rate,
-                                  input=True,
-                                  output=False,
-                                  frames_per_buffer=self.chunksize,
-                                  input_device_index=self.device_no,
-                                  stream_callback=self.new_frame)
+        self.capture_ring.reset()
+        self.clock = StreamClock(self.sampling_rate)
         self._stop = False
+        with portaudio_lock:
+            self.stream = self.p.open(format=pyaudio.paInt16,
+                                      channels=self.nchannels,
+                                      rate=self.sampling_rate,
+                                      input=True,
+                                      output=False,
+                                      frames_per_buffer=self.chunksize,
+                                      input_device_index=self.device_no,
+                                      stream_callback=self.new_frame)
         logger.debug('starting new stream: %s' % self.stream)
         self.stream.start_stream()
 
     def stop(self):
-        with _lock:
-            self._stop = True
+        self._stop = True
         if self.stream is not None:
             self.stream.stop_stream()
 
     def close(self):
         self.stop()
-        self.stream.close()
+        with portaudio_lock:
+            self.stream.close()
 
     def terminate(self):
+        DataProvider.terminate(self)
         if self.stream:
             self.close()
-        self.p.terminate()
+        with portaudio_lock:
+            self.p.terminate()
         logger.debug('terminated stream')
 
     def set_device_no(self, i):
@@ -448,16 +1980,128 @@ class MicrophoneRecorder(DataProvider):
         self.device_no = i
         self.start_new_stream()
 
+
+class PacedProvider(DataProvider):
+    ''' Base class for providers which read or generate frames on demand.
+
+    Subclasses implement :py:meth:`read_frames`.
+
+    :param realtime: if True, each :py:meth:`flush` delivers the frames
+        that became due in wall clock time since :py:meth:`start`. If False,
+        each flush delivers *frames_per_flush* frames, as fast as flush is
+        called. Use the latter to measure the maximum throughput of the
+        analysis.
+    :param frames_per_flush: frames per flush in unthrottled mode. Defaults
+        to *fftsize*.
+    :param nframes: total number of frames available or None if unlimited
+    :param loop: restart at the beginning when *nframes* are exhausted'''
+
+    def __init__(self, sampling_rate, nchannels, fftsize=1024, realtime=True,
+                 frames_per_flush=None, nframes=None, loop=False,
+                 buffer_length_seconds=40, buffer_dir=None):
+        DataProvider.__init__(self)
+        self.sampling_rate = sampling_rate
+        self.nchannels = nchannels
+        self.realtime = realtime
+        self.frames_per_flush = int(frames_per_flush or fftsize)
+        self.nframes = nframes
+        self.loop = loop
+
+        self.setup_channels(
+            self.nchannels, fftsize,
+            buffer_length_seconds=buffer_length_seconds,
+            buffer_dir=buffer_dir)
+
+        # bound for the number of frames deinterleaved per deliver call
+        self.max_frames_deliver = max(
+            self.frames_per_flush, int(self.sampling_rate))
+        self.setup_deinterleave(self.nchannels, self.max_frames_deliver)
+        self.i_read = 0
+        self._stop = True
+        self._t_start = None
+
     @property
-    def deltat(self):
-        return 1./self.sampling_rate
+    def exhausted(self):
+        ''' True if all frames have been delivered.'''
+        return self.nframes is not None and self.i_read >= self.nframes \
+            and not self.loop
+
+    @property
+    def t_read(self):
+        ''' Position in seconds.'''
+        return self.i_read * self.deltat
+
+    def start_new_stream(self):
+        self.i_read = 0
+        self.start()
+
+    def start(self):
+        self._t_start = time.time() - self.t_read
+        self._stop = False
+
+    def stop(self):
+        self._stop = True
+
+    def frames_due(self):
+        ''' Number of frames to deliver in the next :py:meth:`flush`.'''
+        if self._stop:
+            return 0
+
+        if self.realtime:
+            return int((time.time() - self._t_start) * self.sampling_rate) \
+                - self.i_read
+
+        return self.frames_per_flush
+
+    def read_frames(self, istart, n):
+        ''' Return *n* frames starting at frame *istart* as int16 array of
+        shape (n, nchannels).'''
+        raise NotImplementedError
 
     def flush(self):
-        ''' read data and put it into channels' track_data'''
-        # make this entirely numpy:
-        frames = num.array(self.get_frames())
-        for frame in frames:
-            r = num.reshape(frame, (self.chunksize,
-                                    self.nchannels)).T
-            for i, channel in enumerate(self.channels):
-                channel.append(r[i])
+        ''' Deliver the frames which are due.'''
+        n = self.frames_due()
+        while n > 0:
+            nframes = min(n, self.max_frames_deliver)
+            if self.nframes is not None:
+                if self.i_read >= self.nframes:
+                    if not self.loop:
+                        break
+
+                    self.i_read = 0
+                    self._t_start += self.nframes * self.deltat
+
+                nframes = min(nframes, self.nframes-self.i_read)
+
+            self.deliver(
+                (self.read_frames(self.i_read, nframes), ),
+                ((0, self._t_start + self.t_read), ))
+            self.i_read += nframes
+            n -= nframes
+
+
+class WavFileProvider(PacedProvider):
+    ''' Feed channels from a 16 bit PCM (multichannel) WAV file.
+
+    The file is memory mapped and delivered through the same :py:meth:`flush`
+    contract as live input. See :py:class:`PacedProvider` for the remaining
+    arguments.'''
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        sampling_rate, data = wavfile.read(fn, mmap=True)
+        if data.dtype != num.int16:
+            raise ValueError(
+                '%s: only 16 bit PCM files are supported, got %s' % (
+                    fn, data.dtype))
+
+        self.data = data.reshape((data.shape[0], -1))
+        nframes, nchannels = self.data.shape
+        PacedProvider.__init__(
+            self, sampling_rate, nchannels, *args, nframes=nframes, **kwargs)
+
+        for i, c in enumerate(self.channels):
+            c.name = '%s:%s' % (os.path.basename(fn), i)
+
+    def read_frames(self, istart, n):
+        return self.data[istart: istart+n]
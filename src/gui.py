@@ -1,11 +1,12 @@
 import logging
 import sys
+import threading
 import numpy as num
 import os
 
-from pytch.two_channel_tuner import Worker
+from pytch.two_channel_tuner import Worker, AnalysisThread
 
-from .data import pitch_algorithms
+from .data import pitch_algorithms, WavFileProvider
 from .gui_util import add_action_group
 from .gui_util import make_QPolygonF, _color_names, _colors # noqa
 from .util import consecutive, f2cent, index_gradient_filter, relative_keys
@@ -128,6 +129,15 @@ class ChannelView(BaseView):
 
         self.right_click_menu.addMenu(self.fft_smooth_factor_menu)
 
+        self.trace_seconds = tfollow
+        self.trace_length_menu = QMenu(
+            'Trace length [s]', self.right_click_menu)
+        self.trace_length_choices = add_action_group(
+            ['%g' % t for t in (3., 10., 30., channel.buffer_length_seconds)],
+            self.trace_length_menu, self.on_trace_length_select)
+        self.trace_length_choices[0].setChecked(True)
+        self.right_click_menu.addMenu(self.trace_length_menu)
+
         self.spectrum_type_menu = QMenu(
             'lin/log', self.right_click_menu)
         plot_action_group = QActionGroup(self.spectrum_type_menu)
@@ -147,18 +157,24 @@ class ChannelView(BaseView):
         self.trace_widget.clear()
         self.spectrum.clear()
         c = self.channel
-        d = c.fft.latest_frame_data(self.fft_smooth_factor)
-        self.trace_widget.plot(*c.latest_frame(
-            tfollow), ndecimate=25, color=self.color, line_width=1)
+        # the analysis thread appends meanwhile, read consistent copies
+        _, d = c.fft.snapshot(self.fft_smooth_factor)
+        x, ymin, ymax, rms = c.latest_envelope(
+            self.trace_seconds, self.trace_widget.width())
+        y = num.empty(2*len(x), dtype=num.float32)
+        y[::2] = ymin
+        y[1::2] = ymax
+        self.trace_widget.plot(
+            num.repeat(x, 2), y, color=self.color, line_width=1)
         self.plot_spectrum(
             c.freqs, num.mean(d, axis=0), ndecimate=2,
             color=self.color, ignore_nan=True)
 
         self.spectrum.set_xlim(0, 2000)
 
-        confidence = c.pitch_confidence.latest_frame_data(1)
-        if confidence > self.confidence_threshold:
-            x = c.undo_pitch_proxy(c.get_latest_pitch())
+        _, pitch, confidence = c.pitch_snapshot(1)
+        if confidence[0] > self.confidence_threshold:
+            x = c.undo_pitch_proxy(pitch)
             self.spectrum.axvline(x)
 
         if self.freq_keyboard:
@@ -217,6 +233,12 @@ class ChannelView(BaseView):
             self.spectrum.set_ylim(0, 1500000)
             self.spectrum.set_xlim(-5000, 5000)
 
+    def on_trace_length_select(self):
+        for c in self.trace_length_choices:
+            if c.isChecked():
+                self.trace_seconds = float(c.text())
+                break
+
     def on_fft_smooth_select(self):
         for c in self.smooth_choices:
             if c.isChecked():
@@ -344,6 +366,8 @@ class SpectrogramWidget(Axis):
         self.channel = channel
         fake = num.ones((self.nx, self.ny))
         self.image = self.colormesh(z=fake)
+        # data are log power levels already
+        self.image.vmax = 1.
         self.yticks = False
 
         self.right_click_menu = QMenu('RC', self)
@@ -356,8 +380,9 @@ class SpectrogramWidget(Axis):
 
         try:
             x = c.freqs[: self.ny]
-            y = c.xdata[-self.nx:]
-            d = c.fft.latest_frame_data(self.nx)
+            i_filled = c.i_filled
+            y = c.xaxis(max(i_filled-self.nx, 0), i_filled)
+            d = c.fft.latest_frame_levels(self.nx)
             self.image.set_data(d[:, :self.ny])
             self.update_datalims(x, y)
         except ValueError as e:
@@ -501,11 +526,16 @@ class PitchWidget(OverView):
     @qc.pyqtSlot()
     def on_draw(self):
         self.ax.clear()
+        # times relative to the latest frame of all channels, so that the
+        # axis does not have to be rebuilt for every draw
+        frames = [cv.channel.latest_pitch_relative(
+            self.tfollow, clip_min=True) for cv in self.channel_views]
+        tref = max(t for t, _, _, _ in frames)
         for i, cv in enumerate(self.channel_views):
-            x, y = cv.channel.pitch.latest_frame(
-                self.tfollow, clip_min=True)
-            index = num.where(cv.channel.pitch_confidence.latest_frame_data(
-                len(x))>=cv.confidence_threshold)[0]
+            t, x, y, confidence = frames[i]
+            if t != tref:
+                x = x + (t - tref)
+            index = num.where(confidence >= cv.confidence_threshold)[0]
 
             # TODO: attach filter 2000 to slider
             index_grad = index_gradient_filter(x, y, 2000)
@@ -517,15 +547,14 @@ class PitchWidget(OverView):
                 self.ax.plot(
                     x[group], y[group], color=cv.color, line_width=4)
 
-            xstart = num.min(x)
-            self.ax.set_xlim(xstart, xstart+self.tfollow)
+        self.ax.set_xlim(-self.tfollow, 0.)
         try:
             self.current_low_pitch[i] = y[indices_grouped[-1][-1]]
         except IndexError as e:
             pass
 
         self.low_pitch_changed.emit(self.current_low_pitch)
-        self.draw_highlighted(xstart+self.tfollow)
+        self.draw_highlighted(0.)
         self.ax.update()
 
     @qc.pyqtSlot()
@@ -536,9 +565,12 @@ class PitchWidget(OverView):
                 os.makedirs(_fn)
             for i, cv in enumerate(self.channel_views):
                 fn = os.path.join(_fn, 'channel%s.txt' %i)
-                x, y = cv.channel.pitch.xdata, cv.channel.pitch.ydata
-                index = num.where(cv.channel.pitch_confidence.latest_frame_data(
-                    len(x))>=cv.confidence_threshold)
+                pitch = cv.channel.pitch
+                istart, istop = pitch.retained_indices
+                istop, y, confidence = cv.channel.pitch_snapshot(
+                    istop - istart)
+                x = pitch.xaxis(istop - len(y), istop)
+                index = num.where(confidence>=cv.confidence_threshold)
                 num.savetxt(fn, num.vstack((x[index], y[index])).T)
 
 
@@ -572,12 +604,15 @@ class ImageWorker(qc.QObject):
 
     @qc.pyqtSlot()
     def process(self):
-        z = num.asarray(self.channels[0].fft.latest_frame_data(self.nx), dtype=num.float)
+        # runs on the image thread while the gui thread appends spectra
+        z = num.asarray(
+            self.channels[0].fft.snapshot(self.nx)[1], dtype=num.float64)
         nchannels = len(self.channels)
         for c in self.channels:
-            z *= num.asarray(c.fft.latest_frame_data(self.nx), dtype=num.float)
+            z *= c.fft.snapshot(self.nx)[1]
 
-        self.y = c.xdata[-self.nx:]
+        i_filled = c.i_filled
+        self.y = c.xaxis(max(i_filled-self.nx, 0), i_filled)
         self.x = c.freqs[: self.ny]
         self.data = num.ma.log(z[:, :self.ny])**self.scaling
         self.processingFinished.emit()
@@ -672,10 +707,10 @@ class ProductSpectrum(SpectrumWidget): #GLAxis):
     def on_draw(self):
         self.clear()
         ydata = num.asarray(
-            self.channels[0].fft.latest_frame_data(3), dtype=num.float)
+            self.channels[0].fft.snapshot(3)[1], dtype=num.float64)
 
         for c in self.channels[1:]:
-            ydata *= num.asarray(c.fft.latest_frame_data(3), dtype=num.float)
+            ydata *= c.fft.snapshot(3)[1]
 
         self.plotlog(c.freqs, num.mean(ydata, axis=0), ndecimate=2)
 
@@ -692,34 +727,49 @@ class DifferentialPitchWidget(OverView):
     def on_derivative_filter_changed(self, max_derivative):
         self.derivative_filter = max_derivative
 
+    def latest_frames(self, cv):
+        ''' Capture times, pitch and mask of the confident, smooth frames
+        of the channel of *cv* within the latest :py:data:`tfollow`
+        seconds.'''
+        c = cv.channel
+        istart, istop = c.pitch.latest_indices(tfollow)
+        istop, y, confidence = c.pitch_snapshot(istop - istart)
+        x = c.pitch.xaxis(istop - len(y), istop)
+        valid = confidence >= cv.confidence_threshold
+        smooth = num.zeros(len(x), dtype=bool)
+        smooth[index_gradient_filter(x, y, self.derivative_filter)] = True
+        return x, y, valid & smooth
+
     @qc.pyqtSlot()
     def on_draw(self):
         self.ax.clear()
+        frames = [self.latest_frames(cv) for cv in self.channel_views]
+        tstop = max([x[-1] for x, _, _ in frames if len(x)] or [0.])
         for i1, cv1 in enumerate(self.channel_views):
-            x1, y1 = cv1.channel.pitch.latest_frame(tfollow, clip_min=True)
-            xstart = num.min(x1)
-            index1 = cv1.channel.latest_confident_indices(len(x1), cv1.confidence_threshold)
-            index1_grad = index_gradient_filter(x1, y1, self.derivative_filter)
-            index1 = num.intersect1d(index1, index1_grad)
+            x1, y1, valid1 = frames[i1]
             for i2, cv2 in enumerate(self.channel_views):
                 if i1 >= i2:
                     continue
-                x2, y2 = cv2.channel.pitch.latest_frame(tfollow, clip_min=True)
-                index2_grad = index_gradient_filter(x2, y2, self.derivative_filter)
-                index2 = cv2.channel.latest_confident_indices(
-                    len(x2),
-                    cv2.confidence_threshold)
 
-                index2 = num.intersect1d(index2, index2_grad)
-                indices = num.intersect1d(index1, index2)
-                indices_grouped = consecutive(indices)
+                x2, y2, valid2 = frames[i2]
+                if not len(x1) or not len(x2):
+                    continue
+
+                # channels may be analysed at different positions, pair
+                # frames by capture time instead of by index
+                tolerance = 0.5 * cv2.channel.pitch.delta
+                j = num.minimum(
+                    num.searchsorted(x2, x1 - tolerance), len(x2) - 1)
+                paired = valid1 & valid2[j] & (
+                    num.abs(x2[j] - x1) <= tolerance)
+                indices_grouped = consecutive(num.where(paired)[0])
 
                 for group in indices_grouped:
                     if len(group) == 0:
                         continue
 
-                    y = y1[group] - y2[group]
-                    x = x1[group]
+                    y = y1[group] - y2[j[group]]
+                    x = x1[group] - tstop
                     self.ax.plot(
                         x, y, style='solid', line_width=4, color=cv1.color,
                         antialiasing=False)
@@ -727,8 +777,8 @@ class DifferentialPitchWidget(OverView):
                         x, y, style=':', line_width=4, color=cv2.color,
                         antialiasing=False)
 
-        self.ax.set_xlim(xstart, xstart+tfollow)
-        self.draw_highlighted(xstart)
+        self.ax.set_xlim(-tfollow, 0.)
+        self.draw_highlighted(-tfollow)
         self.ax.update()
 
 
@@ -767,16 +817,14 @@ class PitchLevelDifferenceViews(qw.QWidget):
     @qc.pyqtSlot()
     def on_draw(self):
         for cv1, cv2, w in self.widgets:
-            confidence1 = num.where(
-                cv1.channel.pitch_confidence.latest_frame_data(
-                    self.naverage)>cv1.confidence_threshold)
-            confidence2 = num.where(
-                cv2.channel.pitch_confidence.latest_frame_data(
-                    self.naverage)>cv2.confidence_threshold)
+            _, p1, c1 = cv1.channel.pitch_snapshot(self.naverage)
+            _, p2, c2 = cv2.channel.pitch_snapshot(self.naverage)
+            confidence1 = num.where(c1>cv1.confidence_threshold)
+            confidence2 = num.where(c2>cv2.confidence_threshold)
             confidence = num.intersect1d(confidence1, confidence2)
             if len(confidence)>1:
-                d1 = cv1.channel.pitch.latest_frame_data(self.naverage)[confidence]
-                d2 = cv2.channel.pitch.latest_frame_data(self.naverage)[confidence]
+                d1 = p1[confidence]
+                d2 = p2[confidence]
                 w.set_data(num.median(d1-d2))
             else:
                 w.set_data(None)
@@ -812,8 +860,9 @@ class PitchLevelMikadoViews(qw.QWidget):
     @qc.pyqtSlot()
     def on_draw(self):
         for cv1, cv2, w in self.widgets:
-            x1, y1 = cv1.channel.pitch.latest_frame(w.tfollow)
-            x2, y2 = cv2.channel.pitch.latest_frame(w.tfollow)
+            # frames are paired by equal times, relative to the latest
+            _, x1, y1, _ = cv1.channel.latest_pitch_relative(w.tfollow)
+            _, x2, y2, _ = cv2.channel.latest_pitch_relative(w.tfollow)
             w.fill_between(x1, y1, x2, y2)
             w.update()
 
@@ -861,6 +910,10 @@ class MainWidget(qw.QWidget):
 
         self.input_dialog.set_input_callback = self.set_input
         self.data_input = None
+        self.analysis = None
+        self.pitch_workers = settings.pitch_workers
+        self.menu.record_button.toggled.connect(self.on_record_toggled)
+        self.menu.open_file_button.clicked.connect(self.on_open_file)
 
         qc.QTimer().singleShot(0, self.set_input_dialog)
 
@@ -891,15 +944,84 @@ class MainWidget(qw.QWidget):
                 fn = os.path.join(_fn, 'channel%s' %i)
                 tr.channel.save_as(fn, fmt='wav')
 
+    @qc.pyqtSlot(bool)
+    def on_record_toggled(self, checked):
+        '''Start or stop streaming all channels to a wav file'''
+        if not checked:
+            self.with_analysis_lock(self.data_input.stop_recording)
+            return
+
+        fn = QFileDialog().getSaveFileName(
+            self, 'Record to', '.', 'WAV (*.wav)')[0]
+        if not fn:
+            self.menu.record_button.setChecked(False)
+            return
+
+        if not fn.endswith('.wav'):
+            fn += '.wav'
+
+        self.with_analysis_lock(self.data_input.start_recording, fn)
+
+    @qc.pyqtSlot()
+    def on_open_file(self):
+        '''Replay a wav file as input'''
+        fn = QFileDialog().getOpenFileName(
+            self, 'Open', '.', 'WAV (*.wav)')[0]
+        if not fn:
+            return
+
+        try:
+            provider = WavFileProvider(
+                fn, fftsize=int(self.input_dialog.nfft_choice.currentText()),
+                loop=True, buffer_dir=self.input_dialog.buffer_dir)
+        except ValueError as e:
+            logger.error(e)
+            return
+
+        self.set_input(provider)
+
     @qc.pyqtSlot(str)
     def on_algorithm_select(self, arg):
         '''change pitch algorithm'''
-        for c in self.data_input.channels:
-            c.pitch_algorithm = arg
+        with self.analysis.lock:
+            for c in self.data_input.channels:
+                c.pitch_algorithm = arg
+
+        self.setup_pitch_trackers()
+
+    def setup_pitch_trackers(self):
+        ''' Start the worker processes for the current pitch setup on a
+        helper thread. They take seconds to start, which would block the
+        GUI thread or, on the analysis thread, the analysis.'''
+        if self.pitch_workers is None:
+            return
+
+        thread = threading.Thread(
+            target=self.worker.setup_pitch_trackers,
+            kwargs=dict(lock=self.analysis.lock),
+            name='pytch-pitch-setup')
+        thread.daemon = True
+        thread.start()
+
+    def with_analysis_lock(self, f, *args):
+        ''' Call *f* between two analysis passes. Changes to the channels'
+        analysis setup or to the recorder must go through here.'''
+        if self.analysis is None:
+            return f(*args)
+
+        with self.analysis.lock:
+            return f(*args)
+
+    def stop_analysis(self):
+        if self.analysis is not None:
+            self.analysis.stop()
+            self.analysis = None
 
     def cleanup(self):
         ''' clear all widgets. '''
+        self.stop_analysis()
         if self.data_input:
+            self.menu.record_button.setChecked(False)
             self.data_input.stop()
             self.data_input.terminate()
 
@@ -916,8 +1038,16 @@ class MainWidget(qw.QWidget):
 
     def reset(self):
         dinput = self.data_input
+        self.worker = Worker(
+            dinput.channels, pitch_workers=self.pitch_workers,
+            start_pitch_trackers=False)
+        self.analysis = AnalysisThread(dinput, self.worker)
+        with self.analysis.lock:
+            for c in dinput.channels:
+                c.set_spectral_band(0., fmax)
 
-        self.worker = Worker(dinput.channels)
+        self.analysis.start()
+        self.setup_pitch_trackers()
 
         self.channel_views_widget = ChannelViews(dinput.channels)
         channel_views = self.channel_views_widget.views[:-1]
@@ -970,14 +1100,14 @@ class MainWidget(qw.QWidget):
 
     @qc.pyqtSlot()
     def refresh_widgets(self):
-        self.data_input.flush()
-        self.worker.process()
+        # analysis runs on its own thread, only draw its latest results
         self.signal_widgets_clear.emit()
         self.signal_widgets_draw.emit()
 
     def closeEvent(self, ev):
         '''Called when application is closed.'''
         logger.info('closing')
+        self.stop_analysis()
         self.data_input.terminate()
         self.cleanup()
         qw.QWidget.closeEvent(self, ev)
@@ -1028,7 +1158,8 @@ class MainWindow(QMainWindow):
 
 
 def from_command_line(close_after=None, settings=None, check_opengl=False,
-                      disable_opengl=False):
+                      disable_opengl=False, buffer_dir=None,
+                      pitch_workers=None):
     ''' Start the GUI from command line'''
     if check_opengl:
         try:
@@ -1051,6 +1182,8 @@ def from_command_line(close_after=None, settings=None, check_opengl=False,
         settings = DeviceMenuSetting()
         settings.accept = True
 
+    settings.buffer_dir = buffer_dir
+    settings.pitch_workers = pitch_workers
     win = MainWindow(settings=settings)   # noqa
     if close_after:
         close_timer = qc.QTimer()
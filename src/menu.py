@@ -6,13 +6,17 @@ import numpy as num
 
 from .gui_util import FloatQLineEdit, LineEditWithLabel, _colors
 from .util import cent2f
-from .data import get_audio_devices, MicrophoneRecorder
+from .data import device_registry, MicrophoneRecorder
+from .synthetic import SyntheticProvider
+from .shm import SharedMemoryProvider
 
 
 class DeviceMenuSetting:
     device_index = 0
     accept = True
     show_traces = True
+    buffer_dir = None
+    pitch_workers = None
 
     def set_menu(self, m):
         if isinstance(m, MenuWidget):
@@ -22,27 +26,27 @@ class DeviceMenuSetting:
 class DeviceMenu(qw.QDialog):
     ''' Pop up menu at program start devining basic settings'''
 
+    devices_probed = qc.pyqtSignal()
+
     def __init__(self, set_input_callback=None, *args, **kwargs):
         qw.QDialog.__init__(self, *args, **kwargs)
         self.setModal(True)
         self.set_input_callback = set_input_callback
+        self.device_index = None
 
         layout = qw.QVBoxLayout()
         self.setLayout(layout)
 
         layout.addWidget(qw.QLabel('Select Input Device'))
+        input_layout = qw.QHBoxLayout()
         self.select_input = qw.QComboBox()
-        layout.addWidget(self.select_input)
-
-        self.select_input.clear()
-        devices = get_audio_devices()
-        curr = len(devices)-1
-        for idevice, device in enumerate(devices):
-            self.select_input.addItem('%s: %s' % (idevice, device))
-            if 'default' in device:
-                curr = idevice
+        self.select_input.currentIndexChanged.connect(self.on_device_selected)
+        input_layout.addWidget(self.select_input)
 
-        self.select_input.setCurrentIndex(curr)
+        self.refresh_button = qw.QPushButton('Refresh')
+        self.refresh_button.clicked.connect(self.refresh_devices)
+        input_layout.addWidget(self.refresh_button)
+        layout.addLayout(input_layout)
 
         self.edit_sampling_rate = LineEditWithLabel(
             'Sampling rate', default=44100)
@@ -54,6 +58,19 @@ class DeviceMenu(qw.QDialog):
         self.edit_nchannels.edit.setValidator(qg.QDoubleValidator())
         layout.addWidget(self.edit_nchannels)
 
+        self.edit_buffer_length = LineEditWithLabel(
+            'History [s]', default=40)
+        self.edit_buffer_length.edit.setValidator(qg.QDoubleValidator())
+        layout.addWidget(self.edit_buffer_length)
+        self.buffer_dir = None
+
+        self.box_synthetic = qw.QCheckBox('Synthetic test signal')
+        layout.addWidget(self.box_synthetic)
+
+        self.box_capture_process = qw.QCheckBox(
+            'Capture in separate process')
+        layout.addWidget(self.box_capture_process)
+
         layout.addWidget(qw.QLabel('NFFT'))
         self.nfft_choice = self.get_nfft_box()
         layout.addWidget(self.nfft_choice)
@@ -64,6 +81,69 @@ class DeviceMenu(qw.QDialog):
         buttons.rejected.connect(self.close)
         layout.addWidget(buttons)
 
+        # probing runs in a background thread, the signal hands the result
+        # over to the gui thread
+        self.devices_probed.connect(self.on_devices_probed)
+        if device_registry.probed:
+            self.on_devices_probed()
+        else:
+            self.refresh_devices()
+
+    def refresh_devices(self):
+        self.select_input.setEnabled(False)
+        self.refresh_button.setEnabled(False)
+        self.select_input.clear()
+        self.select_input.addItem('Probing devices...')
+        device_registry.refresh(self.devices_probed.emit)
+
+    @qc.pyqtSlot()
+    def on_devices_probed(self):
+        devices = device_registry.device_names()
+        self.select_input.blockSignals(True)
+        self.select_input.clear()
+        for idevice, device in enumerate(devices):
+            self.select_input.addItem('%s: %s' % (idevice, device))
+        self.select_input.blockSignals(False)
+
+        curr = self.device_index
+        if curr is None or curr >= len(devices):
+            curr = len(devices)-1
+            for idevice, device in enumerate(devices):
+                if 'default' in device:
+                    curr = idevice
+
+        self.select_input.setEnabled(True)
+        self.refresh_button.setEnabled(True)
+        self.select_input.setCurrentIndex(curr)
+        self.on_device_selected(curr)
+
+    @qc.pyqtSlot(int)
+    def on_device_selected(self, index):
+        if not self.select_input.isEnabled() or index < 0:
+            return
+
+        self.device_index = index
+        rates = device_registry.sampling_rates(index)
+        edit = self.edit_sampling_rate.edit
+        edit.setToolTip(
+            'Supported: %s' % ', '.join(str(r) for r in rates) if rates
+            else '')
+        try:
+            rate = int(float(edit.text()))
+        except ValueError:
+            rate = None
+
+        if rates and rate not in rates:
+            edit.setText(str(44100 if 44100 in rates else max(rates)))
+
+    def get_device_no(self):
+        ''' Selected device index or None for the default device, if
+        devices have not been probed yet.'''
+        if not self.select_input.isEnabled():
+            return self.device_index
+        index = self.select_input.currentIndex()
+        return index if index >= 0 else None
+
     def get_nfft_box(self):
         ''' Return a qw.QSlider for modifying FFT width'''
         b = qw.QComboBox()
@@ -77,12 +157,37 @@ class DeviceMenu(qw.QDialog):
 
     def on_ok_clicked(self):
         fftsize = int(self.nfft_choice.currentText())
+        if self.box_synthetic.isChecked():
+            self.set_input_callback(SyntheticProvider(
+                nchannels=int(self.edit_nchannels.value),
+                sampling_rate=int(self.edit_sampling_rate.value),
+                fftsize=fftsize,
+                buffer_length_seconds=float(self.edit_buffer_length.value),
+                buffer_dir=self.buffer_dir))
+            self.hide()
+            return
+
+        if self.box_capture_process.isChecked():
+            self.set_input_callback(SharedMemoryProvider(
+                device_no=self.get_device_no(),
+                sampling_rate=int(self.edit_sampling_rate.value),
+                nchannels=int(self.edit_nchannels.value),
+                chunksize=512,
+                fftsize=fftsize,
+                buffer_length_seconds=float(self.edit_buffer_length.value),
+                buffer_dir=self.buffer_dir))
+            self.hide()
+            return
+
         recorder = MicrophoneRecorder(
                         chunksize=512,
-                        device_no=self.select_input.currentIndex(),
+                        device_no=self.get_device_no(),
                         sampling_rate=int(self.edit_sampling_rate.value),
                         fftsize=int(fftsize),
-                        nchannels=int(self.edit_nchannels.value))
+                        nchannels=int(self.edit_nchannels.value),
+                        buffer_length_seconds=float(
+                            self.edit_buffer_length.value),
+                        buffer_dir=self.buffer_dir)
         self.set_input_callback(recorder)
         self.hide()
 
@@ -97,7 +202,11 @@ class DeviceMenu(qw.QDialog):
         menu = cls(parent=parent)
 
         if settings.device_index is not None:
-            menu.select_input.setCurrentIndex(settings.device_index)
+            menu.device_index = settings.device_index
+            if device_registry.probed:
+                menu.select_input.setCurrentIndex(settings.device_index)
+
+        menu.buffer_dir = settings.buffer_dir
 
         if accept:
             qc.QTimer().singleShot(10, menu.on_ok_clicked)
@@ -127,6 +236,13 @@ class MenuWidget(qw.QFrame):
         self.save_as_button = qw.QPushButton('Save as')
         layout.addWidget(self.save_as_button, 1, 1)
 
+        self.record_button = qw.QPushButton('Record')
+        self.record_button.setCheckable(True)
+        layout.addWidget(self.record_button, 2, 0)
+
+        self.open_file_button = qw.QPushButton('Open WAV')
+        layout.addWidget(self.open_file_button, 2, 1)
+
         layout.addWidget(qw.QLabel('Confidence Threshold'), 4, 0)
         self.noise_thresh_slider = qw.QSlider()
         self.noise_thresh_slider.setRange(0, 15)
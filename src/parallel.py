@@ -0,0 +1,194 @@
+''' Pitch tracking of many channels in a pool of worker processes.
+
+aubio pitch detection runs per channel and holds the GIL, so on interfaces
+with many channels it is spread across processes. Each worker process owns
+the aubio detectors of a fixed shard of channels. Hops of audio and the
+results are exchanged through one shared memory block, only the number of
+hops to process travels through a pipe.
+'''
+import logging
+import multiprocessing
+import numpy as num
+
+from multiprocessing import shared_memory
+
+from pytch.data import make_pitch_detector
+from pytch.shm import attach_shared_memory
+
+
+logger = logging.getLogger(__name__)
+
+
+def shared_arrays(buf, nchannels, max_hops, hopsize):
+    ''' Audio array of shape (nchannels, max_hops*hopsize) and results array
+    of shape (2, nchannels, max_hops), holding pitch and confidence, in
+    *buf*.'''
+    naudio = nchannels * max_hops * hopsize
+    audio = num.frombuffer(buf, dtype=num.float32, count=naudio).reshape(
+        nchannels, max_hops*hopsize)
+    results = num.frombuffer(
+        buf, dtype=num.float32, count=2*nchannels*max_hops,
+        offset=naudio*4).reshape(2, nchannels, max_hops)
+    return audio, results
+
+
+def run_pitch_worker(name, ichannels, nchannels, max_hops, hopsize, fftsize,
+                     sampling_rate, algorithm, connection):
+    ''' Track the pitch of channels *ichannels* in the shared block *name*
+    whenever a number of hops is received on *connection*, until None is
+    received. Runs in the worker process.'''
+    shm = None
+    audio = results = hops = None
+    try:
+        shm = attach_shared_memory(name)
+        audio, results = shared_arrays(shm.buf, nchannels, max_hops, hopsize)
+        detectors = [
+            make_pitch_detector(algorithm, fftsize, hopsize, sampling_rate)
+            for i in ichannels]
+
+        while True:
+            nhops = connection.recv()
+            if nhops is None:
+                break
+
+            for ichannel, pitch_o in zip(ichannels, detectors):
+                hops = audio[ichannel, :nhops*hopsize].reshape(nhops, hopsize)
+                for ihop in range(nhops):
+                    results[0, ichannel, ihop] = pitch_o(hops[ihop])[0]
+                    results[1, ichannel, ihop] = pitch_o.get_confidence()
+
+            connection.send(nhops)
+    finally:
+        # numpy views must be released before the buffer can be closed
+        audio = results = hops = None
+        if shm is not None:
+            shm.close()
+
+        # the parent sees the end of the pipe if this worker fails
+        connection.close()
+
+
+class ParallelPitchTracker(object):
+    ''' Track the pitch of *nchannels* channels in *nworkers* processes.
+
+    Channels are split into contiguous shards, one per process. Worker
+    processes are started with the *spawn* method, as the tracker may be
+    created on a thread other than the main thread.
+
+    :param nworkers: number of worker processes, defaults to the number of
+        cores. At most one per channel.
+    :param max_hops: hops per channel exchanged at once. Longer input is
+        processed in several rounds.
+    :param timeout: interval in seconds in which workers that do not answer
+        are checked for being alive'''
+
+    def __init__(self, nchannels, sampling_rate, fftsize, hopsize,
+                 algorithm='yinfft', nworkers=None, max_hops=64, timeout=1.):
+        self.nchannels = nchannels
+        self.hopsize = hopsize
+        self.max_hops = max_hops
+        self.timeout = timeout
+        nworkers = min(nworkers or multiprocessing.cpu_count(), nchannels)
+
+        size = 4 * nchannels * max_hops * (hopsize + 2)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.audio, self.results = shared_arrays(
+            self.shm.buf, nchannels, max_hops, hopsize)
+
+        context = multiprocessing.get_context('spawn')
+        self.connections = []
+        self.processes = []
+        for ichannels in num.array_split(num.arange(nchannels), nworkers):
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=run_pitch_worker,
+                args=(self.shm.name, ichannels.tolist(), nchannels, max_hops,
+                      hopsize, fftsize, sampling_rate, algorithm,
+                      child_connection),
+                name='pytch-pitch')
+            process.daemon = True
+            process.start()
+            # only the worker holds the child end, so that its exit ends
+            # the pipe
+            child_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        logger.debug('started %i pitch worker processes' % nworkers)
+
+    @property
+    def nworkers(self):
+        return len(self.processes)
+
+    def receive(self, iworker):
+        ''' Wait for the answer of worker *iworker*.
+
+        :raises: :py:exc:`RuntimeError` if the worker exited'''
+        connection = self.connections[iworker]
+        process = self.processes[iworker]
+        while not connection.poll(self.timeout):
+            if not process.is_alive():
+                break
+
+        try:
+            return connection.recv()
+        except (EOFError, OSError):
+            raise self.worker_error(iworker)
+
+    def worker_error(self, iworker):
+        process = self.processes[iworker]
+        process.join(self.timeout)
+        return RuntimeError('pitch worker %i exited with code %s' % (
+            iworker, process.exitcode))
+
+    def process(self, audio):
+        ''' Pitch and confidence of each hop in *audio* of shape
+        (nchannels, nhops*hopsize).
+
+        :returns: tuple of float32 arrays of shape (nchannels, nhops)
+        :raises: :py:exc:`RuntimeError` if a worker process failed. The
+            tracker cannot be used any further then.'''
+        nhops = audio.shape[1] // self.hopsize
+        pitch = num.empty((self.nchannels, nhops), dtype=num.float32)
+        confidence = num.empty((self.nchannels, nhops), dtype=num.float32)
+        for istart in range(0, nhops, self.max_hops):
+            n = min(nhops - istart, self.max_hops)
+            self.audio[:, :n*self.hopsize] = audio[
+                :, istart*self.hopsize: (istart+n)*self.hopsize]
+            for iworker, connection in enumerate(self.connections):
+                try:
+                    connection.send(n)
+                except OSError:
+                    raise self.worker_error(iworker)
+
+            for iworker in range(self.nworkers):
+                self.receive(iworker)
+
+            pitch[:, istart: istart+n] = self.results[0, :, :n]
+            confidence[:, istart: istart+n] = self.results[1, :, :n]
+
+        return pitch, confidence
+
+    def close(self):
+        ''' Stop the worker processes and release the shared memory.'''
+        if self.shm is None:
+            return
+
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                # worker is gone already
+                pass
+
+        for process, connection in zip(self.processes, self.connections):
+            process.join(2.)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+
+        self.audio = None
+        self.results = None
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
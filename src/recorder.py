@@ -0,0 +1,174 @@
+import threading
+import queue
+import struct
+import logging
+import numpy as num
+
+
+logger = logging.getLogger(__name__)
+
+
+RIFF_MAX = 0xffffffff
+
+
+class WavWriter(object):
+    ''' Minimal writer of int16 PCM WAV files of unlimited length.
+
+    Files are written as plain RIFF WAV. A JUNK chunk reserves room for a
+    ds64 chunk, so that :py:meth:`close` can turn the header into RF64 (EBU
+    Tech 3306) in place if the file outgrows the 4 GiB that 32-bit RIFF
+    sizes can hold.
+
+    :param f: file object opened for binary writing'''
+
+    riff_limit = RIFF_MAX
+
+    def __init__(self, f, nchannels, sampling_rate):
+        self.f = f
+        self.nchannels = nchannels
+        self.n_data_bytes = 0
+        block_align = 2 * nchannels
+        f.write(b'RIFF' + struct.pack('<I', 0) + b'WAVE')
+        f.write(b'JUNK' + struct.pack('<I', 28) + bytes(28))
+        f.write(b'fmt ' + struct.pack(
+            '<IHHIIHH', 16, 1, nchannels, sampling_rate,
+            sampling_rate*block_align, block_align, 16))
+        f.write(b'data' + struct.pack('<I', 0))
+        self.n_header_bytes = f.tell()
+
+    def write(self, data):
+        ''' Append the raw interleaved frames in the bytes-like *data*.'''
+        self.f.write(data)
+        self.n_data_bytes += len(data)
+
+    def close(self):
+        ''' Write the final sizes into the header and close the file.'''
+        f = self.f
+        riff_size = self.n_header_bytes - 8 + self.n_data_bytes
+        f.seek(0)
+        if riff_size > self.riff_limit:
+            nframes = self.n_data_bytes // (2*self.nchannels)
+            f.write(b'RF64' + struct.pack('<I', RIFF_MAX) + b'WAVE')
+            f.write(b'ds64' + struct.pack(
+                '<IQQQI', 28, riff_size, self.n_data_bytes, nframes, 0))
+            data_size = RIFF_MAX
+        else:
+            f.write(b'RIFF' + struct.pack('<I', riff_size))
+            data_size = self.n_data_bytes
+
+        f.seek(self.n_header_bytes - 4)
+        f.write(struct.pack('<I', data_size))
+        f.close()
+
+
+class WavRecorder(object):
+    ''' Stream interleaved int16 frames to a multichannel WAV file.
+
+    Writing happens on a dedicated thread. :py:meth:`put` never blocks: if
+    the bounded queue is full the block is dropped and counted in
+    :py:attr:`n_dropped_blocks`. If writing fails, the exception is kept in
+    :py:attr:`error` and all further blocks are dropped, as are blocks put
+    after :py:meth:`stop`.
+
+    :param fn: output file name
+    :param nchannels: number of interleaved channels
+    :param sampling_rate: sampling rate in Hz
+    :param max_queue_blocks: maximum number of blocks waiting to be written
+    :param buffer_size: size of the file write buffer in bytes'''
+
+    def __init__(self, fn, nchannels, sampling_rate, max_queue_blocks=256,
+                 buffer_size=4*1024*1024):
+        self.fn = fn
+        self.nchannels = int(nchannels)
+        self.sampling_rate = int(sampling_rate)
+        self.buffer_size = buffer_size
+        self.queue = queue.Queue(maxsize=max_queue_blocks)
+        self.n_dropped_blocks = 0
+        self.n_frames_written = 0
+        self.error = None
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_recording(self):
+        return self._thread is not None
+
+    def start(self):
+        ''' Open the output file and start the writer thread.'''
+        f = open(self.fn, 'wb', buffering=self.buffer_size)
+        writer = WavWriter(f, self.nchannels, self.sampling_rate)
+
+        self._thread = threading.Thread(
+            target=self.run, args=(writer, ), name='pytch-wav-recorder')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info('recording to %s' % self.fn)
+
+    def put(self, frames):
+        ''' Queue a copy of *frames* (shape (n, nchannels)) for writing.
+
+        :returns: False if the block was dropped'''
+        with self._lock:
+            if self.error is not None or self._closed:
+                self.n_dropped_blocks += 1
+                return False
+
+            try:
+                self.queue.put_nowait(num.array(frames, dtype=num.int16))
+            except queue.Full:
+                self.n_dropped_blocks += 1
+                return False
+
+        return True
+
+    def run(self, writer):
+        try:
+            while True:
+                block = self.queue.get()
+                if block is None:
+                    break
+
+                writer.write(memoryview(block).cast('B'))
+                self.n_frames_written += block.shape[0]
+
+        except Exception as e:
+            self.error = e
+            logger.error('recording to %s failed: %s' % (self.fn, e))
+
+        finally:
+            try:
+                writer.close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+                logger.error('finalizing %s failed: %s' % (self.fn, e))
+
+    def stop(self, timeout=1.):
+        ''' Write all queued blocks, finalize the file and join the writer
+        thread.
+
+        :param timeout: time in seconds to wait for room in the queue for
+            the end marker, checked repeatedly while the writer is alive'''
+        thread = self._thread
+        if thread is None:
+            return
+
+        with self._lock:
+            # blocks put later would land behind the end marker
+            self._closed = True
+
+        # a writer that died does not consume the queue anymore
+        while thread.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+                break
+            except queue.Full:
+                pass
+
+        thread.join()
+        self._thread = None
+        if self.n_dropped_blocks:
+            logger.warning('recorder dropped %i blocks' % self.n_dropped_blocks)
+        if self.error is None:
+            logger.info('finished recording %s' % self.fn)
@@ -0,0 +1,294 @@
+''' Audio capture in a separate process, handed over through shared memory.
+
+The capture process owns the PortAudio stream and writes interleaved int16
+frames into a :py:class:`SharedCaptureRing`. A
+:py:class:`SharedMemoryProvider` in the GUI process attaches to the ring and
+drains it in :py:meth:`~pytch.data.DataProvider.flush`. Capture therefore
+keeps running at full rate no matter how long the Qt event loop is busy.
+
+The capture side can also be started standalone::
+
+    python -m pytch.shm --name pytch-capture --nchannels 2
+'''
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+import numpy as num
+
+from multiprocessing import shared_memory, resource_tracker
+
+from pytch.data import CaptureRing, DataProvider, StreamClock
+
+
+logger = logging.getLogger(__name__)
+
+RUN, PAUSE, STOP = range(3)
+
+_attach_lock = threading.Lock()
+
+
+def attach_shared_memory(name):
+    ''' Attach to the existing shared memory block *name* without handing it
+    to the resource tracker, which would otherwise unlink it when this
+    process exits.'''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # python < 3.13 always registers. Unregistering afterwards would also
+    # drop the creator's registration if it shares our resource tracker
+    # (same process, spawned children), so skip registering instead.
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedCaptureRing(CaptureRing):
+    ''' :py:class:`~pytch.data.CaptureRing` in a named shared memory block.
+
+    Header fields behind the ring cursors hold the layout and the capture
+    state, so that attaching only requires the *name*.
+
+    :param create: create a new block. Otherwise attach to the existing
+        block *name*.'''
+
+    _inchannels, _inframes, _isampling_rate, _istate = range(4, 8)
+
+    def __init__(self, name=None, nchannels=None, nframes=None,
+                 sampling_rate=None, create=True):
+        if create:
+            size = self.nbytes_required(nchannels, nframes)
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name)
+            header = num.frombuffer(
+                self.shm.buf, dtype=num.int64, count=self.nheader)
+            nchannels = int(header[self._inchannels])
+            nframes = int(header[self._inframes])
+            del header
+
+        CaptureRing.__init__(self, nchannels, nframes, buffer=self.shm.buf)
+        if create:
+            self.reset()
+            self.header[self._inchannels] = nchannels
+            self.header[self._inframes] = nframes
+            self.header[self._isampling_rate] = sampling_rate
+            self.state = PAUSE
+
+    @classmethod
+    def attach(cls, name):
+        return cls(name=name, create=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def sampling_rate(self):
+        return int(self.header[self._isampling_rate])
+
+    @property
+    def state(self):
+        ''' One of :py:data:`RUN`, :py:data:`PAUSE` or :py:data:`STOP`,
+        controlling the capture process.'''
+        return int(self.header[self._istate])
+
+    @state.setter
+    def state(self, state):
+        self.header[self._istate] = state
+
+    def close(self):
+        # numpy views must be released before the buffer can be closed
+        self.header = None
+        self.anchors = None
+        self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def run_capture(name, device_no=None, chunksize=512):
+    ''' Capture from *device_no* into the shared ring *name* until its state
+    is set to :py:data:`STOP`. Runs in the capture process.'''
+    import pyaudio
+
+    ring = SharedCaptureRing.attach(name)
+    clock = StreamClock(ring.sampling_rate)
+
+    def new_frame(data, frame_count, time_info, status):
+        state = ring.state
+        if state == STOP:
+            return None, pyaudio.paComplete
+
+        if state == RUN:
+            ring.write(num.frombuffer(data, dtype=num.int16),
+                       t=clock(time_info, frame_count))
+
+        return None, pyaudio.paContinue
+
+    p = pyaudio.PyAudio()
+    if device_no is None:
+        device_no = p.get_default_input_device_info()['index']
+
+    stream = p.open(format=pyaudio.paInt16,
+                    channels=ring.nchannels,
+                    rate=ring.sampling_rate,
+                    input=True,
+                    output=False,
+                    frames_per_buffer=chunksize,
+                    input_device_index=device_no,
+                    stream_callback=new_frame)
+    stream.start_stream()
+    logger.debug('capture process started on device %s' % device_no)
+    try:
+        while ring.state != STOP:
+            time.sleep(0.05)
+    finally:
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+        logger.debug('capture process finished, %i overflows' %
+                     ring.n_overflows)
+        ring.close()
+
+
+class SharedMemoryProvider(DataProvider):
+    ''' Data provider reading from a capture process through shared memory.
+
+    :param name: name of the shared ring of an already running capture
+        process. If None, a ring is created and a capture process is spawned
+        with *device_no*, *sampling_rate*, *nchannels* and *chunksize*.'''
+
+    def __init__(self, name=None, device_no=None, sampling_rate=44100,
+                 nchannels=2, chunksize=512, fftsize=1024,
+                 capture_buffer_seconds=5., buffer_length_seconds=40,
+                 buffer_dir=None):
+        DataProvider.__init__(self)
+        self.owner = name is None
+        if self.owner:
+            self.capture_ring = SharedCaptureRing(
+                nchannels=nchannels,
+                nframes=int(capture_buffer_seconds*sampling_rate),
+                sampling_rate=sampling_rate)
+        else:
+            self.capture_ring = SharedCaptureRing.attach(name)
+
+        ring = self.capture_ring
+        self.nchannels = ring.nchannels
+        self.sampling_rate = ring.sampling_rate
+        self.device_no = device_no
+        self.chunksize = chunksize
+        self.process = None
+        self.capture_failed = False
+
+        self.setup_channels(
+            self.nchannels, fftsize,
+            buffer_length_seconds=buffer_length_seconds,
+            buffer_dir=buffer_dir)
+
+        self.setup_deinterleave(self.nchannels, ring.nframes)
+
+    @property
+    def n_overflows(self):
+        return self.capture_ring.n_overflows
+
+    @property
+    def capture_alive(self):
+        ''' False if the capture process spawned by this provider exited,
+        e.g. because the input device could not be opened.'''
+        return self.process is None or self.process.is_alive()
+
+    def start_new_stream(self):
+        if self.owner and self.process is None:
+            # forking the threaded gui process could inherit held locks
+            context = multiprocessing.get_context('spawn')
+            self.process = context.Process(
+                target=run_capture,
+                args=(self.capture_ring.name, self.device_no, self.chunksize),
+                name='pytch-capture')
+            self.process.daemon = True
+            self.process.start()
+
+        self.start()
+
+    def start(self):
+        ring = self.capture_ring
+        # frames captured while paused are stale
+        ring.advance(ring.n_available)
+        ring.state = RUN
+
+    def stop(self):
+        if self.capture_ring is not None:
+            self.capture_ring.state = PAUSE
+
+    def flush(self):
+        if self.capture_ring is None:
+            return
+
+        if not self.capture_alive and not self.capture_failed:
+            self.capture_failed = True
+            logger.error('capture process exited with code %s' %
+                         self.process.exitcode)
+
+        DataProvider.flush(self)
+
+    def terminate(self):
+        DataProvider.terminate(self)
+        ring = self.capture_ring
+        if ring is None:
+            return
+
+        self.capture_ring = None
+        if self.owner:
+            ring.state = STOP
+            if self.process is not None:
+                self.process.join(2.)
+                self.process = None
+
+            ring.close()
+            ring.unlink()
+        else:
+            ring.close()
+
+
+def from_command_line():
+    parser = argparse.ArgumentParser('pytch.shm')
+    parser.add_argument('--name', default='pytch-capture',
+                        help='Name of the shared memory block.')
+    parser.add_argument('--device', dest='device_no', type=int, default=None,
+                        help='Input device index.')
+    parser.add_argument('--sampling-rate', dest='sampling_rate', type=int,
+                        default=44100)
+    parser.add_argument('--nchannels', type=int, default=2)
+    parser.add_argument('--chunksize', type=int, default=512)
+    parser.add_argument('--buffer-seconds', dest='buffer_seconds',
+                        type=float, default=5.)
+    args = parser.parse_args()
+
+    ring = SharedCaptureRing(
+        name=args.name, nchannels=args.nchannels,
+        nframes=int(args.buffer_seconds*args.sampling_rate),
+        sampling_rate=args.sampling_rate)
+    ring.state = RUN
+    logger.info('capturing into shared memory %s' % ring.name)
+    try:
+        run_capture(ring.name, args.device_no, args.chunksize)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    from_command_line()
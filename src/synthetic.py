@@ -0,0 +1,169 @@
+''' Reproducible synthetic input for tests and load generation.'''
+import logging
+import numpy as num
+
+from pytch.data import PacedProvider
+
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceGenerator(object):
+    ''' Harmonic, voice-like test signal.
+
+    The signal is a sequence of notes and rests. Each note glides from the
+    previous pitch to a random target pitch and carries a delayed vibrato.
+    Harmonic amplitudes decay with harmonic number, white noise is added on
+    top. Output is fully determined by *seed* and, up to floating point
+    rounding, does not depend on the block sizes passed to
+    :py:meth:`generate`.
+
+    :param f0_range: range of note pitches in Hz
+    :param note_duration: range of note durations in seconds
+    :param rest_probability: probability that a note is a rest
+    :param glide_duration: duration of the glide between two notes in seconds
+    :param vibrato_rate: vibrato frequency in Hz
+    :param vibrato_depth: vibrato amplitude in cents
+    :param nharmonics: number of harmonics including the fundamental
+    :param noise_level: noise standard deviation relative to *amplitude*
+    :param amplitude: peak amplitude of the harmonic part
+    :param attack: duration of note on- and offset ramps in seconds'''
+
+    def __init__(self, sampling_rate, seed=0, f0_range=(110., 660.),
+                 note_duration=(0.3, 1.5), rest_probability=0.15,
+                 glide_duration=0.08, vibrato_rate=5.5, vibrato_depth=30.,
+                 nharmonics=8, noise_level=0.01, amplitude=8000.,
+                 attack=0.02):
+        self.sampling_rate = float(sampling_rate)
+        self.f0_range = f0_range
+        self.note_duration = note_duration
+        self.rest_probability = rest_probability
+        self.glide_duration = glide_duration
+        self.vibrato_rate = vibrato_rate
+        self.vibrato_depth = vibrato_depth
+        self.noise_level = noise_level
+        self.amplitude = amplitude
+        self.attack = attack
+
+        k = num.arange(1, nharmonics+1)
+        self.harmonics = k[:, num.newaxis]
+        self.harmonic_amplitudes = (k**-1.5 / num.sum(k**-1.5))[:, num.newaxis]
+
+        self._note_rng = num.random.RandomState(seed)
+        self._noise_rng = num.random.RandomState(seed + 2**16)
+        self._phase = 0.
+        self._vibrato_phase = 0.
+        self._note_elapsed = 0
+        self._note_length = 0
+        self._is_rest = True
+        self.f0 = self.f0_from = float(num.sqrt(f0_range[0]*f0_range[1]))
+
+    def next_note(self):
+        rng = self._note_rng
+        self._note_length = int(rng.uniform(*self.note_duration) *
+                                self.sampling_rate)
+        self._note_elapsed = 0
+        self._is_rest = rng.uniform() < self.rest_probability
+        self.f0_from = self.f0
+        if not self._is_rest:
+            self.f0 = float(num.exp(rng.uniform(*num.log(self.f0_range))))
+
+    def generate(self, n, out=None):
+        ''' Return the next *n* samples as float64 array, optionally written
+        into *out*.'''
+        if out is None:
+            out = num.empty(n)
+
+        sr = self.sampling_rate
+        i = 0
+        while i < n:
+            if self._note_elapsed >= self._note_length:
+                self.next_note()
+
+            m = min(n-i, self._note_length-self._note_elapsed)
+            isample = self._note_elapsed + num.arange(1, m+1)
+            t = isample / sr
+
+            glide = num.clip(t / self.glide_duration, 0., 1.)
+            cents = 1200. * num.log2(self.f0_from / self.f0) * (1.-glide)
+            vibrato_phase = self._vibrato_phase + \
+                2. * num.pi * self.vibrato_rate * num.arange(1, m+1) / sr
+            cents += self.vibrato_depth * num.sin(vibrato_phase) * \
+                num.clip(t / 0.3, 0., 1.)
+
+            phase = self._phase + num.cumsum(
+                2. * num.pi * self.f0 * num.exp2(cents/1200.) / sr)
+
+            if self._is_rest:
+                out[i:i+m] = 0.
+            else:
+                tnote = self._note_length / sr
+                envelope = num.clip(
+                    num.minimum(t, tnote-t) / self.attack, 0., 1.)
+                out[i:i+m] = num.sum(
+                    self.harmonic_amplitudes *
+                    num.sin(self.harmonics * phase), axis=0)
+                out[i:i+m] *= envelope * self.amplitude
+
+            self._phase = phase[-1] % (2.*num.pi)
+            self._vibrato_phase = vibrato_phase[-1] % (2.*num.pi)
+            self._note_elapsed += m
+            i += m
+
+        out += self._noise_rng.normal(
+            0., self.noise_level*self.amplitude, size=n)
+        return out
+
+
+class SyntheticProvider(PacedProvider):
+    ''' Feed channels with :py:class:`VoiceGenerator` signals.
+
+    Channel *i* is generated with seed *seed+i*. Further keyword arguments
+    are passed to :py:class:`VoiceGenerator`.
+
+    :param duration: total duration in seconds or None for an endless
+        signal
+    :param realtime: see :py:class:`pytch.data.PacedProvider`'''
+
+    def __init__(self, nchannels=2, sampling_rate=44100, fftsize=1024,
+                 seed=0, duration=None, realtime=True, frames_per_flush=None,
+                 buffer_length_seconds=40, buffer_dir=None,
+                 **generator_kwargs):
+        nframes = int(duration*sampling_rate) if duration is not None \
+            else None
+
+        PacedProvider.__init__(
+            self, sampling_rate, nchannels, fftsize=fftsize,
+            realtime=realtime, frames_per_flush=frames_per_flush,
+            nframes=nframes, buffer_length_seconds=buffer_length_seconds,
+            buffer_dir=buffer_dir)
+
+        self.seed = seed
+        self.generator_kwargs = generator_kwargs
+        self.reset_generators()
+        self._signal = num.empty(self.max_frames_deliver)
+        self._frames = num.empty(
+            (self.max_frames_deliver, self.nchannels), dtype=num.int16)
+
+        for i, c in enumerate(self.channels):
+            c.name = 'synthetic:%s' % i
+
+    def reset_generators(self):
+        self.generators = [
+            VoiceGenerator(self.sampling_rate, seed=self.seed+i,
+                           **self.generator_kwargs)
+            for i in range(self.nchannels)]
+
+    def start_new_stream(self):
+        self.reset_generators()
+        PacedProvider.start_new_stream(self)
+
+    def read_frames(self, istart, n):
+        signal = self._signal[:n]
+        frames = self._frames[:n]
+        for i, generator in enumerate(self.generators):
+            generator.generate(n, out=signal)
+            num.clip(signal, -32768, 32767, out=signal)
+            frames[:, i] = signal
+
+        return frames
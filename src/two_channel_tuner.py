@@ -1,40 +1,350 @@
 # -*- coding: utf-8 -*-
 
+import time
+import threading
+import contextlib
 import numpy as num
 import logging
 
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as sfft
+
+from pytch.yin import yin
+
 logger = logging.getLogger(__name__)
 
 
 class Worker():
 
-    def __init__(self, channels):
-        ''' Grabbing data, working on it and saving the results
+    def __init__(self, channels, fft_workers=None, pitch_workers=None,
+                 start_pitch_trackers=True):
+        ''' Analyse all complete hops of *channels* which arrived since the
+        last call of :py:meth:`process`.
 
-        :param buffer_length: in seconds'''
+        Analysis is driven by sample counts only. Each channel gets one
+        spectrum and pitch estimate per hop, no matter how often or how
+        regularly :py:meth:`process` is called.
+
+        :param fft_workers: number of threads for the batched FFT, see
+            :py:func:`scipy.fft.rfft`
+        :param pitch_workers: if given, pitch tracking runs in this many
+            processes, see :py:class:`pytch.parallel.ParallelPitchTracker`.
+            0 uses one process per core.
+        :param start_pitch_trackers: start the processes here. If False,
+            they are started by the first call of
+            :py:meth:`setup_pitch_trackers`, e.g. on a helper thread.'''
 
         self.channels = channels
+        self.fft_workers = fft_workers
+        self.pitch_workers = pitch_workers
+        self.pitch_trackers = {}
+        self.closed = False
+        # serializes setups, guards swapping and closing the trackers
+        self._setup_lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+        self.work = {}
+        self.windows = {}
+        if start_pitch_trackers:
+            self.setup_pitch_trackers()
+
+    def get_work(self, name, shape, dtype=num.float32):
+        ''' Reusable work array *name* of *shape*. Grows along the first
+        axis as needed.'''
+        key = (name, shape[1:])
+        work = self.work.get(key, None)
+        if work is None or work.shape[0] < shape[0]:
+            work = num.empty(shape, dtype=dtype)
+            self.work[key] = work
+
+        return work[:shape[0]]
+
+    def get_window(self, fftsize):
+        ''' Cached float32 Hann window of length *fftsize*'''
+        win = self.windows.get(fftsize, None)
+        if win is None:
+            win = num.hanning(fftsize).astype(num.float32)
+            self.windows[fftsize] = win
+
+        return win
+
+    def channel_groups(self):
+        ''' Channels grouped by fft size, hop size and analysis state'''
+        groups = {}
+        for channel in self.channels:
+            key = (channel.fftsize, channel.hopsize, channel.i_analysed,
+                   channel.i_filled)
+            groups.setdefault(key, []).append(channel)
+
+        return groups
+
+    def setup_groups(self):
+        ''' Channels grouped by the setup of their pitch tracker, no matter
+        how far they are analysed'''
+        groups = {}
+        for channel in self.channels:
+            key = (channel.sampling_rate, channel.fftsize, channel.hopsize,
+                   channel.pitch_algorithm)
+            groups.setdefault(key, []).append(channel)
+
+        return groups
+
+    def read_frames(self, channels, fftsize, hopsize, nhops):
+        ''' Windows of *fftsize* samples of *channels* ending at each of
+        their next *nhops* hops, as float32 array of shape
+        (nhops, nchannels, fftsize). Channels which make up a whole
+        :py:class:`pytch.data.ChannelBank` are read in one slice.'''
+        c = channels[0]
+        istop = c.i_analysed + nhops * hopsize
+        istart = istop - (nhops - 1) * hopsize - fftsize
+        frames = self.get_work('frames', (nhops, len(channels), fftsize))
+        bank = c.bank
+        if bank is not None and channels == bank.channels:
+            raw = sliding_window_view(
+                bank.slice_view(istart, istop), fftsize, axis=1)[:, ::hopsize]
+            num.multiply(raw.transpose(1, 0, 2),
+                         bank.gains[:, num.newaxis], out=frames,
+                         casting='unsafe')
+        else:
+            for ichannel, channel in enumerate(channels):
+                raw = sliding_window_view(
+                    channel.slice_view(istart, istop), fftsize)[::hopsize]
+                channel.to_float(raw, out=frames[:, ichannel])
+
+        return frames
+
+    def pitch_tracker_setup(self, channels):
+        ''' Key and setup of the parallel pitch tracker of *channels*'''
+        c = channels[0]
+        return (tuple(id(channel) for channel in channels),
+                (c.sampling_rate, c.fftsize, c.hopsize, c.pitch_algorithm))
+
+    def setup_pitch_trackers(self, lock=None):
+        ''' Start parallel pitch trackers for the current setup groups and
+        stop those of groups or setups which are gone.
+
+        Starting worker processes takes seconds, so this is never done
+        during :py:meth:`process`. Call it from another thread after
+        changing the channels' setup. Until then, channels without a
+        matching tracker are tracked serially. Trackers set up after
+        :py:meth:`close` are stopped right away.
+
+        :param lock: held while the groups are read and while the trackers
+            are swapped, e.g. :py:attr:`AnalysisThread.lock`'''
+        if self.pitch_workers is None:
+            return
+
+        from pytch.parallel import ParallelPitchTracker
+        with self._setup_lock:
+            with lock or contextlib.nullcontext():
+                groups = [
+                    self.pitch_tracker_setup(channels) + (len(channels),)
+                    for channels in self.setup_groups().values()
+                    if channels[0].pitch_algorithm != 'numpy-yin']
+
+            old = self.pitch_trackers
+            trackers = {}
+            for key, setup, nchannels in groups:
+                setup_tracker = old.get(key, None)
+                if setup_tracker is None or setup_tracker[0] != setup:
+                    sampling_rate, fftsize, hopsize, algorithm = setup
+                    setup_tracker = (setup, ParallelPitchTracker(
+                        nchannels, sampling_rate, fftsize, hopsize,
+                        algorithm=algorithm,
+                        nworkers=self.pitch_workers or None))
+
+                trackers[key] = setup_tracker
+
+            with lock or contextlib.nullcontext():
+                with self._swap_lock:
+                    closed = self.closed
+                    if not closed:
+                        self.pitch_trackers = trackers
+
+        if closed:
+            # trackers taken over from *old* are stopped by close
+            stale, kept = trackers, old
+        else:
+            stale, kept = old, trackers
+
+        kept = [tracker for _, tracker in kept.values()]
+        for _, tracker in stale.values():
+            if not any(tracker is t for t in kept):
+                tracker.close()
+
+    def get_pitch_tracker(self, channels):
+        ''' Parallel pitch tracker for *channels* or None if they are
+        tracked serially, also while there is no tracker for their current
+        setup.'''
+        key, setup = self.pitch_tracker_setup(channels)
+        setup_tracker = self.pitch_trackers.get(key, None)
+        if setup_tracker is None or setup_tracker[0] != setup:
+            return None
+
+        return setup_tracker[1]
+
+    def close(self):
+        ''' Stop parallel pitch trackers, also those of a later
+        :py:meth:`setup_pitch_trackers`'''
+        with self._swap_lock:
+            self.closed = True
+            trackers, self.pitch_trackers = self.pitch_trackers, {}
+
+        for setup, tracker in trackers.values():
+            tracker.close()
+
+    def power_spectra(self, frames):
+        ''' Power spectra of the windowed rows of *frames* in one real FFT.
+        Returns a reused float32 array of shape (nframes, fftsize//2+1).'''
+        nframes, fftsize = frames.shape
+        windowed = self.get_work('windowed', frames.shape)
+        num.multiply(frames, self.get_window(fftsize), out=windowed)
+        # slight pre-emphasis
+        # windowed[:, 1:] -=  0.1 * windowed[:, :-1]
+        # windowed[:, 0] = windowed[:, 1]
+
+        spectra = sfft.rfft(windowed, axis=1, workers=self.fft_workers)
+        power = self.get_work('power', (nframes, fftsize//2+1))
+        num.abs(spectra, out=power)
+        num.square(power, out=power)
+        power *= 1. / fftsize
+        return power
+
+    def process_group(self, channels):
+        ''' Analyse the pending hops of *channels*, which share fft size,
+        hop size and analysis state.'''
+        c = channels[0]
+        fftsize, hopsize = c.fftsize, c.hopsize
+        nhops = c.n_pending_hops
+        if nhops == 0:
+            return
+
+        # hops whose window is not held, at stream start or after an overrun
+        ifirst = c.retained_indices[0]
+        istart = c.i_analysed + hopsize - fftsize
+        nskip = min(max(-((istart - ifirst) // hopsize), 0), nhops)
+        if nskip:
+            logger.debug('skipping %i hops' % nskip)
+            for channel in channels:
+                channel.skip_hops(nskip)
+            nhops -= nskip
+
+        if nhops == 0:
+            return
+
+        frames = self.read_frames(channels, fftsize, hopsize, nhops)
+        power = self.power_spectra(
+            frames.reshape(-1, fftsize)).reshape(nhops, len(channels), -1)
+
+        for ichannel, channel in enumerate(channels):
+            channel.fft.append(power[:, ichannel])
+
+        if all(channel.pitch_algorithm == 'numpy-yin' for channel in channels):
+            # all windows of all channels in one call
+            pitches, confidences = yin(
+                frames.transpose(1, 0, 2), c.sampling_rate,
+                tolerance=c.pitch_o.tolerance, workers=self.fft_workers)
+            for channel, p, confidence in zip(
+                    channels, pitches, confidences):
+                channel.append_pitch(p, confidence)
+                channel.i_analysed += nhops * hopsize
+
+            return
+
+        tracker = self.get_pitch_tracker(channels)
+        if tracker is not None:
+            # latest hop of each window, per channel
+            hops = frames[:, :, -hopsize:].transpose(1, 0, 2).reshape(
+                len(channels), -1)
+            try:
+                pitches, confidences = tracker.process(hops)
+            except RuntimeError as e:
+                logger.error('%s, continuing with serial pitch tracking' % e)
+                key, _ = self.pitch_tracker_setup(channels)
+                # a new dict, setup_pitch_trackers may read the old one
+                with self._swap_lock:
+                    self.pitch_trackers = dict(
+                        (k, v) for (k, v) in self.pitch_trackers.items()
+                        if k != key)
+                tracker.close()
+            else:
+                for channel, p, confidence in zip(
+                        channels, pitches, confidences):
+                    channel.append_pitch(p, confidence)
+                    channel.i_analysed += nhops * hopsize
+
+                return
+
+        pitches = self.get_work('pitch', (nhops,))
+        confidences = self.get_work('confidence', (nhops,))
+        for ichannel, channel in enumerate(channels):
+            pitch_o = channel.pitch_o
+            for ihop in range(nhops):
+                # aubio keeps the window and expects the latest hop only
+                pitches[ihop] = pitch_o(frames[ihop, ichannel, -hopsize:])[0]
+                confidences[ihop] = pitch_o.get_confidence()
+
+            channel.append_pitch(pitches, confidences)
+            channel.i_analysed += nhops * hopsize
 
     def process(self):
         ''' Do the work'''
         logger.debug('start processing')
 
-        for ic, channel in enumerate(self.channels):
-            frame_work = channel.latest_frame_data(channel.fftsize)
-            win = num.hanning(channel.fftsize)
-            # slight pre-emphasis
-            # frame_work[1:] -=  0.1 * frame_work[:-1]
-            # frame_work[0] = frame_work[1]
+        for channels in self.channel_groups().values():
+            self.process_group(channels)
+
+        logger.debug('finished processing')
 
-            amp_spec = num.abs(num.fft.rfft(frame_work * win)) ** 2 / channel.fftsize
-            channel.fft.append(num.asarray(amp_spec, dtype=num.uint32))
 
-            channel.pitch_confidence.append_value(
-                channel.pitch_o.get_confidence())
-            channel.pitch.append_value(channel.pitch_o(
-                frame_work)[0])
+class AnalysisThread(threading.Thread):
+    ''' Flush *provider* and run *worker* on a background thread.
 
-        logger.debug('finished processing')
+    Results are published into the channels' spectrum and pitch rings,
+    which are appended under their sequence counters. Readers on other
+    threads take the latest completed results, see
+    :py:meth:`pytch.data.RingBuffer.snapshot` and
+    :py:meth:`pytch.data.Channel.pitch_snapshot`, and never wait for the
+    analysis.
+
+    Changes to the channels' analysis setup from other threads, e.g. of the
+    pitch algorithm, have to be made while holding :py:attr:`lock`.
+
+    :param interval: pause between two analysis passes in seconds'''
+
+    def __init__(self, provider, worker, interval=0.01):
+        threading.Thread.__init__(self, name='pytch-analysis')
+        self.daemon = True
+        self.provider = provider
+        self.worker = worker
+        self.interval = interval
+        self.lock = threading.RLock()
+        self.n_passes = 0
+        self.t_busy = 0.
+        self._stopped = threading.Event()
+
+    def run(self):
+        logger.debug('analysis thread started')
+        try:
+            while not self._stopped.wait(self.interval):
+                t0 = time.time()
+                with self.lock:
+                    self.provider.flush()
+                    self.worker.process()
+
+                self.t_busy += time.time() - t0
+                self.n_passes += 1
+        finally:
+            # also stops pitch worker processes if the analysis failed
+            self.worker.close()
+
+        logger.debug('analysis thread finished after %i passes, %.1f s busy' % (
+            self.n_passes, self.t_busy))
+
+    def stop(self):
+        ''' Stop after the current pass and wait for it to finish.'''
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
 
 
 def cross_spectrum(spec1, spec2):
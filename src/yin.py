@@ -0,0 +1,129 @@
+''' YIN pitch estimation in numpy, batched over any number of windows.
+
+Follows de Cheveigne and Kawahara (2002), YIN, a fundamental frequency
+estimator for speech and music. The difference function of all windows is
+computed through one batched real FFT, thresholding and interpolation are
+vectorized as well.
+'''
+import logging
+import numpy as num
+
+from scipy import fft as sfft
+
+
+logger = logging.getLogger(__name__)
+
+
+def difference_function(frames, workers=None):
+    ''' YIN difference function of the windows *frames* of shape
+    (..., W) for lags 0 to W/2 (exclusive), computed as
+    d(tau) = e(0) + e(tau) - 2 r(tau) with the autocorrelation *r* through
+    FFT.'''
+    w = frames.shape[-1]
+    n = w // 2
+    # lags below n of the zero padded head never wrap around
+    spec = sfft.rfft(frames, w, axis=-1, workers=workers)
+    spec_head = sfft.rfft(frames[..., :n], w, axis=-1, workers=workers)
+    spec *= num.conj(spec_head, out=spec_head)
+    r = sfft.irfft(spec, w, axis=-1, workers=workers)[..., :n]
+
+    power = num.zeros(frames.shape[:-1] + (w+1,), dtype=num.float64)
+    num.cumsum(num.square(frames, dtype=num.float64), axis=-1,
+               out=power[..., 1:])
+    # energy of x[tau: tau+n]
+    energy = power[..., n: 2*n] - power[..., :n]
+    return energy[..., :1] + energy - 2. * r
+
+
+def cumulative_mean_normalized(d):
+    ''' Cumulative mean normalized difference function of *d*. 1 where *d*
+    vanishes.'''
+    dn = num.ones_like(d)
+    cumsum = num.cumsum(d[..., 1:], axis=-1)
+    tau = num.arange(1, d.shape[-1])
+    valid = cumsum > 0.
+    dn[..., 1:] = num.where(
+        valid, d[..., 1:] * tau / num.where(valid, cumsum, 1.), 1.)
+    return dn
+
+
+def yin(frames, sampling_rate, tolerance=0.15, fmin=None, fmax=None,
+        workers=None):
+    ''' Pitch and confidence of the windows *frames* of shape (..., W).
+
+    The pitch is given by the first lag at which the cumulative mean
+    normalized difference function falls below *tolerance* and has a local
+    minimum, or its global minimum if there is no such lag. The lag is
+    refined by parabolic interpolation. Confidence is one minus the value of
+    the normalized difference function there.
+
+    :param fmin, fmax: pitch search range in Hz. Defaults to the range
+        covered by lags between 2 and W/2.
+    :param workers: threads for the FFT, see :py:func:`scipy.fft.rfft`
+    :returns: tuple of pitch [Hz] and confidence, float32 arrays of shape
+        (...). Silent windows get pitch and confidence 0.'''
+    frames = num.asarray(frames, dtype=num.float32)
+    n = frames.shape[-1] // 2
+    tau_min = 2 if fmax is None else max(int(sampling_rate / fmax), 2)
+    tau_max = n - 1 if fmin is None else min(int(sampling_rate / fmin), n-1)
+
+    dn = cumulative_mean_normalized(difference_function(frames, workers))
+    # first local minimum below tolerance, searched within tau_min..tau_max
+    search = dn[..., tau_min: tau_max]
+    candidates = search < tolerance
+    candidates &= search <= dn[..., tau_min+1: tau_max+1]
+    candidates &= search <= dn[..., tau_min-1: tau_max-1]
+    has_candidate = num.any(candidates, axis=-1)
+    tau = num.where(
+        has_candidate,
+        num.argmax(candidates, axis=-1),
+        num.argmin(search, axis=-1)) + tau_min
+
+    tau = tau[..., num.newaxis]
+    y0 = num.take_along_axis(dn, tau-1, axis=-1)[..., 0]
+    y1 = num.take_along_axis(dn, tau, axis=-1)[..., 0]
+    y2 = num.take_along_axis(dn, num.minimum(tau+1, n-1), axis=-1)[..., 0]
+    tau = tau[..., 0]
+
+    denom = y0 - 2.*y1 + y2
+    shift = num.where(
+        denom > 0., 0.5 * (y0 - y2) / num.where(denom > 0., denom, 1.), 0.)
+    shift = num.clip(shift, -1., 1.)
+
+    silent = num.all(frames == 0., axis=-1)
+    pitch = num.where(silent, 0., sampling_rate / (tau + shift))
+    confidence = num.where(silent, 0., num.clip(1. - y1, 0., 1.))
+    return pitch.astype(num.float32), confidence.astype(num.float32)
+
+
+class YinDetector(object):
+    ''' Streaming :py:func:`yin` with the interface of an aubio pitch
+    object. Each call takes the latest *hopsize* samples and returns the
+    pitch of the latest *fftsize* samples in Hz.'''
+
+    def __init__(self, fftsize, hopsize, sampling_rate, tolerance=0.15):
+        self.fftsize = fftsize
+        self.hopsize = hopsize
+        self.sampling_rate = sampling_rate
+        self.tolerance = tolerance
+        self.window = num.zeros(fftsize, dtype=num.float32)
+        self.confidence = 0.
+
+    def set_unit(self, unit):
+        if unit != 'Hz':
+            raise ValueError('only Hz supported')
+
+    def set_tolerance(self, tolerance):
+        self.tolerance = tolerance
+
+    def get_confidence(self):
+        return self.confidence
+
+    def __call__(self, hop):
+        window = self.window
+        window[:-self.hopsize] = window[self.hopsize:]
+        window[-self.hopsize:] = hop
+        pitch, confidence = yin(
+            window, self.sampling_rate, tolerance=self.tolerance)
+        self.confidence = float(confidence)
+        return num.array([pitch], dtype=num.float32)
@@ -1,8 +1,13 @@
 import unittest
 
+from test_batch import BatchTestCase
 from test_buffer import BufferTestCase
 from test_mic import MicTestCase
+from test_parallel import ParallelTestCase
+from test_provider import ProviderTestCase
+from test_shm import SharedMemoryTestCase
 from test_util import UtilTestCase
+from test_yin import YinTestCase
 
 if __name__=='__main__':
     unittest.main()
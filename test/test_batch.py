@@ -0,0 +1,74 @@
+import numpy as num
+import unittest
+import os
+import tempfile
+from scipy.io import wavfile
+from pytch.batch import process_directory, output_filenames, analyse_synthetic
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def test_process_directory(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        directory = tempdir.name
+        outdir = os.path.join(directory, 'results')
+        sampling_rate = 44100
+        t = num.arange(sampling_rate) / float(sampling_rate)
+        fns = []
+        for ifile, f in enumerate((220., 330., 440.)):
+            data = num.empty((len(t), 2), dtype=num.int16)
+            data[:, 0] = 10000. * num.sin(2.*num.pi*f*t)
+            data[:, 1] = 10000. * num.sin(2.*num.pi*f*1.5*t)
+            fn = os.path.join(directory, 'take%i.wav' % ifile)
+            wavfile.write(fn, sampling_rate, data)
+            fns.append((fn, f))
+
+        results = process_directory(directory, outdir, nworkers=2,
+                                    fftsize=2048)
+        self.assertEqual(len(results), 3)
+
+        for fn, f in fns:
+            for ichannel, fexpect in enumerate((f, f*1.5)):
+                fn_pitch, fn_spectrum = output_filenames(fn, outdir, ichannel)
+                times, pitch, confidence, centroid = num.loadtxt(fn_pitch).T
+                confident = confidence > 0.8
+                self.assertTrue(num.sum(confident) > len(times)/2)
+                num.testing.assert_allclose(
+                    pitch[confident], fexpect, rtol=0.02)
+
+                freqs, power = num.loadtxt(fn_spectrum).T
+                self.assertAlmostEqual(
+                    freqs[num.argmax(power)], fexpect, delta=2*freqs[1])
+
+    def test_buffer_dir(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        outputs = []
+        for buffer_dir in (None, tempdir.name):
+            outdir = os.path.join(tempdir.name, str(buffer_dir is None))
+            os.makedirs(outdir)
+            analyse_synthetic(2, 2., outdir, fftsize=1024,
+                              buffer_dir=buffer_dir)
+            fn_pitch, _ = output_filenames('synthetic0', outdir, 1)
+            outputs.append(num.loadtxt(fn_pitch))
+
+        num.testing.assert_array_equal(outputs[0], outputs[1])
+
+    def test_pitch_workers(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        outputs = []
+        for pitch_workers in (None, 1):
+            outdir = os.path.join(tempdir.name, str(pitch_workers))
+            os.makedirs(outdir)
+            analyse_synthetic(2, 2., outdir, fftsize=1024,
+                              pitch_workers=pitch_workers)
+            fn_pitch, _ = output_filenames('synthetic0', outdir, 1)
+            outputs.append(num.loadtxt(fn_pitch))
+
+        num.testing.assert_array_equal(outputs[0], outputs[1])
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -1,7 +1,13 @@
 import numpy as num
 import unittest
-from pytch.data import Buffer, RingBuffer
+import os
+import gc
+import tempfile
+from pytch.data import Buffer, RingBuffer, RingBuffer2D, CaptureRing, Channel
+from pytch.data import ChannelBank
+from pytch.data import SpectrumBuffer, TimeIndex, SegmentedBuffer, EnvelopePyramid
 import time
+import threading
 
 
 class BufferTestCase(unittest.TestCase):
@@ -26,6 +32,52 @@ class BufferTestCase(unittest.TestCase):
         num.testing.assert_array_almost_equal(b.ydata, num.arange(10))
         #num.testing.assert_array_almost_equal(b.xdata, num.arange(10))
 
+    def test_buffer_bounds(self):
+        b = Buffer(sampling_rate=1, buffer_length_seconds=5)
+        b.append_value(7)
+        self.assertEqual(b.data[0], 7)
+        b.append(num.arange(4))
+        num.testing.assert_array_equal(b.ydata, [7, 0, 1, 2, 3])
+        self.assertRaises(ValueError, b.append_value, 1)
+        self.assertRaises(ValueError, b.append, num.arange(2))
+        self.assertEqual(b.i_filled, 5)
+
+    def test_segmented_buffer(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        directory = tempdir.name
+        b = SegmentedBuffer(sampling_rate=10, segment_seconds=10,
+                            directory=directory, max_resident=2)
+        reference = num.arange(1234, dtype=num.float32)
+        b.append_value(reference[0])
+        i = 1
+        for n in (5, 99, 100, 1, 300, 728):
+            b.append(reference[i:i+n])
+            i += n
+
+        self.assertEqual(b.i_filled, reference.size)
+        self.assertEqual(len(b.segments), 13)
+        num.testing.assert_array_equal(b.ydata, reference)
+        num.testing.assert_array_almost_equal(b.xdata, num.arange(1234)/10.)
+
+        # reads within a segment are views
+        y = b.latest_frame_data(30)
+        num.testing.assert_array_equal(y, reference[-30:])
+        self.assertTrue(y.base is not None)
+        num.testing.assert_array_equal(
+            b.latest_frame_data(150), reference[-150:])
+        x, y = b.latest_frame(20.)
+        num.testing.assert_array_equal(y, reference[-200:])
+        num.testing.assert_array_almost_equal(x, num.arange(1034, 1234)/10.)
+
+        # all but the latest two segments were moved to one file
+        self.assertEqual(b.n_spilled, 11)
+        self.assertTrue(b.segments[0] is None)
+        self.assertTrue(b.segments[-2] is not None)
+        self.assertEqual(b.nbytes, 2*100*4)
+        num.testing.assert_array_equal(b.read(95, 305), reference[95:305])
+        self.assertEqual(len(os.listdir(directory)), 0)
+
     def test_benchmark_fill(self):
         iall = 100
         sampling_rate = 44100
@@ -121,6 +173,558 @@ class BufferTestCase(unittest.TestCase):
             num.asarray(x[:-1], num.float64),
             num.arange(90, 120)/sampling_rate)
 
+    def test_ringbuffer_time_axis(self):
+        sampling_rate = 10.
+        r = RingBuffer(sampling_rate=sampling_rate, buffer_length_seconds=10)
+        for n in (5, 25, 120):
+            r.append(num.arange(n))
+            for clip_min in (False, True):
+                # reference: absolute axis and clipping by scanning
+                m = int(3*sampling_rate)+1
+                x = r.i_filled/sampling_rate - num.arange(m)[::-1]/sampling_rate
+                istart = num.where(x > 0)[0]
+                istart = istart[0] if clip_min and len(istart) else 0
+
+                t, xrel, y = r.latest_frame_relative(3, clip_min=clip_min)
+                num.testing.assert_array_almost_equal(xrel + t, x[istart:])
+                self.assertEqual(len(y), len(xrel))
+                self.assertTrue(xrel.base is r._xrel)
+
+    def test_ringbuffer_mirror(self):
+        r = RingBuffer(1, 50)
+        rng = num.random.RandomState(0)
+        reference = []
+        for i in range(200):
+            d = rng.uniform(size=rng.randint(2, 30)).astype(num.float32)
+            r.append(d)
+            reference.extend(d)
+            n = rng.randint(1, min(len(reference), 50) + 1)
+            y = r.latest_frame_data(n)
+            self.assertTrue(y.base is r._mirror)
+            num.testing.assert_array_equal(y, reference[-n:])
+
+        r2 = RingBuffer2D(ndimension2=3, sampling_rate=1,
+                          buffer_length_seconds=7)
+        for i in range(5):
+            r2.append(num.arange(9).reshape(3, 3) + i*9)
+        num.testing.assert_array_equal(
+            r2.latest_frame_data(7), num.arange(45).reshape(15, 3)[-7:])
+
+    def test_ringbuffer_bulk_append(self):
+        # randomized appends of 0 up to more than L rows against a reference
+        # which keeps every row ever appended
+        for seed in range(20):
+            rng = num.random.RandomState(seed)
+            L = rng.randint(1, 40)
+            for shape in ((), (rng.randint(1, 5),)):
+                if shape:
+                    r = RingBuffer2D(ndimension2=shape[0], sampling_rate=1,
+                                     buffer_length_seconds=L)
+                else:
+                    r = RingBuffer(1, L)
+
+                reference = num.zeros((0,) + shape, dtype=num.float32)
+                for i in range(100):
+                    n = rng.choice([0, 1, rng.randint(1, L+1),
+                                    rng.randint(L, 3*L+1)])
+                    d = rng.uniform(size=(n,) + shape).astype(num.float32)
+                    if n == 1 and rng.uniform() < 0.5:
+                        r.append_value(d[0])
+                    else:
+                        r.append(d)
+                    reference = num.concatenate((reference, d))
+
+                    self.assertEqual(r.i_filled, len(reference))
+                    self.assertEqual(r.generation % 2, 0)
+                    m = rng.randint(0, min(len(reference), L) + 1)
+                    num.testing.assert_array_equal(
+                        r.latest_frame_data(m), reference[len(reference)-m:])
+
+                    if r.i_filled >= L:
+                        # both halves of the mirror agree
+                        num.testing.assert_array_equal(
+                            r._mirror[:L], r._mirror[L:])
+
+                m = min(len(reference), L)
+                istart = len(reference) - m
+                num.testing.assert_array_equal(
+                    r.data[num.arange(istart, len(reference)) % L],
+                    reference[istart:])
+
+        r2 = RingBuffer2D(ndimension2=3, sampling_rate=1,
+                          buffer_length_seconds=5)
+        self.assertRaises(ValueError, r2.append, num.zeros((2, 4)))
+
+        c = Channel(44100, fftsize=1024)
+        c.append_pitch(num.full(12, 220.), num.linspace(0., 1., 12))
+        self.assertEqual(c.pitch.i_filled, 12)
+        num.testing.assert_array_almost_equal(
+            c.undo_pitch_proxy(c.get_latest_pitch()), [220.], decimal=3)
+        self.assertEqual(c.pitch_confidence.latest_frame_data(1)[0], 1.)
+
+    def test_benchmark_bulk_append(self):
+        r = RingBuffer(1, 1000)
+        d = num.arange(48, dtype=num.float32)
+        ntimes = 200
+        t0 = time.time()
+        for i in range(ntimes):
+            for v in d:
+                r.append_value(v)
+        tvalue = (time.time() - t0) / ntimes
+
+        t0 = time.time()
+        for i in range(ntimes):
+            r.append(d)
+        tbulk = (time.time() - t0) / ntimes
+
+        print('append 48 rows: append_value %.1f us, append %.1f us' % (
+            tvalue*1e6, tbulk*1e6))
+
+    def test_slice_time(self):
+        sampling_rate = 10.
+        r = RingBuffer(sampling_rate=sampling_rate, buffer_length_seconds=5)
+        r.append(num.arange(123, dtype=num.float32))
+        x, y = r.latest_frame(4.9)
+        for t0, t1 in ((8.2, 9.95), (x[3], x[20]), (0., 100.), (11., 12.3),
+                       (9., 8.)):
+            xs, ys = r.slice_time(t0, t1)
+            i = (x >= t0 - 1e-6) & (x <= t1 + 1e-6)
+            num.testing.assert_array_almost_equal(xs, x[i])
+            num.testing.assert_array_equal(ys, y[i])
+            self.assertTrue(ys.base is r._mirror)
+
+        # wrap-around of the ring is still a single view
+        self.assertEqual(r.i_filled % r.data_len, 23)
+        xs, ys = r.slice_time(7.5, 12.)
+        num.testing.assert_array_equal(ys, num.arange(74, 120))
+
+        freqs = num.fft.rfftfreq(64, 1./1000)
+        spectra = SpectrumBuffer(freqs, sampling_rate, 5)
+        power = 10**num.random.RandomState(0).uniform(
+            0., 14., size=(70, freqs.size))
+        spectra.append(power)
+        xs, ys = spectra.slice_time(6., 6.5)
+        x, y = spectra.latest_frame(0.9)
+        self.assertEqual(ys.shape, (6, freqs.size))
+        num.testing.assert_array_almost_equal(xs[1:], x[:5])
+        num.testing.assert_array_equal(ys[1:], y[:5])
+
+        c = Channel(1000, fftsize=64, gain=2.)
+        c.append(num.arange(3000, dtype=num.int16))
+        xs, ys = c.slice_time(1., 1.0095)
+        self.assertEqual(ys.dtype, num.float32)
+        num.testing.assert_array_equal(ys, 2.*num.arange(999, 1009))
+
+        b = SegmentedBuffer(sampling_rate, segment_seconds=2.)
+        b.append(num.arange(55, dtype=num.float32))
+        xs, ys = b.slice_time(1.5, 2.5)
+        num.testing.assert_array_almost_equal(xs, num.arange(15, 26)/10.)
+        num.testing.assert_array_equal(ys, num.arange(15, 26))
+
+        # tmin shifts linear buffers and rings alike
+        b = Buffer(sampling_rate, 20, tmin=100.)
+        r = RingBuffer(sampling_rate, 20, tmin=100.)
+        for buf in (b, r):
+            buf.append(num.arange(55, dtype=num.float32))
+            xs, ys = buf.slice_time(101.5, 102.5)
+            num.testing.assert_array_almost_equal(
+                xs, 100. + num.float64(ys)/10. + (
+                    buf.delta if buf is r else 0.))
+            self.assertEqual(len(ys), 11)
+            self.assertEqual(
+                buf.index_at_time(buf.xaxis(20, 21)[0] + 1e-6), 20)
+
+    def test_benchmark_latest_frame_data(self):
+        ntimes = 200
+        for fftsize in (4096, 16384, 65536):
+            r = RingBuffer(44100, 40)
+            r.append(num.zeros(r.data_len - fftsize//2, dtype=num.float32))
+            t0 = time.time()
+            for i in range(ntimes):
+                num.take(r.data, num.arange(r.i_filled - fftsize, r.i_filled),
+                         mode='wrap', axis=0)
+            ttake = (time.time() - t0) / ntimes
+
+            t0 = time.time()
+            for i in range(ntimes):
+                r.latest_frame_data(fftsize)
+            tview = (time.time() - t0) / ntimes
+
+            print('latest %5i samples: take %.1f us, view %.1f us' % (
+                fftsize, ttake*1e6, tview*1e6))
+
+    def test_spectrum_buffer(self):
+        freqs = num.fft.rfftfreq(1024, 1./44100)
+        rng = num.random.RandomState(0)
+        power = 10**rng.uniform(0., 14., size=(20, freqs.size))
+        for dtype, rtol in ((num.uint8, 0.07), (num.float16, 0.01)):
+            b = SpectrumBuffer(freqs, 10, 10, fmin=100., fmax=2000.,
+                               dtype=dtype)
+            self.assertTrue(b.freqs[0] >= 100. - freqs[1])
+            self.assertTrue(b.freqs[-1] <= 2000. + freqs[1])
+            band = power[:, b.ifmin: b.ifmax]
+            self.assertEqual(band.shape[1], b.freqs.size)
+
+            for i in range(5):
+                b.append(power[i:i+1])
+            b.append(power[5:])
+            d = b.latest_frame_data(20)
+            self.assertEqual(d.dtype, num.float32)
+            num.testing.assert_allclose(d, band, rtol=rtol)
+            self.assertEqual(b.latest_frame_levels(20).dtype, num.uint8)
+            self.assertEqual(b.nbytes, 2*100*b.freqs.size*num.dtype(dtype).itemsize)
+
+        c = Channel(44100, fftsize=16384, fmax=2000.)
+        self.assertTrue(c.freqs[-1] < 2010.)
+        self.assertEqual(c.fft.latest_frame_data(1).shape, (1, c.freqs.size))
+        full = Channel(44100, fftsize=16384)
+        self.assertTrue(c.fft.nbytes * 10 < full.fft.nbytes)
+        self.assertTrue(c.nbytes_total < full.nbytes_total)
+
+    def test_envelope_pyramid(self):
+        sampling_rate = 1000
+        c = Channel(sampling_rate, fftsize=64, buffer_length_seconds=100,
+                    gain=0.5)
+        rng = num.random.RandomState(0)
+        reference = []
+        for i in range(300):
+            d = rng.randint(-30000, 30000, size=rng.randint(1, 900))
+            c.append(d.astype(num.int16))
+            reference.extend(d)
+        reference = num.array(reference, dtype=num.float64)
+
+        for seconds, npoints in ((0.2, 100), (1., 100), (10., 300),
+                                 (90., 200)):
+            x, ymin, ymax, rms = c.latest_envelope(seconds, npoints)
+            self.assertTrue(npoints <= len(x) <= 2*npoints)
+            self.assertTrue(x[-1] <= c.i_filled/float(sampling_rate))
+            nblock = int(round((x[1]-x[0]) * sampling_rate))
+            for i in range(len(x)):
+                istart = int(round(x[i]*sampling_rate - nblock/2.))
+                block = reference[istart: istart+nblock]
+                self.assertEqual(ymin[i], block.min()*0.5)
+                self.assertEqual(ymax[i], block.max()*0.5)
+                self.assertAlmostEqual(
+                    rms[i], num.sqrt(num.mean(block**2))*0.5,
+                    delta=rms[i]*1e-4)
+
+    def test_envelope_pyramid_overrun(self):
+        # more samples than the buffer holds arrive between updates
+        b = RingBuffer(1000, 10, dtype=num.int16)
+        pyramid = EnvelopePyramid(b)
+        rng = num.random.RandomState(0)
+        reference = rng.randint(-30000, 30000, size=25000).astype(num.int16)
+        b.append(reference[:3000])
+        pyramid.update()
+        b.append(reference[3000:])
+        pyramid.update()
+
+        for level, bs in zip(pyramid.levels, pyramid.blocksizes):
+            i_filled = level[0].i_filled
+            self.assertEqual(i_filled, len(reference) // bs)
+            for ldata in level:
+                self.assertEqual(ldata.i_filled, i_filled)
+            m = level[0].data_len // 2
+            blocks = reference[(i_filled-m)*bs: i_filled*bs].reshape((m, bs))
+            num.testing.assert_array_equal(
+                level[0].latest_frame_data(m), blocks.min(axis=1))
+            num.testing.assert_array_equal(
+                level[1].latest_frame_data(m), blocks.max(axis=1))
+
+    def test_benchmark_envelope(self):
+        sampling_rate = 44100
+        c = Channel(sampling_rate, fftsize=1024, buffer_length_seconds=600)
+        chunk = num.zeros(sampling_rate, dtype=num.int16)
+        t0 = time.time()
+        for i in range(600):
+            c.append(chunk)
+        print('envelope update: %.1f us per second of audio' % (
+            (time.time()-t0)/600*1e6))
+
+        for seconds in (3., 60., 600.):
+            t0 = time.time()
+            for i in range(20):
+                c.latest_envelope(seconds, 1000)
+            tenvelope = (time.time()-t0)/20
+            t0 = time.time()
+            for i in range(20):
+                c.latest_frame_decimated(seconds, ndecimate=25)
+            tdecimate = (time.time()-t0)/20
+            print('%4i s trace: envelope %.2f ms, decimated %.2f ms' % (
+                seconds, tenvelope*1e3, tdecimate*1e3))
+
+    def test_time_index(self):
+        sampling_rate = 100.
+        index = TimeIndex(sampling_rate, tolerance=0.005)
+        # chunks of 10 samples with slight jitter, 1 s gap before sample 200
+        for i in range(0, 400, 10):
+            t = 1000. + i/sampling_rate + (0.001 if i % 20 else 0.)
+            if i >= 200:
+                t += 1.
+            index.add(i, t)
+
+        self.assertEqual(index.n, 2)
+        num.testing.assert_array_equal(index.isamples, [0, 200])
+        self.assertAlmostEqual(index.time_at(150), 1001.5)
+        self.assertAlmostEqual(index.time_at(250), 1003.5)
+        num.testing.assert_array_almost_equal(
+            index.time_at(num.array([0, 199, 200])), [1000., 1001.99, 1003.])
+
+        self.assertEqual(index.index_at(1001.5), 150)
+        self.assertEqual(index.index_at(1003.5), 250)
+        # within the gap
+        self.assertEqual(index.index_at(1002.5), 200)
+
+        isamples, durations = index.gaps()
+        num.testing.assert_array_equal(isamples, [200])
+        num.testing.assert_array_almost_equal(durations, [1.])
+
+        self.assertEqual(index.index_range(1001.5, 1003.5), (150, 251))
+        self.assertEqual(index.index_range(1001.985, 1003.), (199, 201))
+        self.assertEqual(index.index_range(1002.2, 1002.5), (200, 200))
+
+        # slicing a ring by capture time steps over the gap
+        r = RingBuffer(sampling_rate, 10)
+        r.time_index = index
+        r.append(num.arange(400, dtype=num.float32))
+        xs, ys = r.slice_time(1001.9, 1003.1)
+        num.testing.assert_array_equal(ys, num.arange(190, 211))
+        num.testing.assert_array_almost_equal(xs, index.time_at(ys))
+        xs, ys = r.slice_time(*r.xaxis(120, 320)[[0, -1]])
+        num.testing.assert_array_equal(ys, num.arange(120, 320))
+        self.assertAlmostEqual(r.t_latest, 1004.99)
+
+        # jitter backwards in time is rejected, times stay monotonic
+        n = index.n
+        index.add(300, index.time_at(300) - 0.5)
+        self.assertEqual(index.n, n)
+        t = index.time_at(num.arange(400))
+        self.assertTrue(num.all(num.diff(t) > 0.))
+
+        # anchors before the oldest held sample are dropped
+        index.prune(250)
+        self.assertEqual(index.isamples[0], 200)
+        num.testing.assert_array_equal(
+            index.time_at(num.arange(250, 400)), t[250:])
+
+    def test_time_index_bounded(self):
+        # a long stream with frequent gaps in a short ring
+        sampling_rate = 1000
+        r = RingBuffer(sampling_rate, 1)
+        r.time_index = TimeIndex(sampling_rate)
+        t = 0.
+        for i in range(1000):
+            r.time_index.add(r.i_filled, t)
+            r.append(num.zeros(100, dtype=num.float32))
+            r.time_index.prune(r.retained_indices[0])
+            # 100 samples plus a gap of 0.1 s
+            t += 0.2
+
+        self.assertTrue(r.time_index.n <= 11)
+        self.assertAlmostEqual(r.t_latest, 199.8 + 0.099)
+
+    def test_snapshot_concurrent_writer(self):
+        r = RingBuffer2D(ndimension2=4096, sampling_rate=1,
+                         buffer_length_seconds=64)
+        stop = threading.Event()
+
+        def write():
+            rows = num.empty((3, 4096))
+            i = 100
+            while not stop.is_set():
+                rows[:] = num.arange(i, i+3)[:, num.newaxis]
+                r.append(rows)
+                i += 3
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            t0 = time.time()
+            nsnapshots = 0
+            while time.time() - t0 < 0.5:
+                i_filled, d = r.snapshot(8)
+                rows = d[:, 0]
+                if rows[0] < 100:
+                    continue
+                # every row written completely and rows are consecutive
+                self.assertTrue(num.all(d == rows[:, num.newaxis]))
+                num.testing.assert_array_equal(num.diff(rows), 1.)
+                nsnapshots += 1
+        finally:
+            stop.set()
+            writer.join()
+
+        self.assertTrue(nsnapshots > 0)
+        self.assertEqual(r.generation % 2, 0)
+
+    def test_pitch_snapshot(self):
+        c = Channel(1000, fftsize=64, hopsize=16)
+        stop = threading.Event()
+
+        def write():
+            f = 100.
+            while not stop.is_set():
+                # pitch and confidence of a pair always match
+                v = num.full(3, f, dtype=num.float32)
+                c.append_pitch(v, v)
+                f += 1.
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            t0 = time.time()
+            while time.time() - t0 < 0.3:
+                i_filled, pitch, confidence = c.pitch_snapshot(8)
+                if i_filled < 8:
+                    continue
+                num.testing.assert_allclose(
+                    c.undo_pitch_proxy(pitch), confidence, rtol=1e-4)
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_snapshot_torn_read(self):
+        paused = threading.Event()
+        resume = threading.Event()
+
+        class PausingRing(RingBuffer2D):
+            pause = False
+
+            def store(self, i, d):
+                if self.pause:
+                    # write the first half of the row, then stall
+                    part = self._mirror[i: i+1].copy()
+                    part[:, :4] = d[:, :4]
+                    RingBuffer2D.store(self, i, part)
+                    paused.set()
+                    resume.wait()
+
+                RingBuffer2D.store(self, i, d)
+
+        r = PausingRing(ndimension2=8, sampling_rate=1,
+                        buffer_length_seconds=16)
+        for i in range(16):
+            r.append(num.full((1, 8), i))
+
+        # the next row overwrites the oldest row of the latest 16
+        r.pause = True
+        writer = threading.Thread(
+            target=r.append, args=(num.full((1, 8), 16), ))
+        writer.start()
+        snapshots = []
+        reader = threading.Thread(
+            target=lambda: snapshots.append(r.snapshot(16)))
+        try:
+            self.assertTrue(paused.wait(5.))
+            torn = r.latest_frame_data(16)[0]
+            self.assertFalse(num.all(torn == torn[0]))
+            reader.start()
+            reader.join(0.1)
+            # the snapshot waits for the write to finish
+            self.assertTrue(reader.is_alive())
+        finally:
+            resume.set()
+            writer.join()
+            if reader.ident is not None:
+                reader.join()
+
+        i_filled, d = snapshots[0]
+        self.assertEqual(i_filled, 17)
+        num.testing.assert_array_equal(
+            d, num.repeat(num.arange(1, 17)[:, num.newaxis], 8, axis=1))
+
+    def test_capture_ring(self):
+        nchannels = 3
+        ring = CaptureRing(nchannels=nchannels, nframes=10)
+        chunk = num.arange(4*nchannels, dtype=num.int16)
+
+        for i in range(2):
+            self.assertTrue(ring.write(chunk))
+        self.assertEqual(ring.n_available, 8)
+
+        # does not fit: chunk is dropped and counted
+        self.assertFalse(ring.write(chunk))
+        self.assertEqual(ring.n_overflows, 1)
+        self.assertEqual(ring.n_frames_dropped, 4)
+
+        views = ring.read_views()
+        self.assertEqual(len(views), 1)
+        num.testing.assert_array_equal(
+            views[0], num.vstack([chunk.reshape(-1, nchannels)]*2))
+        ring.advance(views[0].shape[0])
+        self.assertEqual(ring.read_cursor, ring.write_cursor)
+
+        # wraps around
+        ring.write(chunk)
+        views = ring.read_views()
+        self.assertEqual(len(views), 2)
+        num.testing.assert_array_equal(
+            num.vstack(views), chunk.reshape(-1, nchannels))
+
+    def test_channel_int16_storage(self):
+        c = Channel(sampling_rate=100, fftsize=64, gain=0.5)
+        self.assertEqual(c.data.dtype, num.int16)
+        d = num.arange(-300, 300, dtype=num.int16)
+        c.append(d)
+
+        out = num.empty(10, dtype=num.float32)
+        y = c.latest_frame_data(10, out=out)
+        self.assertTrue(y is out)
+        num.testing.assert_array_equal(y, d[-10:] * 0.5)
+
+        x, y = c.latest_frame_decimated(2., ndecimate=10)
+        raw = d[-200:].reshape(-1, 10)
+        self.assertEqual(len(x), len(y))
+        num.testing.assert_array_equal(y[::2], raw[::2].min(axis=1) * 0.5)
+        num.testing.assert_array_equal(y[1::2], raw[1::2].max(axis=1) * 0.5)
+        xfull, _ = c.latest_frame(2.)
+        num.testing.assert_array_almost_equal(x, xfull[1::10])
+
+    def test_memmap_ringbuffer(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        directory = tempdir.name
+        r = RingBuffer(1, 10, directory=directory)
+        self.assertTrue(isinstance(r.data, num.memmap))
+        r.append(num.arange(14))
+        num.testing.assert_array_equal(
+            r.latest_frame_data(5), num.arange(9, 14))
+
+        r2 = RingBuffer2D(ndimension2=3, sampling_rate=1,
+                          buffer_length_seconds=4, directory=directory)
+        self.assertTrue(isinstance(r2.data, num.memmap))
+        r2.append(num.arange(6).reshape(2, 3))
+        num.testing.assert_array_equal(
+            r2.latest_frame_data(2), num.arange(6).reshape(2, 3))
+
+        c = Channel(100, fftsize=64, buffer_length_seconds=3600,
+                    buffer_dir=directory)
+        for b in (c, c.fft, c.pitch, c.pitch_confidence):
+            self.assertTrue(isinstance(b.data, num.memmap))
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_memmap_file_descriptors(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        nfds = len(os.listdir('/proc/self/fd'))
+        bank = ChannelBank(64, 100, fftsize=64, buffer_length_seconds=60,
+                           buffer_dir=tempdir.name)
+        # buffers replaced during setup are in reference cycles
+        gc.collect()
+        # one file for the bank, one for the analysis buffers of each
+        # channel, each mapped in a few chunks
+        self.assertLessEqual(len(os.listdir('/proc/self/fd')) - nfds, 3*65)
+
+        bank.append(num.arange(64*300, dtype=num.int16).reshape((64, 300)))
+        for c in bank.channels:
+            self.assertTrue(isinstance(c.envelope_pyramid.levels[0][0].data,
+                                       num.memmap))
+            num.testing.assert_array_equal(
+                c.latest_raw_data(300), num.arange(300) + c.ibank*300)
+            _, ymin, ymax, _ = c.latest_envelope(3., 10)
+            self.assertEqual(ymin.min(), c.ibank*300)
+            self.assertEqual(ymax.max(), c.ibank*300 + 299)
+
 
 if __name__=='__main__':
     unittest.main()
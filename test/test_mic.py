@@ -1,6 +1,8 @@
 import unittest
+from unittest import mock
 from subprocess import call
-from pytch.data import MicrophoneRecorder
+from pytch.data import MicrophoneRecorder, DeviceRegistry
+from pytch.data import candidate_sampling_rates
 import time
 
 class MicTestCase(unittest.TestCase):
@@ -21,6 +23,32 @@ class MicTestCase(unittest.TestCase):
         print('OPTIONS', mic.sampling_rate_options)
         mic.terminate()
 
+    def test_device_registry(self):
+        registry = DeviceRegistry()
+        t0 = time.time()
+        registry.refresh()
+        self.assertTrue(time.time() - t0 < 0.1)
+        self.assertTrue(registry.wait(30.))
+        print('devices', registry.device_names())
+        for device in registry.devices:
+            rates = registry.sampling_rates(device['index'])
+            self.assertTrue(set(rates) <= set(candidate_sampling_rates))
+
+        # a refresh probes again, waiting covers it
+        probed = []
+        registry.refresh(lambda: probed.append(True))
+        self.assertTrue(registry.wait(30.))
+        self.assertEqual(probed, [True])
+
+    def test_device_registry_failure(self):
+        registry = DeviceRegistry()
+        with mock.patch('pytch.data.pyaudio.PyAudio',
+                        side_effect=IOError('no audio')):
+            registry.refresh()
+            self.assertTrue(registry.wait(5.))
+
+        self.assertEqual(registry.device_names(), [])
+
     def test_zoom(self):
         ''' works with the zoom interface.'''
         mic = MicrophoneRecorder(chunksize=512, sampling_rate=44100, nchannels=16)
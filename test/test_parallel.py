@@ -0,0 +1,176 @@
+import numpy as num
+import unittest
+import time
+from pytch.data import Channel, make_pitch_detector
+from pytch.parallel import ParallelPitchTracker
+from pytch.two_channel_tuner import Worker
+
+
+def make_signals(nchannels, n, sampling_rate=44100):
+    t = num.arange(n) / float(sampling_rate)
+    f0 = 110. * 2**(num.arange(nchannels)/12.)
+    return (8000. * num.sin(2.*num.pi*f0[:, num.newaxis]*t)).astype(
+        num.float32), f0
+
+
+class ParallelTestCase(unittest.TestCase):
+
+    def test_parallel_pitch_tracker(self):
+        sampling_rate = 44100
+        fftsize = 2048
+        hopsize = 512
+        nchannels = 5
+        audio, f0 = make_signals(nchannels, hopsize*150)
+
+        tracker = ParallelPitchTracker(
+            nchannels, sampling_rate, fftsize, hopsize, algorithm='yin',
+            nworkers=2, max_hops=64)
+        try:
+            self.assertEqual(tracker.nworkers, 2)
+            pitch, confidence = tracker.process(audio)
+        finally:
+            tracker.close()
+
+        self.assertEqual(pitch.shape, (nchannels, 150))
+        for ichannel in range(nchannels):
+            pitch_o = make_pitch_detector('yin', fftsize, hopsize,
+                                          sampling_rate)
+            hops = audio[ichannel].reshape(-1, hopsize)
+            reference = [pitch_o(hop)[0] for hop in hops]
+            num.testing.assert_array_equal(pitch[ichannel], reference)
+
+        num.testing.assert_allclose(pitch[:, -1], f0, rtol=0.01)
+
+    def test_worker_parallel(self):
+        sampling_rate = 44100
+        nchannels = 3
+        audio, f0 = make_signals(nchannels, sampling_rate)
+        results = []
+        for pitch_workers in (None, 2):
+            channels = [Channel(sampling_rate, fftsize=2048)
+                        for i in range(nchannels)]
+            for channel in channels:
+                channel.pitch_algorithm = 'yin'
+
+            worker = Worker(channels, pitch_workers=pitch_workers)
+            for i in range(0, sampling_rate, 4000):
+                for channel, signal in zip(channels, audio):
+                    channel.append(signal[i: i+4000].astype(num.int16))
+                worker.process()
+
+            worker.close()
+            results.append([c.pitch.latest_frame_data(80) for c in channels])
+
+        num.testing.assert_array_equal(results[0], results[1])
+
+    def test_pitch_worker_failure(self):
+        audio, f0 = make_signals(2, 512*4)
+        # detectors cannot be created in the worker process
+        tracker = ParallelPitchTracker(
+            2, 44100, 2048, 512, algorithm='nonexistent', nworkers=1,
+            timeout=0.1)
+        try:
+            with self.assertRaises(RuntimeError):
+                tracker.process(audio)
+        finally:
+            tracker.close()
+
+    def test_worker_pitch_trackers(self):
+        sampling_rate = 44100
+        nchannels = 2
+        audio, f0 = make_signals(nchannels, sampling_rate)
+        channels = [Channel(sampling_rate, fftsize=2048)
+                    for i in range(nchannels)]
+        for channel in channels:
+            channel.pitch_algorithm = 'yinfft'
+
+        # trackers are started up front, not during processing
+        worker = Worker(channels, pitch_workers=1)
+        try:
+            self.assertEqual(len(worker.pitch_trackers), 1)
+            (setup, tracker), = worker.pitch_trackers.values()
+
+            # a changed setup is tracked serially until set up again
+            for channel in channels:
+                channel.pitch_algorithm = 'yin'
+            self.assertTrue(worker.get_pitch_tracker(channels) is None)
+            worker.setup_pitch_trackers()
+            self.assertTrue(tracker.shm is None)
+            (setup, tracker), = worker.pitch_trackers.values()
+            self.assertEqual(setup[-1], 'yin')
+
+            # a dead worker process makes the group fall back to serial
+            tracker.processes[0].terminate()
+            tracker.processes[0].join()
+            for channel, signal in zip(channels, audio):
+                channel.append(signal.astype(num.int16))
+            worker.process()
+            self.assertEqual(worker.pitch_trackers, {})
+            self.assertTrue(tracker.shm is None)
+            for channel in channels:
+                self.assertEqual(channel.n_pending_hops, 0)
+            num.testing.assert_allclose(
+                [c.undo_pitch_proxy(c.get_latest_pitch())[0]
+                 for c in channels], f0, rtol=0.01)
+        finally:
+            worker.close()
+
+    def test_worker_pitch_tracker_groups(self):
+        sampling_rate = 44100
+        audio, f0 = make_signals(2, sampling_rate)
+        channels = [Channel(sampling_rate, fftsize=2048) for i in range(2)]
+        for channel in channels:
+            channel.pitch_algorithm = 'yinfft'
+
+        # set up between the appends to the two channels, as in a pass
+        channels[0].append(audio[0].astype(num.int16))
+        worker = Worker(channels, pitch_workers=1, start_pitch_trackers=False)
+        self.assertEqual(worker.pitch_trackers, {})
+        worker.setup_pitch_trackers()
+        try:
+            channels[1].append(audio[1].astype(num.int16))
+            (setup, tracker), = worker.pitch_trackers.values()
+            self.assertTrue(worker.get_pitch_tracker(channels) is tracker)
+        finally:
+            worker.close()
+
+        self.assertTrue(tracker.shm is None)
+
+        # a setup finishing after close stops its trackers
+        worker.setup_pitch_trackers()
+        self.assertEqual(worker.pitch_trackers, {})
+
+    def test_benchmark_parallel_pitch(self):
+        sampling_rate = 44100
+        fftsize = 2048
+        hopsize = 512
+        nchannels = 16
+        seconds = 2.
+        audio, f0 = make_signals(nchannels, int(seconds*sampling_rate))
+        t0 = time.time()
+        for signal in audio:
+            pitch_o = make_pitch_detector('yinfft', fftsize, hopsize,
+                                          sampling_rate)
+            for hop in signal[:len(signal)//hopsize*hopsize].reshape(
+                    -1, hopsize):
+                pitch_o(hop)
+        print('pitch serial: %.0f channels in real time' % (
+            nchannels * seconds / (time.time() - t0)))
+
+        for nworkers in (1, 2, 4):
+            tracker = ParallelPitchTracker(
+                nchannels, sampling_rate, fftsize, hopsize, nworkers=nworkers)
+            try:
+                tracker.process(audio[:, :hopsize])
+                t0 = time.time()
+                tracker.process(audio)
+                tprocess = time.time() - t0
+            finally:
+                tracker.close()
+
+            print('pitch %i workers: %.0f channels in real time' % (
+                nworkers, nchannels * seconds / tprocess))
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,419 @@
+import numpy as num
+import unittest
+import time
+import os
+import tempfile
+from scipy.io import wavfile
+from pytch.data import DataProvider, Channel, WavFileProvider
+from pytch.synthetic import SyntheticProvider, VoiceGenerator
+from pytch.two_channel_tuner import Worker, AnalysisThread
+from pytch.recorder import WavRecorder, WavWriter
+
+
+def make_provider(nchannels, sampling_rate=44100, capture_seconds=1.,
+                  bank=False):
+    provider = DataProvider()
+    provider.sampling_rate = sampling_rate
+    if bank:
+        provider.setup_channels(nchannels, 1024)
+    else:
+        provider.channels = [
+            Channel(sampling_rate, fftsize=1024) for i in range(nchannels)]
+    provider.setup_capture(nchannels, int(capture_seconds*sampling_rate))
+    return provider
+
+
+class ProviderTestCase(unittest.TestCase):
+
+    def test_flush_deinterleave(self):
+        nchannels = 3
+        chunksize = 512
+        for bank in (False, True):
+            provider = make_provider(nchannels, bank=bank)
+            ring = provider.capture_ring
+
+            data = num.arange(
+                chunksize*nchannels*100, dtype=num.int16).reshape(
+                    -1, nchannels)
+            ichunk = 0
+            for iflush in range(10):
+                for i in range(10):
+                    ring.write(data[ichunk*chunksize: (ichunk+1)*chunksize])
+                    ichunk += 1
+                provider.flush()
+                self.assertEqual(ring.n_available, 0)
+
+            for i, channel in enumerate(provider.channels):
+                num.testing.assert_array_equal(
+                    channel.latest_frame_data(chunksize*5),
+                    data[-chunksize*5:, i])
+
+    def test_channel_bank(self):
+        provider = make_provider(4, capture_seconds=0.5, bank=True)
+        bank = provider.bank
+        provider.channels[2].gain = 2.
+        self.assertRaises(ValueError, provider.channels[0].append,
+                          num.zeros(10, dtype=num.int16))
+
+        data = (num.arange(44100*4*3) % 30000).astype(num.int16).reshape(
+            -1, 4)
+        for i in range(0, len(data), 10000):
+            provider.capture_ring.write(data[i: i+10000])
+            provider.flush()
+
+        block = bank.latest_frame_data(2048)
+        self.assertEqual(block.shape, (4, 2048))
+        for i, channel in enumerate(provider.channels):
+            self.assertEqual(channel.i_filled, bank.i_filled)
+            num.testing.assert_array_equal(
+                block[i], channel.latest_frame_data(2048))
+            num.testing.assert_array_equal(
+                channel.latest_raw_data(2048), data[-2048:, i])
+            self.assertTrue(channel.data.base is bank._mirror)
+
+        num.testing.assert_array_equal(block[2], data[-2048:, 2]*2.)
+
+        worker = Worker(provider.channels)
+        worker.process()
+        for channel in provider.channels:
+            self.assertEqual(channel.n_pending_hops, 0)
+            self.assertEqual(channel.fft.i_filled, channel.i_filled // 256)
+
+    def test_flush_timestamps(self):
+        nchannels = 2
+        chunksize = 441
+        sampling_rate = 44100
+        provider = make_provider(nchannels, capture_seconds=0.05)
+        ring = provider.capture_ring
+        chunk = num.zeros(chunksize*nchannels, dtype=num.int16)
+
+        t0 = 100.
+        nchunks = 32
+        for ichunk in range(nchunks):
+            t = t0 + ichunk*chunksize/float(sampling_rate)
+            if not ring.write(chunk, t=t):
+                # ring full: the chunk is lost
+                provider.flush()
+
+        provider.flush()
+        for channel in provider.channels:
+            index = channel.time_index
+            isamples, durations = index.gaps()
+            self.assertEqual(len(isamples), 5)
+            self.assertEqual(channel.i_filled, (nchunks-5)*chunksize)
+            num.testing.assert_array_almost_equal(
+                durations, chunksize/float(sampling_rate))
+            # the last sample's time accounts for all dropped chunks
+            self.assertAlmostEqual(
+                channel.latest_times(1)[0],
+                t0 + (nchunks*chunksize-1)/float(sampling_rate))
+
+        # analysis frames carry the capture times of their hops
+        worker = Worker(provider.channels)
+        worker.process()
+        for channel in provider.channels:
+            pitch = channel.pitch
+            self.assertTrue(pitch.anchored)
+            self.assertAlmostEqual(
+                pitch.t_latest,
+                channel.time_index.time_at(channel.i_analysed-1))
+            steps = num.diff(pitch.xaxis(0, pitch.i_filled))
+            self.assertAlmostEqual(steps.min(), pitch.delta)
+            self.assertAlmostEqual(
+                steps.sum(), pitch.delta*(pitch.i_filled-1) +
+                5*chunksize/float(sampling_rate))
+            x, y = pitch.slice_time(pitch.t_latest - 0.1, pitch.t_latest)
+            self.assertAlmostEqual(x[-1], pitch.t_latest)
+
+    def test_recording(self):
+        nchannels = 4
+        chunksize = 512
+        provider = make_provider(nchannels)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        fn = os.path.join(tempdir.name, 'test.wav')
+
+        data = (num.arange(chunksize*nchannels*300) % 30000).astype(
+            num.int16).reshape(-1, nchannels)
+        provider.start_recording(fn)
+        for i in range(0, 300, 3):
+            for ichunk in range(i, i+3):
+                provider.capture_ring.write(
+                    data[ichunk*chunksize: (ichunk+1)*chunksize])
+            provider.flush()
+        recorder = provider.recorder
+        provider.stop_recording()
+        # a late block is dropped, it would follow the end marker
+        self.assertFalse(recorder.put(data[:chunksize]))
+
+        sampling_rate, recorded = wavfile.read(fn)
+        self.assertEqual(sampling_rate, 44100)
+        num.testing.assert_array_equal(recorded, data)
+
+    def test_recording_rf64(self):
+        nchannels = 3
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        fn = os.path.join(tempdir.name, 'test.wav')
+        data = (num.arange(3000*nchannels) % 30000).astype(
+            num.int16).reshape(-1, nchannels)
+        with open(fn, 'wb') as f:
+            writer = WavWriter(f, nchannels, 44100)
+            # pretend the 4 GiB limit was passed
+            writer.riff_limit = 1000
+            writer.write(data.tobytes())
+            writer.close()
+
+        with open(fn, 'rb') as f:
+            self.assertEqual(f.read(4), b'RF64')
+        sampling_rate, recorded = wavfile.read(fn)
+        self.assertEqual(sampling_rate, 44100)
+        num.testing.assert_array_equal(recorded, data)
+
+    def test_recording_error(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        fn = os.path.join(tempdir.name, 'test.wav')
+        recorder = WavRecorder(fn, 2, 44100, max_queue_blocks=4)
+        recorder.start()
+        self.assertTrue(recorder.put(num.zeros((10, 2))))
+        # a block the writer cannot handle kills it
+        recorder.queue.put(object())
+        recorder._thread.join(2.)
+        self.assertFalse(recorder._thread.is_alive())
+        self.assertTrue(recorder.error is not None)
+        self.assertFalse(recorder.put(num.zeros((10, 2))))
+        for i in range(4):
+            recorder.queue.put_nowait(num.zeros((10, 2)))
+
+        # stop must not hang on the full queue
+        recorder.stop(timeout=0.1)
+        self.assertFalse(recorder.is_recording)
+        sampling_rate, recorded = wavfile.read(fn)
+        self.assertEqual(recorded.shape, (10, 2))
+
+    def test_benchmark_flush(self):
+        chunksize = 512
+        nchunks = 5     # ~58 ms backlog at 44.1 kHz
+        ntimes = 50
+        for bank in (False, True):
+            for nchannels in (2, 8, 32):
+                provider = make_provider(nchannels, bank=bank)
+                chunk = num.zeros(chunksize*nchannels, dtype=num.int16)
+                tdrain = 0.
+                for i in range(ntimes):
+                    for ichunk in range(nchunks):
+                        provider.capture_ring.write(chunk)
+                    t0 = time.time()
+                    provider.flush()
+                    tdrain += time.time() - t0
+
+                print('flush %2i channels%s: %.3f ms/tick' % (
+                    nchannels, ' (bank)' if bank else '',
+                    tdrain/ntimes*1000.))
+
+    def test_worker_hops(self):
+        sampling_rate = 8000
+        t = num.arange(sampling_rate*3) / float(sampling_rate)
+        signal = (8000.*num.sin(2.*num.pi*440.*t)).astype(num.int16)
+        rng = num.random.RandomState(0)
+
+        results = []
+        for regular in (True, False):
+            channel = Channel(sampling_rate, fftsize=1024, hopsize=200,
+                              buffer_length_seconds=5)
+            worker = Worker([channel])
+            i = 0
+            while i < len(signal):
+                n = 100 if regular else rng.randint(1, 3000)
+                channel.append(signal[i: i+n])
+                worker.process()
+                i += n
+
+            self.assertEqual(channel.analysis_rate, 40.)
+            self.assertEqual(channel.n_pending_hops, 0)
+            self.assertEqual(channel.pitch.i_filled, len(signal) // 200)
+            self.assertEqual(channel.fft.i_filled, len(signal) // 200)
+            x, y = channel.pitch.latest_frame(1.)
+            self.assertAlmostEqual(
+                x[-1], channel.i_analysed / float(sampling_rate))
+            results.append((channel.fft.latest_frame_data(100),
+                            channel.pitch.latest_frame_data(100)))
+
+        num.testing.assert_array_equal(results[0][0], results[1][0])
+        num.testing.assert_array_equal(results[0][1], results[1][1])
+        num.testing.assert_allclose(
+            channel.undo_pitch_proxy(results[0][1]), 440., rtol=0.01)
+
+        # overrun: hops whose samples are gone are skipped, the history
+        # keeps its frame rate
+        channel = Channel(sampling_rate, fftsize=1024, hopsize=200,
+                          buffer_length_seconds=1)
+        channel.pitch_algorithm = 'yin'
+        worker = Worker([channel])
+        channel.append(signal)
+        worker.process()
+        self.assertEqual(channel.pitch.i_filled, len(signal) // 200)
+        self.assertEqual(channel.pitch_confidence.latest_frame_data(
+            channel.pitch.data_len)[0], 0.)
+        self.assertTrue(channel.pitch_confidence.latest_frame_data(1)[0] > 0.8)
+
+    def test_analysis_thread(self):
+        provider = SyntheticProvider(nchannels=4, seed=0, fftsize=2048)
+        worker = Worker(provider.channels)
+        analysis = AnalysisThread(provider, worker)
+        provider.start_new_stream()
+        analysis.start()
+
+        # the reading thread is busy "drawing" while analysis keeps up
+        t_start = time.time()
+        nread = 0
+        while time.time() - t_start < 0.6:
+            t0 = time.time()
+            while time.time() - t0 < 0.1:
+                pass
+
+            for channel in provider.channels:
+                i_filled, spectra = channel.fft.snapshot(5)
+                self.assertEqual(spectra.shape, (5, channel.freqs.size))
+                nread += 1
+
+        analysis.stop()
+        provider.stop()
+        self.assertFalse(analysis.is_alive())
+        self.assertTrue(analysis.n_passes > 10)
+        for channel in provider.channels:
+            self.assertEqual(channel.n_pending_hops, 0)
+            self.assertTrue(channel.i_filled > 0.5*provider.sampling_rate)
+            self.assertEqual(channel.pitch.i_filled,
+                             channel.i_filled // channel.hopsize)
+
+    def test_worker_power_spectra(self):
+        rng = num.random.RandomState(0)
+        worker = Worker([])
+        for fftsize in (512, 2048):
+            frames = rng.uniform(-3e4, 3e4, size=(5, fftsize)).astype(
+                num.float32)
+            power = worker.power_spectra(frames)
+            self.assertTrue(
+                power.base is worker.power_spectra(frames).base)
+            for frame, p in zip(frames, power):
+                reference = num.abs(num.fft.rfft(
+                    frame * num.hanning(fftsize)))**2 / fftsize
+                num.testing.assert_allclose(
+                    p, reference, rtol=1e-3, atol=reference.max()*1e-6)
+
+        self.assertEqual(sorted(worker.windows.keys()), [512, 2048])
+
+    def test_benchmark_worker_spectra(self):
+        fftsize = 4096
+        ntimes = 50
+        rng = num.random.RandomState(0)
+        for nchannels in (2, 8, 32):
+            frames = rng.uniform(-3e4, 3e4, size=(nchannels, fftsize)).astype(
+                num.float32)
+            t0 = time.time()
+            for i in range(ntimes):
+                for frame in frames:
+                    num.abs(num.fft.rfft(
+                        frame * num.hanning(fftsize)))**2 / fftsize
+            tloop = (time.time() - t0) / ntimes
+
+            worker = Worker([])
+            t0 = time.time()
+            for i in range(ntimes):
+                worker.power_spectra(frames)
+            tbatch = (time.time() - t0) / ntimes
+
+            print('spectra %2i channels: per channel %.3f ms, '
+                  'batched %.3f ms' % (nchannels, tloop*1e3, tbatch*1e3))
+
+    def make_wav(self, nchannels, seconds, sampling_rate=44100):
+        t = num.arange(int(seconds*sampling_rate)) / float(sampling_rate)
+        data = num.empty((len(t), nchannels), dtype=num.int16)
+        for i in range(nchannels):
+            data[:, i] = 10000. * num.sin(2.*num.pi*110.*(i+1)*t)
+
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        fn = os.path.join(tempdir.name, 'test.wav')
+        wavfile.write(fn, sampling_rate, data)
+        return fn, data
+
+    def test_wavfile_unthrottled(self):
+        fn, data = self.make_wav(nchannels=2, seconds=1.)
+        provider = WavFileProvider(fn, fftsize=1024, realtime=False)
+        provider.start_new_stream()
+        nflush = 0
+        while not provider.exhausted:
+            provider.flush()
+            nflush += 1
+
+        self.assertEqual(nflush, int(num.ceil(len(data)/1024.)))
+        for i, channel in enumerate(provider.channels):
+            num.testing.assert_array_equal(
+                channel.latest_frame_data(len(data)), data[:, i])
+
+    def test_wavfile_realtime(self):
+        fn, data = self.make_wav(nchannels=1, seconds=1.)
+        provider = WavFileProvider(fn, fftsize=1024, realtime=True)
+        provider.start_new_stream()
+        time.sleep(0.2)
+        provider.flush()
+        self.assertTrue(0.15 < provider.t_read < 0.5)
+
+        provider.stop()
+        i_read = provider.i_read
+        provider.flush()
+        self.assertEqual(provider.i_read, i_read)
+
+    def test_benchmark_wavfile_throughput(self):
+        seconds = 5.
+        for nchannels in (1, 4):
+            fn, data = self.make_wav(nchannels=nchannels, seconds=seconds)
+            provider = WavFileProvider(fn, fftsize=2048, realtime=False)
+            worker = Worker(provider.channels)
+            provider.start_new_stream()
+            t0 = time.time()
+            while not provider.exhausted:
+                provider.flush()
+                worker.process()
+
+            print('wav %i channels: %.1f x realtime' % (
+                nchannels, seconds / (time.time()-t0)))
+
+    def test_synthetic_deterministic(self):
+        frames = []
+        for i in range(2):
+            provider = SyntheticProvider(
+                nchannels=3, seed=7, duration=2., realtime=False)
+            provider.start_new_stream()
+            while not provider.exhausted:
+                provider.flush()
+            frames.append(num.array(
+                [c.latest_frame_data(provider.nframes) for c in
+                 provider.channels]))
+
+        num.testing.assert_array_equal(frames[0], frames[1])
+        self.assertFalse(num.all(frames[0][0] == frames[0][1]))
+
+        signal = VoiceGenerator(44100, seed=1).generate(44100*5)
+        self.assertTrue(num.abs(signal).max() < 32768)
+        self.assertTrue(num.std(signal) > 100.)
+
+    def test_benchmark_synthetic(self):
+        for nchannels in (8, 64):
+            provider = SyntheticProvider(
+                nchannels=nchannels, seed=0, duration=1., realtime=False,
+                frames_per_flush=4096)
+            provider.start_new_stream()
+            t0 = time.time()
+            while not provider.exhausted:
+                provider.flush()
+
+            print('synthetic %2i channels: %.1f x realtime' % (
+                nchannels, 1. / (time.time()-t0)))
+
+
+if __name__=='__main__':
+    unittest.main()
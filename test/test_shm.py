@@ -0,0 +1,83 @@
+import numpy as num
+import unittest
+import time
+import multiprocessing
+from pytch.shm import SharedCaptureRing, SharedMemoryProvider, RUN, STOP
+
+
+def wait_until(condition, timeout=10.):
+    tmax = time.time() + timeout
+    while not condition():
+        if time.time() > tmax:
+            raise AssertionError('timed out')
+
+        time.sleep(0.001)
+
+
+def fake_capture(name, chunks):
+    ''' Stand-in for the capture process writing *chunks* once running.'''
+    ring = SharedCaptureRing.attach(name)
+    try:
+        wait_until(lambda: ring.state == RUN)
+        for chunk in chunks:
+            wait_until(lambda: ring.write(chunk))
+    finally:
+        ring.close()
+
+
+class SharedMemoryTestCase(unittest.TestCase):
+
+    def test_shared_provider(self):
+        nchannels = 2
+        chunksize = 512
+        ring = SharedCaptureRing(
+            nchannels=nchannels, nframes=chunksize*8, sampling_rate=44100)
+        data = (num.arange(chunksize*nchannels*40) % 30000).astype(
+            num.int16).reshape(-1, nchannels)
+        chunks = [data[i*chunksize: (i+1)*chunksize] for i in range(40)]
+
+        provider = SharedMemoryProvider(name=ring.name, fftsize=1024)
+        self.assertEqual(provider.sampling_rate, 44100)
+        self.assertEqual(provider.nchannels, nchannels)
+
+        process = multiprocessing.Process(
+            target=fake_capture, args=(ring.name, chunks))
+        process.start()
+        provider.start_new_stream()
+
+        def read_all():
+            provider.flush()
+            return provider.capture_ring.read_cursor >= len(data)
+
+        wait_until(read_all)
+        process.join(10.)
+        self.assertEqual(process.exitcode, 0)
+        for i, channel in enumerate(provider.channels):
+            num.testing.assert_array_equal(
+                channel.latest_frame_data(len(data)), data[:, i])
+
+        provider.terminate()
+        ring.state = STOP
+        ring.close()
+        ring.unlink()
+
+    def test_capture_process_failure(self):
+        ring = SharedCaptureRing(nchannels=1, nframes=512, sampling_rate=44100)
+        provider = SharedMemoryProvider(name=ring.name, fftsize=1024)
+        # e.g. a capture process which could not open its device
+        provider.process = multiprocessing.Process(target=time.sleep,
+                                                   args=(0., ))
+        provider.process.start()
+        provider.process.join()
+        self.assertFalse(provider.capture_alive)
+        provider.flush()
+        self.assertTrue(provider.capture_failed)
+
+        provider.process = None
+        provider.terminate()
+        ring.close()
+        ring.unlink()
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import numpy as num
+import unittest
+import time
+from numpy.lib.stride_tricks import sliding_window_view
+from pytch.data import Channel, make_pitch_detector
+from pytch.two_channel_tuner import Worker
+from pytch.yin import yin, YinDetector
+
+
+def make_voices(nchannels, n, sampling_rate=44100, seed=0):
+    ''' Harmonic signals with random, constant pitches plus noise.'''
+    rng = num.random.RandomState(seed)
+    f0 = num.exp(rng.uniform(num.log(80.), num.log(800.), size=nchannels))
+    t = num.arange(n) / float(sampling_rate)
+    k = num.arange(1, 9)[:, num.newaxis]
+    signals = num.empty((nchannels, n), dtype=num.float32)
+    for signal, f in zip(signals, f0):
+        phases = rng.uniform(0., 2.*num.pi, size=(8, 1))
+        signal[:] = 8000. * num.sum(
+            k**-1.5 * num.sin(2.*num.pi*f*k*t + phases), axis=0)
+
+    signals += rng.normal(0., 100., size=signals.shape)
+    return signals, f0
+
+
+def cents(pitch, f0):
+    return 1200. * num.log2(num.maximum(pitch, 1e-3) / f0)
+
+
+class YinTestCase(unittest.TestCase):
+
+    def test_yin(self):
+        sampling_rate = 44100
+        fftsize = 2048
+        hopsize = 512
+        signals, f0 = make_voices(6, fftsize + 19*hopsize)
+        frames = sliding_window_view(signals, fftsize, axis=1)[:, ::hopsize]
+        pitch, confidence = yin(frames, sampling_rate)
+        self.assertEqual(pitch.shape, (6, 20))
+        self.assertEqual(pitch.dtype, num.float32)
+        self.assertTrue(num.all(num.abs(cents(pitch, f0[:, num.newaxis])) < 5.))
+        self.assertTrue(num.all(confidence > 0.9))
+
+        # single windows and streaming give the same estimates
+        p, c = yin(frames[2, 7], sampling_rate)
+        self.assertAlmostEqual(p, pitch[2, 7], places=3)
+        detector = YinDetector(fftsize, hopsize, sampling_rate)
+        for hop in signals[2, :fftsize + 7*hopsize].reshape(-1, hopsize):
+            p = detector(hop)
+        self.assertAlmostEqual(p[0], pitch[2, 7], places=3)
+        self.assertAlmostEqual(detector.get_confidence(), confidence[2, 7],
+                               places=5)
+
+        # search range and silence
+        p, c = yin(frames, sampling_rate, fmin=200., fmax=300.)
+        self.assertTrue(num.all((p > 190.) & (p < 310.)))
+        p, c = yin(num.zeros((3, fftsize)), sampling_rate)
+        num.testing.assert_array_equal(p, 0.)
+        num.testing.assert_array_equal(c, 0.)
+
+    def test_worker_numpy_yin(self):
+        sampling_rate = 44100
+        signals, f0 = make_voices(3, sampling_rate)
+        channels = [Channel(sampling_rate, fftsize=2048, dtype=num.float32)
+                    for i in range(3)]
+        for channel in channels:
+            channel.pitch_algorithm = 'numpy-yin'
+
+        worker = Worker(channels)
+        for i in range(0, sampling_rate, 5000):
+            for channel, signal in zip(channels, signals):
+                channel.append(signal[i: i+5000])
+            worker.process()
+
+        for channel, f in zip(channels, f0):
+            self.assertEqual(channel.n_pending_hops, 0)
+            pitch = channel.undo_pitch_proxy(
+                channel.pitch.latest_frame_data(50))
+            self.assertTrue(num.all(num.abs(cents(pitch, f)) < 5.))
+
+    def test_benchmark_yin(self):
+        sampling_rate = 44100
+        fftsize = 2048
+        hopsize = 512
+        nframes = 100
+        for nchannels in (1, 16):
+            signals, f0 = make_voices(
+                nchannels, fftsize + (nframes-1)*hopsize)
+            frames = sliding_window_view(
+                signals, fftsize, axis=1)[:, ::hopsize]
+
+            t0 = time.time()
+            pitch, confidence = yin(frames, sampling_rate)
+            tnumpy = time.time() - t0
+
+            f0 = f0[:, num.newaxis]
+            print('%2i channels x %i frames: numpy-yin %.1f ms, median '
+                  'error %.2f cents' % (
+                      nchannels, nframes, tnumpy*1e3,
+                      num.median(num.abs(cents(pitch, f0)))))
+
+            for algorithm in ('yinfft', 'yin'):
+                t0 = time.time()
+                pitch_aubio = num.empty((nchannels, nframes))
+                for channel_frames, p in zip(frames, pitch_aubio):
+                    # a hop size of fftsize makes aubio take whole windows
+                    pitch_o = make_pitch_detector(
+                        algorithm, fftsize, fftsize, sampling_rate)
+                    for i, frame in enumerate(channel_frames):
+                        p[i] = pitch_o(num.ascontiguousarray(frame))[0]
+                taubio = time.time() - t0
+
+                print('%2i channels x %i frames: aubio %s %.1f ms, median '
+                      'error %.2f cents' % (
+                          nchannels, nframes, algorithm, taubio*1e3,
+                          num.median(num.abs(cents(pitch_aubio, f0)))))
+
+if __name__=='__main__':
+    unittest.main()